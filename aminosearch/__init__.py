@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 
-from .exceptions import PubtatorDBError
+from .exceptions import PubtatorDBError, ClinVarDBError
 from .pubtatordb import PubtatorDB
 from .clinvardb import ClinVarAminoDB
 
@@ -0,0 +1,260 @@
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import logging
+import time
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from .config import POOL_SIZE, POOL_MAX_AGE, POOL_TIMEOUT, POSITION_WINDOW
+from .exceptions import PubtatorDBError, PoolTimeout
+from .instrument import fire_query_hooks
+from .pubtatordb import PubtatorQueries
+from .clinvardb import ClinVarQueries
+from .sqldata import DEFAULT_HOST, DEFAULT_USER, DEFAULT_PASS, DEFAULT_NAME
+
+log = logging.getLogger('pubtatordb.async')
+
+# (event loop, host, db, user) -> future resolving to an aiomysql pool.  aiomysql pools belong to
+# the event loop they were created in, so each loop gets its own (and pools of closed loops, e.g.
+# from earlier asyncio.run() calls, are dropped).
+_pools = {}
+
+
+async def get_async_pool(host, db, user, create_func):
+    """ Returns the aiomysql pool for (host, db, user) in the running event loop, creating it
+    with create_func (a coroutine function taking no arguments) if needed.
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, host, db, user)
+    if key not in _pools:
+        for stale in [stale for stale in _pools if stale[0].is_closed()]:
+            del _pools[stale]
+        _pools[key] = loop.create_task(create_func())
+    try:
+        return await _pools[key]
+    except Exception:
+        _pools.pop(key, None)
+        raise
+
+
+class AsyncSQLData(object):
+    """ asyncio counterpart of SQLData over aiomysql (pip install aiomysql): the same query methods
+    (fetchall, fetchrow, fetchID, results2set, execute, insert, iterate), as coroutines.
+
+    Connections come from an aiomysql pool shared by every AsyncSQLData object using the same
+    (host, db, user) in the running event loop, sized like SQLData's pool (POOL_SIZE, POOL_MAX_AGE,
+    POOL_TIMEOUT).  Connections are in autocommit mode, so each execute() is committed on its own;
+    bulk loading (batch_insert, transaction) stays with SQLData.
+
+    Example:
+        db = AsyncPubtatorDB()
+        rows = await db.fetchall('select * from m2p_SUB where Pos=%s', 151)
+    """
+
+    def __init__(self, *args, **kwargs):
+        if aiomysql is None:
+            raise ImportError('AsyncSQLData requires aiomysql (pip install aiomysql)')
+        self._db_host = kwargs.get('host', None) or DEFAULT_HOST
+        self._db_user = kwargs.get('user', None) or DEFAULT_USER
+        self._db_pass = kwargs.get('pass', None) or DEFAULT_PASS
+        self._db_name = kwargs.get('name', None) or DEFAULT_NAME
+
+    async def create_pool(self):
+        """ Opens and returns a new aiomysql pool.  (Used by pool(); don't call directly.) """
+        return await aiomysql.create_pool(password=self._db_pass,
+                                          user=self._db_user,
+                                          db=self._db_name,
+                                          host=self._db_host,
+                                          charset='utf8',
+                                          use_unicode=True,
+                                          autocommit=True,
+                                          maxsize=POOL_SIZE,
+                                          pool_recycle=POOL_MAX_AGE if POOL_MAX_AGE is not None else -1,
+                                          )
+
+    async def pool(self):
+        return await get_async_pool(self._db_host, self._db_name, self._db_user, self.create_pool)
+
+    async def _acquire(self, pool):
+        try:
+            return await asyncio.wait_for(pool.acquire(), POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout('%s@%s/%s: no connection available after %is' % (self._db_user, self._db_host,
+                                                                             self._db_name, POOL_TIMEOUT))
+
+    async def _run(self, sql, args, fetch=True):
+        """ Runs sql on a pooled connection and returns (rows or None, closed cursor). """
+        pool = await self.pool()
+        conn = await self._acquire(pool)
+        try:
+            cursor = await conn.cursor(aiomysql.DictCursor)
+            try:
+                start = time.time()
+                await cursor.execute(sql, args or None)
+                rows = await cursor.fetchall() if fetch else None
+                fire_query_hooks(sql, args, (time.time() - start) * 1000, cursor.rowcount, 'async', self._db_name)
+            finally:
+                await cursor.close()
+        finally:
+            pool.release(conn)
+        return rows, cursor
+
+    async def fetchall(self, select_sql, *args):
+        """ Coroutine version of SQLData.fetchall: returns results as a list of dictionaries. """
+        rows, _ = await self._run(select_sql, args)
+        return list(rows)
+
+    async def fetchrow(self, select_sql, *args):
+        res = await self.fetchall(select_sql, *args)
+        return res[0] if len(res) > 0 else None
+
+    async def fetchID(self, select_sql, *args, **kwargs):
+        id_colname = kwargs.get('id_colname', 'ID')
+        try:
+            return (await self.fetchrow(select_sql, *args))[id_colname]
+        except TypeError:
+            return None
+
+    async def results2set(self, select_sql, col, *args):
+        return set(str(row[col]) for row in await self.fetchall(select_sql, *args))
+
+    async def iterate(self, select_sql, *args, **kwargs):
+        """ Async generator version of SQLData.iterate: streams rows from an unbuffered server-side
+        cursor, batch_size rows at a time.
+
+        Example:
+            async for row in db.iterate('select * from mutation2pubtator', batch_size=10000):
+                ...
+
+        Keywords:
+            batch_size (int): number of rows fetched from the server per round trip [default: 1000]
+        """
+        batch_size = kwargs.get('batch_size', 1000)
+
+        pool = await self.pool()
+        conn = await self._acquire(pool)
+        finished = False
+        try:
+            cursor = await conn.cursor(aiomysql.SSDictCursor)
+            start = time.time()
+            await cursor.execute(select_sql, args or None)
+            count = 0
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+            await cursor.close()
+            finished = True
+            fire_query_hooks(select_sql, args, (time.time() - start) * 1000, count, 'async-iterate', self._db_name)
+        finally:
+            if not finished:
+                # unread rows would have to be drained from the server first; just drop the connection.
+                conn.close()
+            pool.release(conn)
+
+    async def execute(self, sql, *args):
+        """ Coroutine version of SQLData.execute.
+
+        :return: closed aiomysql cursor (for lastrowid / rowcount)
+        """
+        _, cursor = await self._run(sql, args, fetch=False)
+        return cursor
+
+    async def insert(self, tablename, field_value_dict, None_as_null=False):
+        """ Coroutine version of SQLData.insert.
+
+        :return row_id: (integer)
+        """
+        fields = [key for key, val in field_value_dict.items() if val is not None or None_as_null]
+        sql = 'insert into %s (%s) values (%s)' % (tablename, ','.join(fields), ','.join(['%s' for _ in fields]))
+        cursor = await self.execute(sql, *[field_value_dict[field] for field in fields])
+        return cursor.lastrowid
+
+
+class AsyncPubtatorDB(PubtatorQueries, AsyncSQLData):
+    """ PubtatorDB search methods as coroutines. """
+
+    async def check_gene_table(self):
+        """ Coroutine version of PubtatorDB.check_gene_table. """
+        if getattr(self, '_gene_table_checked', False):
+            return
+        row = await self.fetchrow('select count(*) as found from information_schema.TABLES where TABLE_SCHEMA=%s '
+                                  'and TABLE_NAME=%s', self._db_name, self.GENE_TABLE)
+        self.gene_table = self.GENE_TABLE if row['found'] else None
+        self._gene_table_checked = True
+
+    async def _fetchall_or_raise_pubtatordberror(self, sql, comp, *args):
+        try:
+            return await self.fetchall(sql, *args)
+        except aiomysql.ProgrammingError as error:
+            # attempt to lookup an edittype that we don't currently handle (e.g. EXT, INV)
+            raise PubtatorDBError('EditType %s currently not handled. (%r)' % (comp.edittype, error))
+
+    async def search_FS(self, comp, gene_id, strict=False):
+        await self.check_gene_table()
+        sql, args = self.search_FS_query(comp, gene_id, strict)
+        return await self.fetchall(sql, *args)
+
+    async def search_m2p(self, comp, gene_id, strict=False):
+        await self.check_gene_table()
+        sql, args = self.search_m2p_query(comp, gene_id, strict)
+        return await self._fetchall_or_raise_pubtatordberror(sql, comp, *args)
+
+    async def search_proteins(self, comp, gene_id, strict=False):
+        await self.check_gene_table()
+        sql, args = self.search_proteins_query(comp, gene_id, strict)
+        return await self._fetchall_or_raise_pubtatordberror(sql, comp, *args)
+
+    async def search_many(self, components_list, gene_id, strict=False):
+        """ Coroutine version of PubtatorDB.search_many; the statements (one per m2p table) run concurrently. """
+        await self.check_gene_table()
+        keys = [self.search_key(comp, gene_id, strict) for comp in components_list]
+        queries = list(self.search_many_queries(keys, gene_id))
+        fetched = await asyncio.gather(*[self.fetchall(sql, *args) for _, _, sql, args in queries],
+                                       return_exceptions=True)
+        results = []
+        for (tablename, columns, _, _), rows in zip(queries, fetched):
+            if isinstance(rows, aiomysql.ProgrammingError):
+                log.info('search_many: cannot search %s (%r)', tablename, rows)
+                continue
+            if isinstance(rows, BaseException):
+                raise rows
+            results.append((tablename, columns, rows))
+        return self.map_search_many(keys, results)
+
+    async def search_window(self, comp, gene_id, window=POSITION_WINDOW):
+        await self.check_gene_table()
+        sql, args = self.search_window_query(comp, gene_id, window)
+        return await self.fetchall(sql, *args)
+
+
+class AsyncClinVarAminoDB(ClinVarQueries, AsyncSQLData):
+    """ ClinVarAminoDB search methods as coroutines. """
+
+    def __init__(self, *args, **kwargs):
+        kwargs['name'] = 'clinvar'
+        super().__init__(*args, **kwargs)
+
+    async def search_clinvar_strict(self, comp, gene_id):
+        sql, args = self.search_clinvar_strict_query(comp, gene_id)
+        return await self.fetchall(sql, *args)
+
+    async def search_clinvar_loose(self, comp, gene_id):
+        sql, args = self.search_clinvar_loose_query(comp, gene_id)
+        return await self.fetchall(sql, *args)
+
+    async def search(self, comp, gene_id, strict=False):
+        if strict:
+            return await self.search_clinvar_strict(comp, gene_id)
+        return await self.search_clinvar_loose(comp, gene_id)
+
+    async def search_window(self, comp, gene_id, window=POSITION_WINDOW):
+        sql, args = self.search_clinvar_window_query(comp, gene_id, window)
+        return await self.fetchall(sql, *args)
@@ -2,13 +2,70 @@
 #from medgen.db.dataset import SQLData
 
 from .sqldata import SQLData
+from .exceptions import ClinVarDBError
+from .positions import parse_position
+from .config import POSITION_WINDOW
 
-class ClinVarAminoDB(SQLData):
+
+class ClinVarQueries(object):
+    """ Builds the (sql, args) for each ClinVarAminoDB search, shared by ClinVarAminoDB and
+    AsyncClinVarAminoDB (see asyncdb.py).
+    """
+
+    def search_clinvar_strict_query(self, comp, gene_id):
+        if gene_id:
+            sql = 'select * from clinvar.t2g_hgvs_components where GeneID=%s and Ref=%s and Alt=%s and Pos=%s'
+            args = (gene_id, comp.ref, comp.alt, comp.pos)
+        else:
+            sql = 'select * from clinvar.t2g_hgvs_components where Ref=%s and Alt=%s and Pos=%s'
+            args = (comp.ref, comp.alt, comp.pos)
+        return sql, args
+
+    def search_clinvar_loose_query(self, comp, gene_id):
+        if gene_id:
+            sql = 'select * from clinvar.t2g_hgvs_components where GeneID=%s and Ref=%s and Pos=%s'
+            args = (gene_id, comp.ref, comp.pos)
+        else:
+            sql = 'select * from clinvar.t2g_hgvs_components where Ref=%s and Pos=%s'
+            args = (comp.ref, comp.pos)
+        return sql, args
+
+
+    def search_clinvar_window_query(self, comp, gene_id, window=POSITION_WINDOW):
+        """ Builds the search for ClinVar variants on the same seqtype within `window` positions of comp's
+        start position (a range scan of GeneID_Pos_Ref_Alt, or of SeqType_Pos without a gene_id).
+        """
+        start = parse_position(comp.pos)[0]
+        if start is None:
+            raise ClinVarDBError('Position %s has no numeric start; cannot search around it.' % comp.pos)
+        if gene_id:
+            sql = 'select * from clinvar.t2g_hgvs_components where GeneID=%s and SeqType=%s and Pos between %s and %s'
+            args = (gene_id, comp.seqtype, start - window, start + window)
+        else:
+            sql = 'select * from clinvar.t2g_hgvs_components where SeqType=%s and Pos between %s and %s'
+            args = (comp.seqtype, start - window, start + window)
+        return sql, args
+
+
+class ClinVarAminoDB(ClinVarQueries, SQLData):
+
+    # composite index for the searches with a GeneID (see add_indexes).
+    COMPONENTS_INDEX = ('GeneID_Pos_Ref_Alt', 'GeneID, Pos, Ref, Alt')
+    # range index for window searches without a GeneID (see search_window).
+    POSITION_INDEX = ('SeqType_Pos', 'SeqType, Pos')
 
     def __init__(self, *args, **kwargs):
         kwargs['name'] = 'clinvar'
         super().__init__(*args, **kwargs)
 
+    def add_indexes(self):
+        """ Adds COMPONENTS_INDEX and POSITION_INDEX to t2g_hgvs_components if they aren't there yet.
+
+        :return: list of names of the indexes that were added
+        """
+        return [name for name, columns in (self.COMPONENTS_INDEX, self.POSITION_INDEX)
+                if self.add_index('t2g_hgvs_components', name, columns)]
+
     def _fetchall_or_raise_exception(self, sql, comp, *args):
         try:
             return self.fetchall(sql, *args)
@@ -17,21 +74,11 @@ class ClinVarAminoDB(SQLData):
             raise Exception('EditType %s currently not handled. (%r)' % (comp.edittype, error))
 
     def search_clinvar_strict(self, comp, gene_id):
-        if gene_id:
-            sql = 'select * from clinvar.t2g_hgvs_components where GeneID=%s and Ref=%s and Alt=%s and Pos=%s'
-            args = (gene_id, comp.ref, comp.alt, comp.pos)
-        else:
-            sql = 'select * from clinvar.t2g_hgvs_components where Ref=%s and Alt=%s and Pos=%s'
-            args = (comp.ref, comp.alt, comp.pos)
+        sql, args = self.search_clinvar_strict_query(comp, gene_id)
         return self.fetchall(sql, *args)
 
     def search_clinvar_loose(self, comp, gene_id):
-        if gene_id:
-            sql = 'select * from clinvar.t2g_hgvs_components where GeneID=%s and Ref=%s and Pos=%s'
-            args = (gene_id, comp.ref, comp.pos)
-        else:
-            sql = 'select * from clinvar.t2g_hgvs_components where Ref=%s and Pos=%s'
-            args = (comp.ref, comp.pos)
+        sql, args = self.search_clinvar_loose_query(comp, gene_id)
         return self.fetchall(sql, *args)
 
     def search(self, comp, gene_id, strict=False):
@@ -42,3 +89,13 @@ class ClinVarAminoDB(SQLData):
 
         return self._fetchall_or_raise_exception(sql, comp, *args)
 
+    def search_window(self, comp, gene_id, window=POSITION_WINDOW):
+        """ Returns t2g_hgvs_components rows within `window` positions (either side) of comp's position.
+
+        :param comp: VariantComponents object
+        :param gene_id: (int) Gene ID, or None to search without a gene
+        :param window: (int) [default: POSITION_WINDOW]
+        :raises ClinVarDBError: if comp.pos has no numeric start position
+        """
+        sql, args = self.search_clinvar_window_query(comp, gene_id, window)
+        return self.fetchall(sql, *args)
@@ -1,7 +1,44 @@
 PKGNAME = 'pubtatordb'
 DATABASE = { 'host': 'localhost', 'user': 'medgen', 'pass': 'medgen', 'name': 'PubTator' }
 
-SQLDEBUG = True
+# log every statement to sqldata.log (slow; query timings are always kept, see instrument.py).
+SQLDEBUG = False
+
+# instrument.py: statements slower than SLOW_QUERY_MS are written to slowquery.log (a SLOW_QUERY_SAMPLE_RATE
+# fraction of them, with their args cut to SLOW_QUERY_MAX_ARGS_CHARS), and per-statement latency stats are
+# kept for up to QUERY_STATS_MAX_STATEMENTS statements.
+SLOW_QUERY_MS = 500
+SLOW_QUERY_SAMPLE_RATE = 0.2
+SLOW_QUERY_MAX_ARGS_CHARS = 500
+QUERY_STATS_MAX_STATEMENTS = 500
+
+# connection pool (see pool.py): max open connections per (host, db, user) per process,
+# seconds before a connection is recycled, seconds to wait for a free connection, and seconds a connection
+# may sit idle before it is pinged on checkout (well under the server's wait_timeout).
+POOL_SIZE = 10
+POOL_MAX_AGE = 3600
+POOL_TIMEOUT = 30
+POOL_PING_AFTER = 30
+
+# read replicas (hosts with the same user, password and database as DATABASE) that SQLData sends fetchall/fetchrow
+# to, and seconds after a write during which the writing thread keeps reading from the primary (read-your-writes).
+# ETL scripts that read back what they just loaded should pass replicas=[] to SQLData.
+READ_REPLICAS = []
+REPLICA_STICKY_SECONDS = 5
+
+# SQLData.batch_insert: max rows per chunk, and fraction of the server's max_allowed_packet a chunk may use.
+BATCH_MAX_ROWS = 10000
+BATCH_PACKET_FRACTION = 0.5
+
+# PubtatorDB / ClinVarAminoDB search_window: default number of positions either side of the query position.
+POSITION_WINDOW = 10
+
+# M2PIndex (m2pindex.py): longest value (in bytes) stored per field; rows with longer values are left to MySQL.
+M2P_INDEX_MAX_FIELD_BYTES = 48
+
+# GenePrefetch (prefetch.py): max number of genes, and of component rows in all, held in memory.
+GENE_PREFETCH_MAX_GENES = 16
+GENE_PREFETCH_MAX_ROWS = 500000
 
 import logging
 
@@ -18,11 +55,11 @@ def get_process_log(filepath, loglevel=logging.INFO, name=PKGNAME+'-process'):
     return log
 
 
-def get_data_log(filepath, name=PKGNAME+'-data'):
+def get_data_log(filepath, name=PKGNAME+'-data', fmt=''):
     datalog = logging.getLogger(name)
     datalog.setLevel(logging.DEBUG)
     datalog.propagate = False
-    formatter = logging.Formatter('')
+    formatter = logging.Formatter(fmt)
     fh = logging.FileHandler(filepath)
     fh.setFormatter(formatter)
     datalog.addHandler(fh)
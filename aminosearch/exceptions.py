@@ -3,3 +3,10 @@ class ReadOnlyData(Exception):
 
 class PubtatorDBError(Exception):
     pass
+
+class ClinVarDBError(Exception):
+    pass
+
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection becomes available within the pool's timeout. """
+    pass
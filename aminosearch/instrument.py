@@ -0,0 +1,205 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import random
+import re
+import threading
+
+from .config import SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE, SLOW_QUERY_MAX_ARGS_CHARS, QUERY_STATS_MAX_STATEMENTS, \
+    get_data_log
+
+# upper bounds (in milliseconds) of latency histogram buckets; the last bucket catches everything else.
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+log = logging.getLogger('pubtatordb.instrument')
+
+
+class LatencyHistogram(object):
+    """ Fixed-bucket latency histogram (milliseconds) with approximate percentiles. """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or LATENCY_BUCKETS_MS
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        idx = 0
+        while idx < len(self.buckets) and ms > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct):
+        """ Returns the upper bound of the bucket containing the pct-th percentile (or max_ms
+        if it falls in the overflow bucket), or None if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        threshold = self.count * pct / 100.0
+        seen = 0
+        for idx, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= threshold:
+                return self.buckets[idx] if idx < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        buckets = {}
+        for idx, cnt in enumerate(self.counts):
+            label = '<=%i' % self.buckets[idx] if idx < len(self.buckets) else '>%i' % self.buckets[-1]
+            buckets[label] = cnt
+        return {'count': self.count,
+                'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+                'max_ms': round(self.max_ms, 3),
+                'p50_ms': self.percentile(50),
+                'p95_ms': self.percentile(95),
+                'p99_ms': self.percentile(99),
+                'buckets': buckets,
+                }
+
+
+#### Statement normalization
+
+re_whitespace = re.compile(r'\s+')
+re_quoted = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+re_number = re.compile(r'\b\d+(\.\d+)?\b')
+re_value_list = re.compile(r'\(\s*\?(\s*,\s*\?)+\s*\)')
+re_value_rows = re.compile(r'(\(\?\+?\))(\s*,\s*\(\?\+?\))+')
+
+# normalize_sql() results by raw sql (bounded, since raw sql can embed literals).
+_normalized = {}
+NORMALIZED_CACHE_SIZE = 10000
+
+
+def normalize_sql(sql):
+    """ Returns sql with literals and placeholders replaced by "?", IN lists and multi-row VALUES
+    collapsed, and whitespace squeezed, so that executions of the same statement group together.
+
+    Example:
+        normalize_sql('select * from m2p_SUB where Pos=%s and Ref in ("A", "G")')
+        --> 'select * from m2p_SUB where Pos=? and Ref in (?+)'
+    """
+    try:
+        return _normalized[sql]
+    except KeyError:
+        pass
+    norm = re_whitespace.sub(' ', sql).strip()
+    norm = re_quoted.sub('?', norm)
+    norm = re_number.sub('?', norm)
+    norm = norm.replace('%s', '?')
+    norm = re_value_list.sub('(?+)', norm)
+    norm = re_value_rows.sub(r'\1, ...', norm)
+    if len(_normalized) < NORMALIZED_CACHE_SIZE:
+        _normalized[sql] = norm
+    return norm
+
+
+#### Hooks
+
+_hooks = []
+
+
+def add_query_hook(func):
+    """ Registers func to be called as func(event) after every statement run through SQLData, where event
+    is a dictionary with keys: sql, args, statement (normalized sql), ms (wall time), rows, method, db.
+
+    Exceptions raised by func are logged, not passed on to the statement's caller.
+    """
+    if func not in _hooks:
+        _hooks.append(func)
+
+
+def remove_query_hook(func):
+    if func in _hooks:
+        _hooks.remove(func)
+
+
+def query_hooks_active():
+    return bool(_hooks)
+
+
+def fire_query_hooks(sql, args, ms, rows, method, db):
+    if not _hooks:
+        return
+    event = {'sql': sql, 'args': args, 'statement': normalize_sql(sql), 'ms': ms, 'rows': rows,
+             'method': method, 'db': db}
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            # a broken hook mustn't fail the statement (or keep the other hooks from seeing it).
+            log.exception('query hook %r failed', hook)
+
+
+class QueryStats(object):
+    """ Query hook keeping a latency histogram and row count for each normalized statement
+    (at most QUERY_STATS_MAX_STATEMENTS of them; further statements are counted under "(other)").
+    """
+
+    def __init__(self, max_statements=QUERY_STATS_MAX_STATEMENTS):
+        self.max_statements = max_statements
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        statement = event['statement']
+        with self._lock:
+            if statement not in self.statements:
+                if len(self.statements) >= self.max_statements:
+                    statement = '(other)'
+                self.statements.setdefault(statement, {'latency': LatencyHistogram(), 'rows': 0})
+            entry = self.statements[statement]
+            entry['latency'].record(event['ms'])
+            if event['rows'] is not None and event['rows'] > 0:
+                entry['rows'] += event['rows']
+
+    def to_dict(self, top=None):
+        """ Returns dictionary of statement -> stats, optionally only the `top` statements by total time. """
+        with self._lock:
+            items = [(statement, entry['latency'].total_ms, dict(entry['latency'].to_dict(), rows=entry['rows']))
+                     for statement, entry in self.statements.items()]
+        items.sort(key=lambda item: item[1], reverse=True)
+        if top:
+            items = items[:top]
+        return dict((statement, stats) for statement, _, stats in items)
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+
+
+class SlowQueryLog(object):
+    """ Query hook writing statements slower than threshold_ms to slowquery.log (one timestamped,
+    tab-separated line each), sampling sample_rate (0 to 1) of them.  The args are cut to max_args_chars
+    (a multi-row insert's run to megabytes).
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, sample_rate=SLOW_QUERY_SAMPLE_RATE, filepath='slowquery.log',
+                 max_args_chars=SLOW_QUERY_MAX_ARGS_CHARS):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.max_args_chars = max_args_chars
+        self.filepath = filepath
+        self._log = None
+
+    def __call__(self, event):
+        if event['ms'] < self.threshold_ms or random.random() >= self.sample_rate:
+            return
+        if self._log is None:
+            self._log = get_data_log(self.filepath, name='pubtatordb-slowquery', fmt='%(asctime)s\t%(message)s')
+        args = repr(event['args'])
+        if len(args) > self.max_args_chars:
+            args = '%s... (%i args)' % (args[:self.max_args_chars], len(event['args']))
+        self._log.warning('%.1fms\t%s\t%s rows\t%s\t%s\t%s', event['ms'], event['db'], event['rows'],
+                          event['method'], event['statement'], args)
+
+
+query_stats = QueryStats()
+slow_query_log = SlowQueryLog()
+
+add_query_hook(query_stats)
+add_query_hook(slow_query_log)
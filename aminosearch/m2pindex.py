@@ -0,0 +1,229 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .config import log, M2P_INDEX_MAX_FIELD_BYTES
+
+# m2p columns stored in the index (besides GeneID and PMID); Pos and Ref are stored in the sort key.
+STRING_FIELDS = ('EditType', 'SeqType', 'Pos', 'Ref', 'Alt')
+ROW_FIELDS = ('EditType', 'SeqType', 'Alt')
+
+# bit set in a row's "nulls" field for each of its STRING_FIELDS that is NULL (and stored as '').
+NULL_BITS = dict((field, 1 << idx) for idx, field in enumerate(STRING_FIELDS))
+
+# separates Pos from Ref in the sort key (sorts before any printable character, so all the keys for
+# one Pos are contiguous).
+KEY_SEP = b'\x1f'
+
+# every parsed mutation, once per gene it is annotated with (GeneID 0 if none), as searched by PubtatorDB.
+EXPORT_SQL = '''select distinct ifnull(G.GeneID, 0) as GeneID, M.PMID, M.EditType, M.SeqType, M.Pos, M.Ref, M.Alt
+                  from m2p_general M left join gene2pubtator G on G.PMID = M.PMID
+                 where M.EditType != "rs" and M.Pos is not NULL'''
+
+WIDTHS_SQL = '''select max(length(EditType)) as EditType, max(length(SeqType)) as SeqType, max(length(Pos)) as Pos,
+                       max(length(Ref)) as Ref, max(length(Alt)) as Alt
+                  from m2p_general where EditType != "rs"'''
+
+
+def _field_bytes(value):
+    # the m2p columns are case-insensitive, so everything is stored (and compared) lowercased.
+    return ('%s' % (value if value is not None else '')).lower().encode('utf-8')
+
+
+def index_key(pos, ref):
+    return _field_bytes(pos) + KEY_SEP + _field_bytes(ref)
+
+
+def meta_path(path):
+    """ Returns path of the JSON file holding the index's metadata (row count, build time, overflow keys). """
+    return path + '.json'
+
+
+def build_m2p_index(db, path, progress=None, chunk_size=100000):
+    """ Exports the parsed mutations in m2p_general (with their GeneIDs from gene2pubtator) to a NumPy
+    structured array sorted by (Pos, Ref, GeneID), saved at `path` (.npy), for M2PIndex.  NULL values
+    are stored as '' with a bit set in the row's "nulls" field (see NULL_BITS), so they aren't taken for ''.
+
+    Rows with a value longer than M2P_INDEX_MAX_FIELD_BYTES are left out of the array, and their
+    (Pos, Ref) keys listed in the metadata file instead, so that M2PIndex sends searches for those
+    keys to MySQL.  Both files are written to temporary names and renamed into place, so processes
+    with the previous index open keep reading it until they reopen.
+
+    :param db: PubtatorDB object
+    :param path: (str) path of the .npy file to write
+    :param progress: optional function called as progress(rows_read) every chunk_size rows
+    :return: (int) number of rows in the index
+    """
+    if np is None:
+        raise ImportError('build_m2p_index requires numpy (pip install numpy)')
+
+    max_lengths = db.fetchrow(WIDTHS_SQL)
+    widths = dict((field, max(1, min(max_lengths[field] or 0, M2P_INDEX_MAX_FIELD_BYTES))) for field in STRING_FIELDS)
+    dtype = np.dtype([('key', 'S%i' % (widths['Pos'] + len(KEY_SEP) + widths['Ref'])),
+                      ('GeneID', '<u4'),
+                      ('PMID', '<u4'),
+                      ('nulls', 'u1')] + [(field, 'S%i' % widths[field]) for field in ROW_FIELDS])
+
+    chunks = []
+    chunk = np.zeros(chunk_size, dtype=dtype)
+    filled = 0
+    overflow = set()
+    count = 0
+    for row in db.iterate(EXPORT_SQL, batch_size=10000):
+        count += 1
+        if progress and count % chunk_size == 0:
+            progress(count)
+
+        values = dict((field, _field_bytes(row[field])) for field in STRING_FIELDS)
+        if any(len(value) > M2P_INDEX_MAX_FIELD_BYTES for value in values.values()):
+            overflow.add(index_key(row['Pos'], row['Ref']).decode('utf-8'))
+            continue
+
+        nulls = sum(NULL_BITS[field] for field in STRING_FIELDS if row[field] is None)
+        chunk[filled] = ((values['Pos'] + KEY_SEP + values['Ref']), row['GeneID'], row['PMID'], nulls,
+                         values['EditType'], values['SeqType'], values['Alt'])
+        filled += 1
+        if filled == chunk_size:
+            chunks.append(chunk)
+            chunk = np.zeros(chunk_size, dtype=dtype)
+            filled = 0
+    chunks.append(chunk[:filled])
+
+    rows = np.concatenate(chunks)
+    del chunks
+    rows = rows[np.lexsort((rows['GeneID'], rows['key']))]
+
+    with open(meta_path(path) + '.tmp', 'w') as fh:
+        json.dump({'rows': len(rows), 'built': time.time(), 'overflow': sorted(overflow)}, fh)
+    with open(path + '.tmp', 'wb') as fh:
+        np.save(fh, rows)
+    os.rename(meta_path(path) + '.tmp', meta_path(path))
+    os.rename(path + '.tmp', path)
+    log.info('build_m2p_index: wrote %i rows to %s (%i keys left to MySQL)', len(rows), path, len(overflow))
+    return len(rows)
+
+
+class M2PIndex(object):
+    """ Read-only, memory-mapped PubTator mutation index (see build_m2p_index), answering the
+    PubtatorDB search_m2p / search_FS / search_proteins query shapes by binary search on (Pos, Ref),
+    without MySQL.
+
+    The file is mapped read-only, so processes on one host (e.g. gunicorn workers) share its pages
+    through the OS page cache.
+
+    Searches return rows as dictionaries with PMID, GeneID, EditType, SeqType, Pos, Ref and Alt
+    (lowercased; no Components or Mentions), or None when the index can't answer (values longer than
+    the index stores), in which case the caller should ask PubtatorDB.  As in MySQL, NULL values
+    (returned as None) never equal a searched value.  The index is a snapshot: it doesn't see
+    changes to the m2p tables made after it was built.
+
+    Example:
+        index = M2PIndex('data/m2p_index.npy')
+        rows = index.search_m2p(VariantComponents(seqvar), gene_id)
+    """
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('M2PIndex requires numpy (pip install numpy)')
+        self.path = path
+        self.rows = np.load(path, mmap_mode='r')
+        if 'nulls' not in self.rows.dtype.names:
+            raise ValueError('%s was built by an older version of build_m2p_index; rebuild it' % path)
+        self.keys = self.rows['key']
+        with open(meta_path(path)) as fh:
+            self.meta = json.load(fh)
+        self.overflow = set(key.encode('utf-8') for key in self.meta['overflow'])
+        self.key_width = self.rows.dtype['key'].itemsize
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, pos, ref, gene_id=None, **match):
+        """ Returns rows for (pos, ref) (and gene_id, if supplied) whose other ROW_FIELDS equal the
+        values in `match` (case-insensitively), or None if the index can't answer.
+
+        Example:
+            index.lookup('919', 'G', 4087, EditType='SUB', Alt='C')
+        """
+        if pos is None or ref is None or None in match.values():
+            # (like "Ref=NULL" in MySQL, matches nothing.)
+            return []
+        key = index_key(pos, ref)
+        if key in self.overflow or len(key) > self.key_width:
+            return None
+
+        start = np.searchsorted(self.keys, key, side='left')
+        block = self.rows[start:np.searchsorted(self.keys, key, side='right')]
+        # (a NULL Ref has the same key as Ref='', but doesn't match it.)
+        block = block[block['nulls'] & NULL_BITS['Ref'] == 0]
+        if gene_id:
+            block = block[block['GeneID'] == gene_id]
+        for field, value in match.items():
+            block = block[(block[field] == _field_bytes(value)) & (block['nulls'] & NULL_BITS[field] == 0)]
+
+        pos, ref = key.decode('utf-8').split(KEY_SEP.decode('utf-8'))
+        results = []
+        seen = set()
+        for row in block:
+            values = tuple(None if row['nulls'] & NULL_BITS[field] else row[field].decode('utf-8')
+                           for field in ROW_FIELDS)
+            # (without a gene, the same mutation appears once per gene its paper mentions.)
+            if not gene_id:
+                if (row['PMID'], values) in seen:
+                    continue
+                seen.add((row['PMID'], values))
+            result = dict(zip(ROW_FIELDS, values))
+            result.update({'PMID': int(row['PMID']), 'GeneID': int(row['GeneID']), 'Pos': pos, 'Ref': ref})
+            results.append(result)
+        return results
+
+    def search_m2p(self, comp, gene_id, strict=False):
+        if gene_id:
+            return self.lookup(comp.pos, comp.ref, gene_id, EditType=comp.edittype, Alt=comp.alt)
+        return self.lookup(comp.pos, comp.ref, EditType=comp.edittype, SeqType=comp.seqtype, Alt=comp.alt)
+
+    search_FS = search_m2p
+
+    def search_proteins(self, comp, gene_id, strict=False):
+        match = {'SeqType': 'p'}
+        if comp.edittype:
+            match['EditType'] = comp.edittype
+        if strict:
+            match['Alt'] = comp.alt
+        return self.lookup(comp.pos, comp.ref, gene_id, **match)
+
+    def search_many(self, components_list, gene_id, strict=False):
+        """ Index version of PubtatorDB.search_many: returns list of result lists, one per item in
+        components_list, with None for the components the index can't answer.
+        """
+        results = []
+        for comp in components_list:
+            if comp.seqtype == 'p':
+                results.append(self.search_proteins(comp, gene_id, strict))
+            else:
+                results.append(self.search_m2p(comp, gene_id, strict))
+        return results
+
+
+def open_m2p_index(path):
+    """ Returns M2PIndex for path, or None if path is empty, or the index (or numpy) isn't available. """
+    if not path:
+        return None
+    if np is None:
+        log.warning('m2p index %s not used: numpy is not installed', path)
+        return None
+    if not os.path.exists(path):
+        log.warning('m2p index %s not found; searching PubtatorDB', path)
+        return None
+    try:
+        return M2PIndex(path)
+    except ValueError as error:
+        log.warning('m2p index %s not used: %s', path, error)
+        return None
@@ -0,0 +1,214 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .config import POOL_SIZE, POOL_MAX_AGE, POOL_TIMEOUT, POOL_PING_AFTER
+from .exceptions import PoolTimeout
+
+log = logging.getLogger('pubtatordb.pool')
+
+
+class ConnectionPool(object):
+    """ Bounded pool of MySQLdb connections to a single (host, db, user).
+
+    Connections are made with connect_func (no arguments; returns a new connection) when none are
+    idle and fewer than maxsize are open.  On checkout, connections older than max_age seconds are
+    replaced, and those idle for longer than ping_after seconds are pinged (and replaced if the ping
+    fails), so a connection dropped by the server (e.g. after wait_timeout) is not handed out.
+
+    :param connect_func: function returning a new MySQLdb connection
+    :param maxsize: max number of open connections (idle + checked out)
+    :param max_age: seconds after which a connection is closed and replaced (None: never)
+    :param timeout: seconds to wait for a connection when maxsize are checked out before raising PoolTimeout
+    :param ping_after: seconds a connection may sit idle before it is pinged on checkout (0: always ping)
+    """
+
+    def __init__(self, connect_func, maxsize=POOL_SIZE, max_age=POOL_MAX_AGE, timeout=POOL_TIMEOUT, name='',
+                 ping_after=POOL_PING_AFTER):
+        self.connect_func = connect_func
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.name = name
+
+        self._idle = deque()     # idle connections, most recently returned last
+        self._created = {}       # id(conn) -> creation time, for every open connection
+        self._returned = {}      # id(conn) -> time it was last checked in, for idle connections
+        self._pending = 0        # connections being opened (counted against maxsize)
+        self._cond = threading.Condition()
+
+        self.counters = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'connects': 0, 'reconnects': 0,
+                         'recycled': 0, 'discarded': 0, 'pings': 0, 'rollbacks': 0}
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    @property
+    def size(self):
+        return len(self._created) + self._pending
+
+    def _close(self, conn):
+        # call with self._cond held.
+        self._created.pop(id(conn), None)
+        self._returned.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _connect(self):
+        """ Opens a new connection for a slot already reserved in self._pending. """
+        conn = None
+        try:
+            conn = self.connect_func()
+        finally:
+            with self._cond:
+                self._pending -= 1
+                if conn is not None:
+                    self._created[id(conn)] = time.time()
+                    self.counters['connects'] += 1
+                self._cond.notify()
+        return conn
+
+    def _replace(self, conn, counter):
+        with self._cond:
+            self._close(conn)
+            self._pending += 1
+            self.counters[counter] += 1
+        return self._connect()
+
+    def _validate(self, conn, returned):
+        """ Returns a usable connection: conn itself if it is young enough and (when it has been idle
+        since `returned` for longer than ping_after) answers a ping, otherwise a new one (conn is closed).
+        """
+        now = time.time()
+        created = self._created.get(id(conn), 0)
+        if self.max_age is not None and now - created > self.max_age:
+            return self._replace(conn, 'recycled')
+        if now - returned <= self.ping_after:
+            return conn
+        try:
+            self.counters['pings'] += 1
+            conn.ping()
+            return conn
+        except Exception as error:
+            log.info('%s: connection failed ping (%r); reconnecting', self.name, error)
+            return self._replace(conn, 'reconnects')
+
+    def checkout(self):
+        """ Returns a validated connection, waiting up to `timeout` seconds if the pool is exhausted.
+
+        :raises: PoolTimeout
+        """
+        start = time.time()
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    returned = self._returned.pop(id(conn), 0)
+                    break
+                if self.size < self.maxsize:
+                    conn = None
+                    self._pending += 1
+                    break
+                remaining = self.timeout - (time.time() - start)
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout('%s: no connection available after %is (%i open)' % (self.name, self.timeout, self.size))
+                waited = True
+                self._cond.wait(remaining)
+
+            self.counters['checkouts'] += 1
+            if waited:
+                wait_ms = (time.time() - start) * 1000
+                self.counters['waits'] += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+        if conn is None:
+            return self._connect()
+        return self._validate(conn, returned)
+
+    def checkin(self, conn, dirty=True):
+        """ Returns conn to the pool.  If it is dirty (ran statements since its last commit or rollback,
+        and so may hold an open transaction), the transaction is rolled back first, so the next user
+        doesn't see its uncommitted writes or read from its stale REPEATABLE READ snapshot.
+        Connections that fail the rollback are discarded.
+
+        :param dirty: (bool) False if the caller knows conn holds no open transaction [default: True]
+        """
+        if dirty:
+            try:
+                self.counters['rollbacks'] += 1
+                conn.rollback()
+            except Exception as error:
+                log.info('%s: discarding connection that failed rollback (%r)', self.name, error)
+                self.discard(conn)
+                return
+        with self._cond:
+            if id(conn) in self._created:
+                self._idle.append(conn)
+                self._returned[id(conn)] = time.time()
+            self._cond.notify()
+
+    def discard(self, conn):
+        """ Closes conn instead of returning it to the pool (e.g. after it raised a connection error). """
+        with self._cond:
+            self._close(conn)
+            self.counters['discarded'] += 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            outd = dict(self.counters)
+            outd['size'] = self.size
+            outd['idle'] = len(self._idle)
+            outd['in_use'] = self.size - len(self._idle)
+            outd['maxsize'] = self.maxsize
+            outd['wait_ms_mean'] = round(self.wait_ms_total / outd['waits'], 3) if outd['waits'] else None
+            outd['wait_ms_max'] = round(self.wait_ms_max, 3)
+            return outd
+
+
+# pools are keyed by process id as well, so a forked child never uses connections (sockets) it
+# inherited from its parent.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # the parent's pools (and their connections) belong to the parent: leave them open, but drop them
+    # here.  The lock may have been held by another thread of the parent when it forked.
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    pid = os.getpid()
+    for key in [key for key in _pools if key[0] != pid]:
+        del _pools[key]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_pool(host, db, user, connect_func):
+    """ Returns the (process-wide) ConnectionPool for (host, db, user), creating it with connect_func
+    if needed.
+    """
+    key = (os.getpid(), host, db, user)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect_func, name='%s@%s/%s' % (user, host, db))
+        return _pools[key]
+
+
+def all_pool_stats():
+    """ Returns dictionary of "user@host/db" -> stats dictionary for every pool in this process. """
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == pid]
+    return dict((pool.name, pool.stats()) for pool in pools)
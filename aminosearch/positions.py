@@ -0,0 +1,45 @@
+from __future__ import absolute_import, unicode_literals
+
+import re
+
+# one end of a position: base position, optionally with an intronic offset ("4320", "-1224", "4320+1", "88-12").
+re_position = re.compile(r'^(?P<pos>-?\d+)(?P<offset>[+-]\d+)?$')
+
+
+def _parse_end(text):
+    match = re_position.match(text.strip().strip('()'))
+    if not match:
+        return None, None
+    return int(match.group('pos')), int(match.group('offset') or 0)
+
+
+def parse_position(pos):
+    """ Parses a component position (the Pos column of the m2p tables, or VariantComponents.pos)
+    into integers (PosStart, PosEnd, Offset), where Offset is the intronic offset of PosStart.
+
+    Positions that don't have a numeric start (e.g. 3' UTR positions like "*45") give (None, None, None).
+
+    Examples:
+        parse_position('2153')          --> (2153, 2153, 0)
+        parse_position('2153_2155')     --> (2153, 2155, 0)
+        parse_position('4320+1')        --> (4320, 4320, 1)
+        parse_position('-1224')         --> (-1224, -1224, 0)
+
+    :param pos: (str or int)
+    :return: tuple (PosStart, PosEnd, Offset)
+    """
+    if pos is None:
+        return None, None, None
+    parts = ('%s' % pos).split('_')
+    start, offset = _parse_end(parts[0])
+    if start is None:
+        return None, None, None
+    end = _parse_end(parts[-1])[0] if len(parts) > 1 else start
+    if end is None:
+        end = start
+    return start, end, offset
+
+
+def position_columns(pos):
+    """ Returns dictionary of PosStart, PosEnd and Offset for pos (see parse_position). """
+    return dict(zip(('PosStart', 'PosEnd', 'Offset'), parse_position(pos)))
@@ -0,0 +1,191 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from collections import OrderedDict
+
+from .config import log, GENE_PREFETCH_MAX_GENES, GENE_PREFETCH_MAX_ROWS
+from .pubtatordb import PubtatorDB
+from .clinvardb import ClinVarAminoDB
+
+
+def _lower(value):
+    # the component columns are case-insensitive varchars.
+    return ('%s' % (value if value is not None else '')).lower()
+
+
+class GenePrefetch(object):
+    """ Loads all of a gene's component rows with one query (see gene_query) and answers searches
+    for that gene's variants from memory, for batch runs over variant lists that are mostly one gene.
+
+    Genes are kept in an LRU: once more than max_genes genes (or max_rows rows in all) are held, the
+    least recently used gene is dropped.  A gene with more than max_rows rows is not held at all, and
+    lookups for it return None (meaning: ask the database).
+
+    A gene is loaded without holding the LRU's lock, so lookups for other genes aren't held up by it;
+    threads asking for a gene that is being loaded wait for that load instead of starting their own.
+
+    Rows are returned as-is (not copied), so callers must not mutate them.
+    """
+
+    def __init__(self, db, max_genes=GENE_PREFETCH_MAX_GENES, max_rows=GENE_PREFETCH_MAX_ROWS):
+        self.db = db
+        self.max_genes = max_genes
+        self.max_rows = max_rows
+        self.stats = {'hits': 0, 'loads': 0, 'too_big': 0}
+
+        self._genes = OrderedDict()     # gene_id -> ((Pos, Ref) -> rows, row count)
+        self._row_count = 0
+        self._too_big = set()
+        self._loading = {}              # gene_id -> threading.Event set when its load is done
+        self._lock = threading.Lock()
+
+    def gene_query(self, gene_id):
+        """ Returns (sql, args) selecting every component row for gene_id. """
+        raise NotImplementedError
+
+    def _load(self, gene_id):
+        # runs without self._lock; only adding the gene to the LRU takes it.
+        sql, args = self.gene_query(gene_id)
+        rows = self.db.fetchall(sql + ' limit %s', *(args + (self.max_rows + 1,)))
+        if len(rows) > self.max_rows:
+            log.info('GenePrefetch: gene %s has more than %i rows; not prefetched', gene_id, self.max_rows)
+            with self._lock:
+                self.stats['loads'] += 1
+                self.stats['too_big'] += 1
+                self._too_big.add(gene_id)
+            return None
+
+        positions = {}
+        for row in rows:
+            positions.setdefault((_lower(row['Pos']), _lower(row['Ref'])), []).append(row)
+        with self._lock:
+            self.stats['loads'] += 1
+            self._genes[gene_id] = (positions, len(rows))
+            self._row_count += len(rows)
+            while len(self._genes) > self.max_genes or self._row_count > self.max_rows:
+                _, (_, count) = self._genes.popitem(last=False)
+                self._row_count -= count
+        return positions
+
+    def gene_positions(self, gene_id):
+        """ Returns dictionary of (Pos, Ref) -> rows for gene_id (lowercased), loading the gene if
+        needed, or None if the gene has too many rows to hold.
+        """
+        while True:
+            with self._lock:
+                if gene_id in self._too_big:
+                    return None
+                if gene_id in self._genes:
+                    self._genes.move_to_end(gene_id)
+                    self.stats['hits'] += 1
+                    return self._genes[gene_id][0]
+                loading = self._loading.get(gene_id)
+                if loading is None:
+                    loading = self._loading[gene_id] = threading.Event()
+                    break
+            # another thread is loading this gene: wait for it, then look again (and load it
+            # ourselves if that load failed).
+            loading.wait()
+
+        try:
+            return self._load(gene_id)
+        finally:
+            with self._lock:
+                del self._loading[gene_id]
+            loading.set()
+
+    def lookup(self, gene_id, pos, ref, **match):
+        """ Returns gene_id's rows for (pos, ref) whose other columns equal the values in `match`
+        (case-insensitively), or None if the gene isn't held (see gene_positions).
+        """
+        positions = self.gene_positions(gene_id)
+        if positions is None:
+            return None
+        rows = positions.get((_lower(pos), _lower(ref)), [])
+        for column, value in match.items():
+            rows = [row for row in rows if _lower(row[column]) == _lower(value)]
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._genes.clear()
+            self._too_big.clear()
+            self._row_count = 0
+
+    def __len__(self):
+        return len(self._genes)
+
+
+class PubtatorGenePrefetch(GenePrefetch):
+    """ GenePrefetch for PubtatorDB: search_m2p, search_FS, search_proteins and search_many with a
+    gene_id, answered from the gene's rows in the gene table (gene2m2p) or, without one, in
+    m2p_general joined to gene2pubtator.  Searches without a gene_id (or for genes too big to hold)
+    go to the database.
+
+    Example:
+        prefetch = PubtatorGenePrefetch()
+        for comp in brca1_components:
+            rows = prefetch.search_m2p(comp, 672)    # one query for all of them
+    """
+
+    def __init__(self, db=None, **kwargs):
+        super(PubtatorGenePrefetch, self).__init__(db or PubtatorDB(), **kwargs)
+
+    def gene_query(self, gene_id):
+        self.db.check_gene_table()
+        if self.db.gene_table:
+            sql = 'select distinct '+self.db.GENE_TABLE_COLUMNS+' from '+self.db.gene_table+' where GeneID=%s'
+        else:
+            sql = 'select distinct M.* from gene2pubtator G, m2p_general M where G.PMID = M.PMID and G.GeneID=%s and M.EditType != "rs"'
+        return sql, (gene_id,)
+
+    def _search_m2p(self, comp, gene_id, strict=False):
+        return self.lookup(gene_id, comp.pos, comp.ref, EditType=comp.edittype, Alt=comp.alt)
+
+    def _search_proteins(self, comp, gene_id, strict=False):
+        match = {'SeqType': 'p'}
+        if comp.edittype:
+            match['EditType'] = comp.edittype
+        if strict:
+            match['Alt'] = comp.alt
+        return self.lookup(gene_id, comp.pos, comp.ref, **match)
+
+    def search_m2p(self, comp, gene_id, strict=False):
+        rows = self._search_m2p(comp, gene_id, strict) if gene_id else None
+        return rows if rows is not None else self.db.search_m2p(comp, gene_id, strict)
+
+    def search_FS(self, comp, gene_id, strict=False):
+        rows = self._search_m2p(comp, gene_id, strict) if gene_id else None
+        return rows if rows is not None else self.db.search_FS(comp, gene_id, strict)
+
+    def search_proteins(self, comp, gene_id, strict=False):
+        rows = self._search_proteins(comp, gene_id, strict) if gene_id else None
+        return rows if rows is not None else self.db.search_proteins(comp, gene_id, strict)
+
+    def search_many(self, components_list, gene_id, strict=False):
+        """ Same as PubtatorDB.search_many (which it falls back to when the gene can't be held). """
+        if not gene_id or self.gene_positions(gene_id) is None:
+            return self.db.search_many(components_list, gene_id, strict)
+        return [self._search_proteins(comp, gene_id, strict) if comp.seqtype == 'p'
+                else self._search_m2p(comp, gene_id, strict) for comp in components_list]
+
+
+class ClinVarGenePrefetch(GenePrefetch):
+    """ GenePrefetch for ClinVarAminoDB: search() with a gene_id, answered from the gene's
+    t2g_hgvs_components rows.
+    """
+
+    def __init__(self, db=None, **kwargs):
+        super(ClinVarGenePrefetch, self).__init__(db or ClinVarAminoDB(), **kwargs)
+
+    def gene_query(self, gene_id):
+        return 'select * from clinvar.t2g_hgvs_components where GeneID=%s', (gene_id,)
+
+    def search(self, comp, gene_id, strict=False):
+        rows = None
+        if gene_id:
+            if strict:
+                rows = self.lookup(gene_id, comp.pos, comp.ref, Alt=comp.alt)
+            else:
+                rows = self.lookup(gene_id, comp.pos, comp.ref)
+        return rows if rows is not None else self.db.search(comp, gene_id, strict)
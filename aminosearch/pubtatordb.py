@@ -5,53 +5,322 @@ from MySQLdb import ProgrammingError
 #from medgen.db.dataset import SQLData 
 from .sqldata import SQLData
 from .exceptions import PubtatorDBError
+from .positions import parse_position
+from .config import log, POSITION_WINDOW
 
-class PubtatorDB(SQLData):
 
-    def _fetchall_or_raise_pubtatordberror(self, sql, comp, *args):
-        try:
-            return self.fetchall(sql, *args)
-        except ProgrammingError as error:
-            # attempt to lookup an edittype that we don't currently handle (e.g. EXT, INV)
-            raise PubtatorDBError('EditType %s currently not handled. (%r)' % (comp.edittype, error))
+class PubtatorQueries(object):
+    """ Builds the (sql, args) for each PubtatorDB search, so that PubtatorDB and
+    AsyncPubtatorDB (see asyncdb.py) run exactly the same statements.
 
-    def search_FS(self, comp, gene_id, strict=False):
+    Searches with a gene_id use the gene-keyed table named by gene_table (see GENE_TABLE) when it
+    is set: one range scan of its (GeneID, EditType, Pos, Ref, Alt) index, instead of joining
+    gene2pubtator to an m2p table.
+    """
+
+    # gene-keyed copy of m2p_general, made by sbin/07_create_m2p_components_tables.py.
+    GENE_TABLE = 'gene2m2p'
+    GENE_TABLE_COLUMNS = 'PMID, Components, Mentions, SeqType, EditType, Ref, Pos, Alt'
+
+    # GENE_TABLE once it has been found in the database (see PubtatorDB.check_gene_table), else None.
+    gene_table = None
+
+    # max number of distinct components per statement in search_many.
+    SEARCH_MANY_BATCH_SIZE = 500
+
+    # numeric position columns (see positions.parse_position) returned by search_window.
+    POSITION_COLUMNS = 'PosStart, PosEnd, `Offset`'
+
+    def _gene_table_query(self, where, gene_id, *args):
+        sql = 'select distinct '+self.GENE_TABLE_COLUMNS+' from '+self.gene_table+' where GeneID=%s and '+where
+        return sql, (gene_id,) + args
+
+    def search_FS_query(self, comp, gene_id, strict=False):
+        if gene_id and self.gene_table:
+            return self._gene_table_query('EditType="FS" and Pos=%s and Ref=%s and Alt=%s', gene_id,
+                                          comp.pos, comp.ref, comp.alt)
         if gene_id:
-            sql = 'select distinct M.* from gene2pubtator G, m2p_FS M where G.PMID = M.PMID and G.GeneID=%s and Ref="%s" and Alt="%s" and Pos=%s'
+            sql = 'select distinct M.* from gene2pubtator G, m2p_FS M where G.PMID = M.PMID and G.GeneID=%s and Ref=%s and Alt=%s and Pos=%s'
             args = (gene_id, comp.ref, comp.alt, comp.pos)
         else:
-            sql = 'select distinct * from m2p_FS where SeqType="%s", and Ref="%s" and Alt="%s" and Pos=%s'
+            sql = 'select distinct * from m2p_FS where SeqType=%s and Ref=%s and Alt=%s and Pos=%s'
             args = (comp.seqtype, comp.ref, comp.alt, comp.pos)
+        return sql, args
 
-        return self.fetchall(sql, *args)
-
-    def search_m2p(self, comp, gene_id, strict=False):
+    def search_m2p_query(self, comp, gene_id, strict=False):
         # sql = "select distinct M.* from gene2pubtator G, m2p_{comp.edittype} M where G.PMID = M.PMID and G.GeneID = {gene_id} and Pos={comp.pos} and Ref = '{comp.ref}' and Alt = '{comp.alt}' and SeqType='{comp.seqtype}'".format(comp=comp, gene_id=gene_id)
+        if gene_id and self.gene_table:
+            return self._gene_table_query('EditType=%s and Pos=%s and Ref=%s and Alt=%s', gene_id,
+                                          comp.edittype, comp.pos, comp.ref, comp.alt)
         if gene_id:
-            sql = 'select distinct M.* from gene2pubtator G, m2p_'+comp.edittype+' M where G.PMID = M.PMID and G.GeneID=%s and Ref="%s" and Alt="%s" and Pos=%s'
+            sql = 'select distinct M.* from gene2pubtator G, m2p_'+comp.edittype+' M where G.PMID = M.PMID and G.GeneID=%s and Ref=%s and Alt=%s and Pos=%s'
             args = (gene_id, comp.ref, comp.alt, comp.pos)
         else:
-            sql = 'select distinct * from m2p_'+comp.edittype+' where SeqType="%s" and Ref="%s" and Alt="%s" and Pos=%s'
+            sql = 'select distinct * from m2p_'+comp.edittype+' where SeqType=%s and Ref=%s and Alt=%s and Pos=%s'
             args = (comp.seqtype, comp.ref, comp.alt, comp.pos)
+        return sql, args
 
-        return self._fetchall_or_raise_pubtatordberror(sql, comp, *args)
-
-    def search_proteins(self, comp, gene_id, strict=False):
+    def search_proteins_query(self, comp, gene_id, strict=False):
         if not comp.edittype:
             tablename = 'm2p_general'
         else:
             tablename = 'm2p_%s' % comp.edittype
 
-        if gene_id:
-            sql = 'select distinct M.* from gene2pubtator G, '+tablename+' M where G.PMID = M.PMID and G.GeneID=%s and Pos="%s" and SeqType="p" and Ref="%s"'
+        if gene_id and self.gene_table:
+            if comp.edittype:
+                sql, args = self._gene_table_query('EditType=%s and Pos=%s and Ref=%s and SeqType="p"', gene_id,
+                                                   comp.edittype, comp.pos, comp.ref)
+            else:
+                sql, args = self._gene_table_query('Pos=%s and Ref=%s and SeqType="p"', gene_id, comp.pos, comp.ref)
+        elif gene_id:
+            sql = 'select distinct M.* from gene2pubtator G, '+tablename+' M where G.PMID = M.PMID and G.GeneID=%s and Pos=%s and SeqType="p" and Ref=%s'
             args = (gene_id, comp.pos, comp.ref)
         else:
-            sql = 'select distinct * from '+tablename+' where SeqType="%s" and Pos=%s and SeqType="p" and Ref="%s"'
-            args = (comp.seqtype, comp.pos, comp.ref)
+            sql = 'select distinct * from '+tablename+' where Pos=%s and SeqType="p" and Ref=%s'
+            args = (comp.pos, comp.ref)
 
         if strict:
-            sql += ' and Alt = "%s"'
-            args = (args, comp.alt)
+            sql += ' and Alt=%s'
+            args = args + (comp.alt,)
+        return sql, args
+
+    def search_window_query(self, comp, gene_id, window=POSITION_WINDOW):
+        """ Builds the search for every mutation (of any edit type) whose PosStart is within `window`
+        positions of comp's start position, on the same kind of sequence (protein or nucleotide).
+
+        Nucleotide searches don't filter on the seqtype itself, since tmVar leaves it blank for many
+        c. and g. mentions.
+
+        :raises PubtatorDBError: if comp.pos has no numeric start position (e.g. "*45")
+        """
+        start = parse_position(comp.pos)[0]
+        if start is None:
+            raise PubtatorDBError('Position %s has no numeric start; cannot search around it.' % comp.pos)
+
+        where = 'SeqType="p"' if comp.seqtype == 'p' else 'SeqType!="p"'
+        where += ' and PosStart between %s and %s'
+        args = (start - window, start + window)
+
+        if gene_id and self.gene_table:
+            sql = 'select distinct '+self.GENE_TABLE_COLUMNS+', '+self.POSITION_COLUMNS+' from '+self.gene_table+' where GeneID=%s and '+where
+            args = (gene_id,) + args
+        elif gene_id:
+            sql = 'select distinct M.* from gene2pubtator G, m2p_general M where G.PMID = M.PMID and G.GeneID=%s and '+where
+            args = (gene_id,) + args
+        else:
+            sql = 'select distinct * from m2p_general where '+where
+        return sql, args
+
+    def search_key(self, comp, gene_id, strict=False):
+        """ Returns (tablename, columns, values) describing the search that search_proteins (for protein
+        components) or search_m2p (for the rest) would run for comp, so that components with equal keys
+        share one search.  Values are lowercased strings, since the m2p tables' columns are
+        case-insensitive varchars.
+        """
+        if comp.seqtype == 'p':
+            tablename = 'm2p_%s' % comp.edittype if comp.edittype else 'm2p_general'
+            columns = ('SeqType', 'Pos', 'Ref', 'Alt') if strict else ('SeqType', 'Pos', 'Ref')
+            if gene_id and self.gene_table:
+                tablename = self.gene_table
+                columns = ('EditType',) + columns if comp.edittype else columns
+        elif gene_id and self.gene_table:
+            tablename = self.gene_table
+            columns = ('EditType', 'Pos', 'Ref', 'Alt')
+        else:
+            tablename = 'm2p_%s' % comp.edittype
+            # with a gene_id, search_m2p doesn't look at the seqtype.
+            columns = ('Pos', 'Ref', 'Alt') if gene_id else ('SeqType', 'Pos', 'Ref', 'Alt')
+        values = tuple(('%s' % getattr(comp, column.lower())).lower() for column in columns)
+        return tablename, columns, values
+
+    def row_key(self, tablename, columns, row):
+        """ Returns the search_key() of the components a row from search_many_queries() matched. """
+        return tablename, columns, tuple(('%s' % row[column]).lower() for column in columns)
+
+    def search_many_queries(self, keys, gene_id):
+        """ Yields (tablename, columns, sql, args) for each statement needed to run the searches described
+        by keys (see search_key): duplicate keys are searched once, and the keys for each table are searched
+        together with a row-value IN list of up to SEARCH_MANY_BATCH_SIZE entries.
+        """
+        groups = {}
+        for tablename, columns, values in keys:
+            group = groups.setdefault((tablename, columns), [])
+            if values not in group:
+                group.append(values)
+
+        for (tablename, columns), all_values in sorted(groups.items()):
+            for idx in range(0, len(all_values), self.SEARCH_MANY_BATCH_SIZE):
+                chunk = all_values[idx:idx + self.SEARCH_MANY_BATCH_SIZE]
+                row_value = '(' + ','.join(['%s'] * len(columns)) + ')'
+                where = '(%s) in (%s)' % (','.join('M.' + column for column in columns),
+                                          ','.join([row_value] * len(chunk)))
+                if tablename == self.gene_table:
+                    sql = 'select distinct '+self.GENE_TABLE_COLUMNS+' from '+tablename+' M where M.GeneID=%s and '+where
+                    args = [gene_id]
+                elif gene_id:
+                    sql = 'select distinct M.* from gene2pubtator G, '+tablename+' M where G.PMID = M.PMID and G.GeneID=%s and '+where
+                    args = [gene_id]
+                else:
+                    sql = 'select distinct M.* from '+tablename+' M where '+where
+                    args = []
+                for values in chunk:
+                    args.extend(values)
+                yield tablename, columns, sql, args
+
+    def map_search_many(self, keys, results):
+        """ Returns list of rows matching each key (in the order of keys), given results as a list of
+        (tablename, columns, rows) for the statements from search_many_queries().
+        """
+        found = {}
+        for tablename, columns, rows in results:
+            for row in rows:
+                found.setdefault(self.row_key(tablename, columns, row), []).append(row)
+        return [found.get(key, []) for key in keys]
+
 
+class PubtatorDB(PubtatorQueries, SQLData):
+
+    # composite index on every m2p table (see add_indexes): all the searches filter on Pos, Ref (and Alt)
+    # together, and the join to gene2pubtator then reads PMID from the index.
+    M2P_INDEX = ('Pos_Ref_Alt_PMID', 'Pos, Ref, Alt, PMID')
+
+    # range indexes for search_window: on each m2p table, then joined to gene2pubtator by PMID; and on the gene table.
+    POSITION_INDEX = ('PosStart_PMID', 'PosStart, PMID')
+    GENE_POSITION_INDEX = ('GeneID_PosStart', 'GeneID, PosStart')
+
+    def m2p_tables(self):
+        """ Returns names of the m2p_<EditType> tables (and m2p_general) present in the database. """
+        rows = self.fetchall('select TABLE_NAME from information_schema.TABLES where TABLE_SCHEMA=%s '
+                             'and TABLE_NAME like %s', self._db_name, 'm2p\\_%')
+        return sorted(row['TABLE_NAME'] for row in rows if row['TABLE_NAME'] != 'm2p_rs')
+
+    def add_indexes(self):
+        """ Adds M2P_INDEX to each m2p table that doesn't have it yet (safe to run more than once).
+
+        :return: list of names of the tables the index was added to
+        """
+        name, columns = self.M2P_INDEX
+        return [tablename for tablename in self.m2p_tables() if self.add_index(tablename, name, columns)]
+
+    def add_position_indexes(self):
+        """ Adds POSITION_INDEX to each m2p table (and GENE_POSITION_INDEX to the gene table) that
+        doesn't have it yet.  The tables must already have the PosStart column (see add_position_columns).
+
+        :return: list of names of the tables an index was added to
+        """
+        name, columns = self.POSITION_INDEX
+        added = [tablename for tablename in self.m2p_tables() if self.add_index(tablename, name, columns)]
+        self.check_gene_table()
+        if self.gene_table and self.add_index(self.gene_table, *self.GENE_POSITION_INDEX):
+            added.append(self.gene_table)
+        return added
+
+    def add_position_columns(self, progress=None):
+        """ Adds PosStart, PosEnd and Offset (see positions.parse_position) to m2p tables and the gene
+        table made before they were part of sbin/07_create_m2p_components_tables.py, fills them in from
+        Pos, and adds the position indexes (safe to run more than once).
+
+        :param progress: optional function called as progress(tablename, positions_done, positions_total)
+        :return: list of names of the tables the columns were added to
+        """
+        self.check_gene_table()
+        tablenames = self.m2p_tables() + ([self.gene_table] if self.gene_table else [])
+        added = []
+        for tablename in tablenames:
+            row = self.fetchrow('select count(*) as found from information_schema.COLUMNS where TABLE_SCHEMA=%s '
+                                'and TABLE_NAME=%s and COLUMN_NAME=%s', self._db_name, tablename, 'PosStart')
+            if row['found']:
+                continue
+            self.execute('alter table '+tablename+' add column PosStart int(11) default NULL after Pos, '
+                         'add column PosEnd int(11) default NULL after PosStart, '
+                         'add column `Offset` int(11) default NULL after PosEnd')
+            added.append(tablename)
+
+            # one update per distinct Pos, using the existing Pos index.
+            positions = self.results2set('select distinct Pos from '+tablename+' where Pos is not NULL', 'Pos')
+            with self.transaction(commit_every=1000):
+                for idx, pos in enumerate(positions):
+                    start, end, offset = parse_position(pos)
+                    if start is not None:
+                        self.execute('update '+tablename+' set PosStart=%s, PosEnd=%s, `Offset`=%s where Pos=%s',
+                                     start, end, offset, pos)
+                    if progress:
+                        progress(tablename, idx + 1, len(positions))
+
+        self.add_position_indexes()
+        return added
+
+    def check_gene_table(self):
+        """ Sets gene_table to GENE_TABLE if it exists in the database (checked once per object). """
+        if getattr(self, '_gene_table_checked', False):
+            return
+        row = self.fetchrow('select count(*) as found from information_schema.TABLES where TABLE_SCHEMA=%s '
+                            'and TABLE_NAME=%s', self._db_name, self.GENE_TABLE)
+        self.gene_table = self.GENE_TABLE if row['found'] else None
+        self._gene_table_checked = True
+
+    def _fetchall_or_raise_pubtatordberror(self, sql, comp, *args):
+        try:
+            return self.fetchall(sql, *args)
+        except ProgrammingError as error:
+            # attempt to lookup an edittype that we don't currently handle (e.g. EXT, INV)
+            raise PubtatorDBError('EditType %s currently not handled. (%r)' % (comp.edittype, error))
+
+    def search_FS(self, comp, gene_id, strict=False):
+        self.check_gene_table()
+        sql, args = self.search_FS_query(comp, gene_id, strict)
+        return self.fetchall(sql, *args)
+
+    def search_m2p(self, comp, gene_id, strict=False):
+        self.check_gene_table()
+        sql, args = self.search_m2p_query(comp, gene_id, strict)
         return self._fetchall_or_raise_pubtatordberror(sql, comp, *args)
 
+    def search_proteins(self, comp, gene_id, strict=False):
+        self.check_gene_table()
+        sql, args = self.search_proteins_query(comp, gene_id, strict)
+        return self._fetchall_or_raise_pubtatordberror(sql, comp, *args)
+
+    def search_many(self, components_list, gene_id, strict=False):
+        """ Batched version of search_proteins (for protein components) and search_m2p (for the rest),
+        for all the VariantComponents made from one LVG's seqvars.
+
+        Components that would run the same search (e.g. the same edit on several transcripts, when
+        gene_id is supplied) are searched once, and each m2p table is searched with a single statement.
+        Tables for edit types we don't handle (e.g. EXT, INV) are logged and skipped.
+
+        Example:
+            results = db.search_many([VariantComponents(seqvar) for seqvar in seqvars], gene_id)
+
+        :param components_list: list of VariantComponents objects
+        :param gene_id: (int) Gene ID, or None to search without a gene
+        :param strict: whether protein searches must also match Alt [default: False]
+        :return: list of result lists (one per item in components_list, in the same order; don't modify them,
+                 as components with the same search share a list)
+        """
+        self.check_gene_table()
+        keys = [self.search_key(comp, gene_id, strict) for comp in components_list]
+        results = []
+        for tablename, columns, sql, args in self.search_many_queries(keys, gene_id):
+            try:
+                results.append((tablename, columns, self.fetchall(sql, *args)))
+            except ProgrammingError as error:
+                log.info('search_many: cannot search %s (%r)', tablename, error)
+        return self.map_search_many(keys, results)
+
+    def search_window(self, comp, gene_id, window=POSITION_WINDOW):
+        """ Returns rows for mutations within `window` positions (either side) of comp's position, of any
+        edit type: the literature for nearby variants, as a position-range scan of the PosStart index.
+
+        Example:
+            rows = db.search_window(VariantComponents(seqvar), gene_id, window=5)
+
+        :param comp: VariantComponents object
+        :param gene_id: (int) Gene ID, or None to search without a gene
+        :param window: (int) number of positions either side of comp's start position [default: POSITION_WINDOW]
+        :return: list of rows (dictionaries), with PosStart, PosEnd and Offset
+        :raises PubtatorDBError: if comp.pos has no numeric start position
+        """
+        self.check_gene_table()
+        sql, args = self.search_window_query(comp, gene_id, window)
+        return self.fetchall(sql, *args)
@@ -1,10 +1,17 @@
+import json
 import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
 
 from pyrfc3339 import parse
 import MySQLdb
 import MySQLdb.cursors as cursors
 
-from .config import DATABASE, SQLDEBUG, get_data_log
+from .config import DATABASE, SQLDEBUG, BATCH_MAX_ROWS, BATCH_PACKET_FRACTION, READ_REPLICAS, REPLICA_STICKY_SECONDS, get_data_log
+from .pool import get_pool
+from .instrument import fire_query_hooks
 
 log = get_data_log('sqldata.log')
 if SQLDEBUG:
@@ -33,45 +40,214 @@ def SQLdatetime(pydatetime_or_string):
         dtobj = parse(pydatetime_or_string)
     return dtobj.strftime(SQLDATE_FMT)
 
+# MySQL client error codes meaning the connection itself failed (as opposed to the statement).
+CONNECTION_ERROR_CODES = (2002, 2003, 2006, 2013, 2055)
+
+def is_connection_error(error):
+    if isinstance(error, MySQLdb.InterfaceError):
+        return True
+    return isinstance(error, MySQLdb.OperationalError) and bool(error.args) and error.args[0] in CONNECTION_ERROR_CODES
+
 class SQLData(object):
     """
     MySQL base class for config, select, insert, update, and delete in MySQL databases.
+
+    Keywords:
+        replicas (list): hosts of read replicas for fetchall/fetchrow/iterate (see read_connection)
+                         [default: READ_REPLICAS]
     """
     def __init__(self, *args, **kwargs):
         self._db_host = kwargs.get('host', None) or DEFAULT_HOST
         self._db_user = kwargs.get('user', None) or DEFAULT_USER
         self._db_pass = kwargs.get('pass', None) or DEFAULT_PASS
         self._db_name = kwargs.get('name', None) or DEFAULT_NAME
+        self._db_replicas = kwargs.get('replicas', None)
+        if self._db_replicas is None:
+            self._db_replicas = READ_REPLICAS
 
         self.conn = None
 
-    def connect(self):
-        self.conn = MySQLdb.connect(passwd=self._db_pass,
-                                    user=self._db_user,
-                                    db=self._db_name,
-                                    host=self._db_host,
-                                    cursorclass=cursors.DictCursor,
-                                    charset='utf8',
-                                    use_unicode=True,
-                                   )
-        return self.conn
+    def _thread_state(self):
+        # per-thread state (the checked-out connection); created lazily since subclasses
+        # don't always call SQLData.__init__.
+        try:
+            return self.__dict__['_thread']
+        except KeyError:
+            return self.__dict__.setdefault('_thread', threading.local())
+
+    @property
+    def conn(self):
+        """ Connection currently checked out by this thread (None if there isn't one). """
+        return getattr(self._thread_state(), 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self._thread_state().conn = value
+
+    @property
+    def pool(self):
+        """ Process-wide ConnectionPool shared by every SQLData object using the same (host, db, user). """
+        return get_pool(self._db_host, self._db_name, self._db_user, self.connect)
+
+    def replica_pool(self, host):
+        """ Process-wide ConnectionPool for the read replica at host. """
+        return get_pool(host, self._db_name, self._db_user, lambda: self.connect(host))
+
+    def connect(self, host=None):
+        """ Opens and returns a new connection to host [default: the primary].  (Used by the pool;
+        use connection() or read_connection() to get one.)
+        """
+        return MySQLdb.connect(passwd=self._db_pass,
+                               user=self._db_user,
+                               db=self._db_name,
+                               host=host or self._db_host,
+                               cursorclass=cursors.DictCursor,
+                               charset='utf8',
+                               use_unicode=True,
+                              )
+
+    @contextmanager
+    def connection(self):
+        """ Context manager that checks a connection out of the pool for this thread for the duration
+        of the block and sets it as self.conn.  Nested blocks (in the same thread) reuse it.
+
+        A connection that raises OperationalError or InterfaceError is discarded instead of being
+        returned to the pool.
+        """
+        conn = self.conn
+        if conn is not None:
+            yield conn
+            return
+
+        pool = self.pool
+        with self._use_connection(pool, pool.checkout()) as conn:
+            yield conn
+
+    @contextmanager
+    def read_connection(self):
+        """ Like connection(), but for reads: checks a connection out of a randomly chosen read replica
+        (if any are configured) instead of the primary.
+
+        The primary is used instead when this thread already holds a connection (e.g. inside a
+        connection() or transaction() block), when this thread wrote through this object in the last
+        REPLICA_STICKY_SECONDS (so it reads its own writes despite replication lag), or when the
+        replica cannot be reached.
+        """
+        replicas = getattr(self, '_db_replicas', None)
+        last_write = getattr(self._thread_state(), 'last_write', 0)
+        if self.conn is not None or not replicas or time.time() - last_write < REPLICA_STICKY_SECONDS:
+            with self.connection() as conn:
+                yield conn
+            return
+
+        pool = self.replica_pool(random.choice(replicas))
+        try:
+            conn = pool.checkout()
+        except Exception as error:
+            log.error('Read replica %s unavailable (%r); reading from primary', pool.name, error)
+            pool = self.pool
+            conn = pool.checkout()
+
+        with self._use_connection(pool, conn) as conn:
+            yield conn
+
+    @contextmanager
+    def _use_connection(self, pool, conn):
+        """ Sets conn (checked out of pool) as self.conn for the duration of the block, then returns it
+        to the pool, or discards it if it raised OperationalError or InterfaceError.
+
+        The pool only rolls conn back if statements ran on it since its last commit (see _commit).
+        """
+        state = self._thread_state()
+        self.conn = conn
+        state.dirty = False
+        broken = False
+        try:
+            yield conn
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.conn = None
+            if broken:
+                pool.discard(conn)
+            else:
+                pool.checkin(conn, dirty=state.dirty)
+
+    def _commit(self, conn):
+        conn.commit()
+        self._thread_state().dirty = False
+
+    def _rollback(self, conn):
+        conn.rollback()
+        self._thread_state().dirty = False
+
+    @contextmanager
+    def transaction(self, commit_every=None):
+        """ Context manager for a "unit of work": execute() (and so insert()) and batch_insert() calls made
+        by this thread inside the block are not committed one by one, but together when the block exits, or every
+        commit_every statements if supplied.  If the block raises, uncommitted statements are rolled back.
+
+        Nested blocks join the outermost one.  The whole block runs on a single pooled connection.
+
+        Example:
+            with DB.transaction(commit_every=5000):
+                for row in rows:
+                    DB.insert('some_table', row)
+
+        :param commit_every: (int) commit after this many statements [default: None (only at the end)]
+        """
+        state = self._thread_state()
+        if getattr(state, 'uow', None) is not None:
+            yield
+            return
+
+        with self.connection() as conn:
+            state.uow = {'pending': 0, 'commit_every': commit_every}
+            try:
+                yield
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+            finally:
+                state.uow = None
+
+    def _statement_done(self, conn):
+        """ Commits after a statement, unless a transaction() block is deferring commits. """
+        self._thread_state().last_write = time.time()
+        uow = getattr(self._thread_state(), 'uow', None)
+        if uow is None:
+            self._commit(conn)
+            return
+        uow['pending'] += 1
+        if uow['commit_every'] and uow['pending'] >= uow['commit_every']:
+            self._commit(conn)
+            uow['pending'] = 0
 
     def cursor(self, execute_sql=None, *args):
         """Returns cursor for MySQL execution, optionally preloaded with execute_sql.
 
+        Must be called inside a connection() (or read_connection() / transaction()) block, which
+        returns the connection to the pool when it exits.
+
         Also remember: having multiple cursors open can result in unwanted things happening...
 
         :returns: MySQLdb cursor object (DictCursor)
+        :raises: RuntimeError if called outside a connection() block
         """
         if not self.conn:
-            self.connect()
+            raise RuntimeError('SQLData.cursor() called outside a connection() block')
         cursor = self.conn.cursor(cursors.DictCursor)
 
         if execute_sql is not None:
+            self._thread_state().dirty = True
+            start = time.time()
             if args:
                 cursor.execute(execute_sql, args)
             else:
                 cursor.execute(execute_sql)
+            fire_query_hooks(execute_sql, args, (time.time() - start) * 1000, cursor.rowcount, 'execute', self._db_name)
 
         return cursor
 
@@ -81,6 +257,9 @@ class SQLData(object):
 
         Results will be returned as a list of dictionaries.
 
+        Runs on a read replica if there are any (see read_connection), so use execute() for
+        statements that write (or lock).
+
         Example:
             DB.fetchall('select HGVS from clinvar where PMID="%s"', ('21129721',))
 
@@ -88,11 +267,77 @@ class SQLData(object):
         :returns: results as list of dictionaries
         :rtype: list
         """
-        cursor = self.cursor(select_sql, *args)
-        stuff = cursor.fetchall()
-        cursor.close() 
+        with self.read_connection():
+            cursor = self.cursor(select_sql, *args)
+            stuff = cursor.fetchall()
+            cursor.close()
         return stuff
 
+    def iterate(self, select_sql, *args, **kwargs):
+        """ Generator version of fetchall() for result sets too large to hold in memory: streams rows
+        (as dictionaries) from an unbuffered server-side cursor (SSDictCursor), batch_size rows at a time.
+
+        The query runs on its own pooled connection (to a read replica, if there are any), so other
+        statements (e.g. inserts) can be issued through this object while iterating.  If the loop is abandoned before the last row, that
+        connection is closed rather than drained.
+
+        Example:
+            for row in DB.iterate('select * from mutation2pubtator', batch_size=10000):
+                ...
+
+        The server gives up on a streaming query once sending it a batch has blocked for longer than its
+        net_write_timeout (60s by default), which a slow loop body will hit; pass net_write_timeout to
+        raise it for this query.  The connection is then closed afterwards instead of being returned
+        to the pool with the raised timeout.
+
+        Keywords:
+            batch_size (int): number of rows fetched from the server per round trip [default: 1000]
+            net_write_timeout (int): seconds, set for this query's session [default: server's setting]
+
+        :param select_sql: (str)
+        :returns: generator of dictionaries
+        """
+        batch_size = kwargs.get('batch_size', 1000)
+        net_write_timeout = kwargs.get('net_write_timeout', None)
+
+        pool = self.pool
+        replicas = getattr(self, '_db_replicas', None)
+        if replicas and time.time() - getattr(self._thread_state(), 'last_write', 0) >= REPLICA_STICKY_SECONDS:
+            pool = self.replica_pool(random.choice(replicas))
+        conn = pool.checkout()
+        cursor = None
+        finished = False
+        try:
+            if net_write_timeout:
+                setting = conn.cursor()
+                setting.execute('set session net_write_timeout=%s', (int(net_write_timeout),))
+                setting.close()
+            cursor = conn.cursor(cursors.SSDictCursor)
+            start = time.time()
+            if args:
+                cursor.execute(select_sql, args)
+            else:
+                cursor.execute(select_sql)
+
+            count = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+            finished = True
+            # (includes time spent by the caller between batches)
+            fire_query_hooks(select_sql, args, (time.time() - start) * 1000, count, 'iterate', self._db_name)
+        finally:
+            if finished and not net_write_timeout:
+                cursor.close()
+                pool.checkin(conn)
+            else:
+                # unread rows would have to be drained from the server first; just drop the connection.
+                pool.discard(conn)
+
     def fetchrow(self, select_sql, *args):
         """
         If the query was successful:
@@ -155,41 +400,111 @@ class SQLData(object):
             values.append(val)
         return fields, values
 
-    def batch_insert(self, tablename, new_data):
-        """ Insert new_data (list of dicts with identical schemas) into 
-        indicated tablename.  
-
-        Note: supplied data dictionaries MUST have identical data structure.
+    def max_allowed_packet(self):
+        """ Returns (and remembers) the server's max_allowed_packet, in bytes. """
+        if getattr(self, '_max_allowed_packet', None) is None:
+            row = self.fetchrow('select @@max_allowed_packet as max_packet')
+            self._max_allowed_packet = int(row['max_packet'])
+        return self._max_allowed_packet
 
-        WARNING: this is *really* not SQL-injection-safe, so don't wrap 
-                end-user interfaces around this method, OK?
+    def _batch_chunks(self, rows, fields, budget):
+        """ Splits rows (lists of values) into chunks whose estimated statement size stays under budget bytes
+        and which hold at most BATCH_MAX_ROWS rows.
+        """
+        chunk = []
+        size = 0
+        for row in rows:
+            row_size = sum(len('%s' % val) for val in row) + 4 * len(fields)
+            if chunk and (size + row_size > budget or len(chunk) >= BATCH_MAX_ROWS):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(row)
+            size += row_size
+        if chunk:
+            yield chunk
+
+    def batch_insert(self, tablename, new_data, dead_letter=None):
+        """ Insert new_data (list of dicts with identical schemas) into indicated tablename
+        using parameterized executemany() statements.
+
+        Rows are sent in chunks sized to fit comfortably within the server's max_allowed_packet,
+        each chunk committed on its own.  Inside a transaction() block nothing is committed here: each
+        chunk counts as one of the block's statements (see commit_every).  If a chunk fails, it is
+        rolled back (inside a transaction() block, to a savepoint taken before it) and retried one row
+        at a time; rows that still fail are rejected: written as JSON lines (with the error) to the
+        dead_letter file if one is supplied, and logged either way.
 
         :param tablename: name of table to receive new rows
-        :param new_data: list of field:value dictionaries
+        :param new_data: list of field:value dictionaries (fields are taken from the first one)
+        :param dead_letter: (str) path of file to append rejected rows to [default: None]
+        :return: (int) number of rows inserted
         """
-        # suss out the schema of the dictionaries.
-        fields = new_data[0].keys()
-
-        # store each set of values in a list
-        all_values = []
-
-        for field_value_dict in new_data:
-            _, values = self._get_fields_and_values(field_value_dict, quote_values=True)
-            all_values.append('(%s)' % ','.join(values))
-
-        sql = 'insert into '+tablename+' (%s) values %s' % (','.join(fields), ','.join(all_values))
-        try:
-            cursor = self.cursor(sql)
-        except Exception as error:
-            print(sql)
-            print(error)
-            from IPython import embed; embed()
-            return False
-
-        if cursor.lastrowid:
-            print('Batch Insert Done. Last insert id =', cursor.lastrowid)
-            return True
+        if not new_data:
+            return 0
+
+        fields = list(new_data[0].keys())
+        rows = [[field_value_dict.get(field) for field in fields] for field_value_dict in new_data]
+        sql = 'insert into %s (%s) values (%s)' % (tablename, ','.join(fields), ','.join(['%s' for _ in fields]))
+        budget = int(self.max_allowed_packet() * BATCH_PACKET_FRACTION)
+
+        inserted = 0
+        rejected = []
+        self._thread_state().last_write = time.time()
+        in_transaction = getattr(self._thread_state(), 'uow', None) is not None
+        with self.connection() as conn:
+            for chunk in self._batch_chunks(rows, fields, budget):
+                self._thread_state().dirty = True
+                cursor = conn.cursor()
+                # let executemany() build multi-row statements up to our budget (default is 64KB).
+                cursor.max_stmt_length = budget
+                try:
+                    if in_transaction:
+                        cursor.execute('savepoint batch_chunk')
+                    start = time.time()
+                    cursor.executemany(sql, chunk)
+                    fire_query_hooks(sql, (), (time.time() - start) * 1000, len(chunk), 'executemany', self._db_name)
+                    self._statement_done(conn)
+                    inserted += len(chunk)
+                    continue
+                except MySQLdb.Error as error:
+                    if is_connection_error(error):
+                        raise
+                    if in_transaction:
+                        cursor.execute('rollback to savepoint batch_chunk')
+                    else:
+                        self._rollback(conn)
+                    log.info('batch_insert into %s: chunk of %i rows failed (%r); retrying row by row',
+                             tablename, len(chunk), error)
+                finally:
+                    cursor.close()
+
+                self._thread_state().dirty = True
+                for row in chunk:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(sql, row)
+                        inserted += 1
+                    except MySQLdb.Error as error:
+                        if is_connection_error(error):
+                            raise
+                        rejected.append((dict(zip(fields, row)), error))
+                    finally:
+                        cursor.close()
+                self._statement_done(conn)
+
+        if rejected:
+            log.error('batch_insert into %s: %i rows rejected%s', tablename, len(rejected),
+                      ' (see %s)' % dead_letter if dead_letter else '')
+            if dead_letter:
+                with open(dead_letter, 'a') as fh:
+                    for row, error in rejected:
+                        fh.write(json.dumps({'table': tablename, 'error': '%r' % error, 'row': row}, default=str) + '\n')
+            else:
+                for row, error in rejected:
+                    log.error('rejected: %r (%r)', row, error)
 
+        return inserted
 
     def insert(self, tablename, field_value_dict, None_as_null=False):
         """ Insert field_value_dict into indicated tablename.
@@ -210,6 +525,19 @@ class SQLData(object):
         cursor = self.execute(sql, *values)
         return cursor.lastrowid
 
+    def add_index(self, tablename, name, columns):
+        """ Adds index `name` on columns (e.g. "Pos, Ref, Alt") to tablename, unless the table already
+        has an index of that name.
+
+        :return: (bool) whether the index was added
+        """
+        row = self.fetchrow('select INDEX_NAME from information_schema.STATISTICS where TABLE_SCHEMA=%s '
+                            'and TABLE_NAME=%s and INDEX_NAME=%s limit 1', self._db_name, tablename, name)
+        if row:
+            return False
+        self.execute('alter table {} add index {} ({})'.format(tablename, name, columns))
+        return True
+
     def drop_table(self, tablename):
         return self.execute('drop table if exists ' + tablename)
 
@@ -224,13 +552,14 @@ class SQLData(object):
         :param sql: (str)
         :return: MySQLdb cursor object
         """
-        log.debug('SQL.execute ' + sql, *args)
+        # (formatted only if SQLDEBUG is on)
+        log.debug('SQL.execute %s %r', sql, args)
 
         #try:
-        cursor = self.cursor(sql, *args)
-        log.debug('SQL.execute ' + sql % args)
-        cursor.close()
-        self.conn.commit()
+        with self.connection() as conn:
+            cursor = self.cursor(sql, *args)
+            cursor.close()
+            self._statement_done(conn)
         return cursor
         #except Exception as err:
         #    log.info('Medgen SQL ERROR: %r' % err)
@@ -2,14 +2,22 @@ from __future__ import absolute_import, print_function
 
 from metavariant import Variant, VariantComponents
 from metavariant.exceptions import RejectedSeqVar, CriticalHgvsError
-from medgen.db.clinvar import ClinVarDB
+
+from MySQLdb import IntegrityError
 
 from aminosearch.sqldata import SQLData
 from aminosearch.config import get_process_log
 
 import re
+import sys
 import subprocess
 
+# number of component inserts grouped into each transaction.
+COMMIT_EVERY = 1000
+
+# seconds the server waits on the (streaming) read of the source table while process_row() runs.
+NET_WRITE_TIMEOUT = 3600
+
 SOURCE_TABLENAME = 'clinvar.t2g_variant_summary'
 TARGET_TABLENAME = 'clinvar.t2g_hgvs_components'
 
@@ -167,12 +175,17 @@ def add_components_to_row(db, dbrow, comp):
         print()
         return False
 
+    except IntegrityError as error:
+        # (PMID, hgvs_text) already added; InnoDB only rolls back this statement, not the transaction.
+        print_dbrow_with_components(dbrow, 'duplicate')
+        return False
+
 
 def main():
     global UNUSABLE
     global GOOD
 
-    db = ClinVarDB()
+    db = SQLData(name='clinvar')
     
     # hello, are you there MySQL? It's me, python.
     db.ping()
@@ -208,21 +221,23 @@ def main():
 
     log.info('Rows in %s: %i' % (SOURCE_TABLENAME, res['cnt']))
 
-    rows = db.fetchall('select * from '+SOURCE_TABLENAME+' order by rand()')
-
+    # stream the source table (rather than loading all of it); iterate() uses its own connection,
+    # so inserts into the target table proceed (COMMIT_EVERY per transaction) while iterating.
     count = 0
     total_added = 0
-    for row in rows:
-        count += 1
-        print(count, '/', res['cnt'], ':', row['variant_name'])
-        results = process_row(db, row)
-        if len(results) == 0:
-            UNUSABLE += 1
-        else:
-            GOOD += 1
-        total_added += len(results)
-
-    return len(rows), total_added
+    with db.transaction(commit_every=COMMIT_EVERY):
+        for row in db.iterate('select * from '+SOURCE_TABLENAME, batch_size=5000,
+                              net_write_timeout=NET_WRITE_TIMEOUT):
+            count += 1
+            print(count, '/', res['cnt'], ':', row['variant_name'])
+            results = process_row(db, row)
+            if len(results) == 0:
+                UNUSABLE += 1
+            else:
+                GOOD += 1
+            total_added += len(results)
+
+    return count, total_added
 
 
 if __name__=='__main__':
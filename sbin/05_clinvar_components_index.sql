@@ -4,6 +4,10 @@ call create_index('t2g_hgvs_components', 'PMID');
 call create_index('t2g_hgvs_components', 'Symbol');
 call create_index('t2g_hgvs_components', "Symbol,Pos,Ref");
 call create_index('t2g_hgvs_components', "Symbol,Pos,Ref,Alt");
+-- composite index for ClinVarAminoDB searches by GeneID (same name as ClinVarAminoDB.COMPONENTS_INDEX).
+alter table t2g_hgvs_components add index GeneID_Pos_Ref_Alt (GeneID, Pos, Ref, Alt);
+-- range index for position-window searches without a GeneID (ClinVarAminoDB.POSITION_INDEX).
+alter table t2g_hgvs_components add index SeqType_Pos (SeqType, Pos);
 
 -- index this column for rapid selection of example HGVS strings (e.g. HGVS like "NM_%")
 call create_index('clinvar_hgvs', 'HGVS');
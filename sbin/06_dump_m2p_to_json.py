@@ -17,34 +17,38 @@ M2P_JSON_DATA = 'data/m2p.json'
 """
 
 db = sqldata.SQLData()
-table = db.fetchall('select * from mutation2pubtator')
 
-new_rows = []
-row_tmpl = {'Mentions': '', 'PMID': None, 'Components': '',
-            'edit_type': False, 'seq_type': '', 'ref': '', 'pos': '', 'alt': '' }
-
-open(M2P_JSON_DATA, 'w').write(json.dumps(table))
-
-for row in table:
-    #print('')
-    if row['Components']:
-        components = row['Components'].split('|')
-    else:
-        components = ['','','','','',]
-
-    if len(components) < 5:
-        continue
-
-    new_row = row.copy()
-    new_row['seq_type'] = components[0]
-    new_row['edit_type'] = components[1]
-    new_row['ref'] = components[2]
-    new_row['pos'] = components[3]
-    new_row['alt'] = components[4]
-
-    print(new_row)
-    new_rows.append(new_row)
+# stream rows out of MySQL (and into the JSON file) instead of loading the whole table into memory.
+count = 0
+represented = 0
+
+with open(M2P_JSON_DATA, 'w') as fh:
+    fh.write('[')
+    for row in db.iterate('select * from mutation2pubtator', batch_size=10000):
+        if count:
+            fh.write(', ')
+        fh.write(json.dumps(row))
+        count += 1
+
+        #print('')
+        if row['Components']:
+            components = row['Components'].split('|')
+        else:
+            components = ['','','','','',]
+
+        if len(components) < 5:
+            continue
+
+        new_row = row.copy()
+        new_row['seq_type'] = components[0]
+        new_row['edit_type'] = components[1]
+        new_row['ref'] = components[2]
+        new_row['pos'] = components[3]
+        new_row['alt'] = components[4]
+
+        print(new_row)
+        represented += 1
+    fh.write(']')
 
 print('Finished dump mutation2pubtator table to data/m2p.json')
-print(len(new_rows), 'represented.')
-
+print(count, 'rows dumped,', represented, 'represented.')
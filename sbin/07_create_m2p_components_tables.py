@@ -2,6 +2,7 @@
 # 
 #   Some data cleaning issues yet unresolved. Probably missing a few thousand entries
 #       due to batch-insert failures on insufficiently cleaned data.
+#       (Those rows are now written to M2P_REJECTED_ROWS instead of being lost.)
 
 import json
 import math
@@ -11,15 +12,23 @@ import sys
 from metavariant import VariantComponents
 
 from aminosearch.sqldata import SQLData
+from aminosearch.pubtatordb import PubtatorDB
+from aminosearch.positions import position_columns
 from aminosearch.config import get_data_log
 
 log = get_data_log('logs/sqldata.log')
 
 TABLENAME_TEMPLATE = 'm2p_%s'
+
+# m2p_general rows joined to their GeneIDs (see create_gene2m2p_table); PubtatorDB.GENE_TABLE.
+GENE_M2P_TABLENAME = 'gene2m2p'
 M2P_JSON_DATA = 'data/m2p.json'
 
-# limit of rows to collect, for testing purposes. Set to None to turn off testing.
-ROW_LIMIT = 100
+# rows that MySQL refuses during batch inserts end up here (one JSON object per line).
+M2P_REJECTED_ROWS = 'data/m2p_rejected.dump'
+
+# main_one_at_a_time(): number of inserts grouped into each transaction.
+COMMIT_EVERY = 5000
 
 # === Mutation Component Types, with examples and tmVar format statements === #
 # 
@@ -91,6 +100,9 @@ def create_all_edittype_table(db):
       EditType varchar(255) default NULL,
       Ref varchar(255) default NULL,
       Pos varchar(255) default NULL,
+      PosStart int(11) default NULL,
+      PosEnd int(11) default NULL,
+      `Offset` int(11) default NULL,
       Alt varchar(255) default NULL,
       DupX varchar(255) default NULL,
       FS_Pos varchar(255) default NULL,
@@ -114,6 +126,9 @@ def create_component_table(db, edit_type):
       EditType varchar(255) default NULL,
       Ref varchar(255) default NULL,
       Pos varchar(255) default NULL,
+      PosStart int(11) default NULL,
+      PosEnd int(11) default NULL,
+      `Offset` int(11) default NULL,
       Alt varchar(255) default NULL
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci''' % edit_type)
 
@@ -131,6 +146,9 @@ def create_dup_table(db):
       EditType varchar(255) default NULL,
       Ref varchar(255) default NULL,
       Pos varchar(255) default NULL,
+      PosStart int(11) default NULL,
+      PosEnd int(11) default NULL,
+      `Offset` int(11) default NULL,
       Alt varchar(255) default NULL,
       DupX varchar(255) default NULL
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci''')
@@ -149,6 +167,9 @@ def create_fs_table(db):
       EditType varchar(255) default NULL,
       Ref varchar(255) default NULL,
       Pos varchar(255) default NULL,
+      PosStart int(11) default NULL,
+      PosEnd int(11) default NULL,
+      `Offset` int(11) default NULL,
       Alt varchar(255) default NULL,
       FS_Pos varchar(255) default NULL
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci''')
@@ -181,6 +202,42 @@ def create_gene2mutation2pubmed_table(db):
     db.execute('call create_index("gene2mutation2pubmed", "GeneID,Components")')
 
 
+def create_gene2m2p_table(db):
+    """Creates (and fills, from m2p_general and gene2pubtator) a table of parsed mutation
+    components keyed by GeneID, so that PubtatorDB can look up a gene's mutations with one
+    index range scan instead of joining gene2pubtator to an m2p table.
+
+    Run after the m2p tables are populated.
+
+    :param db: SQLData object already connected to MySQL PubTator database.
+    """
+    db.drop_table(GENE_M2P_TABLENAME)
+    db.execute('''CREATE TABLE %s (
+      GeneID int(10) unsigned NOT NULL,
+      PMID int(10) unsigned DEFAULT NULL,
+      Components varchar(200) COLLATE utf8_unicode_ci DEFAULT NULL,
+      Mentions text COLLATE utf8_unicode_ci NOT NULL,
+      SeqType varchar(255) default NULL,
+      EditType varchar(255) default NULL,
+      Ref varchar(255) default NULL,
+      Pos varchar(255) default NULL,
+      PosStart int(11) default NULL,
+      PosEnd int(11) default NULL,
+      `Offset` int(11) default NULL,
+      Alt varchar(255) default NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci''' % GENE_M2P_TABLENAME)
+
+    db.execute('''insert into %s
+        select distinct  G.GeneID, M.PMID, M.Components, M.Mentions, M.SeqType, M.EditType, M.Ref, M.Pos,
+                         M.PosStart, M.PosEnd, M.Offset, M.Alt
+                   from  gene2pubtator G, m2p_general M
+                   where G.PMID=M.PMID and M.EditType != "rs"''' % GENE_M2P_TABLENAME)
+
+    # (prefix lengths keep the key within InnoDB's index size limit; Ref/Alt are rarely longer.)
+    db.execute('call create_index("%s", "GeneID,EditType(16),Pos(64),Ref(64),Alt(64)")' % GENE_M2P_TABLENAME)
+    db.add_index(GENE_M2P_TABLENAME, *PubtatorDB.GENE_POSITION_INDEX)
+
+
 def parse_components(components):
     for name, re_patt in list(component_patterns.items()):
         match = re_patt.search(components)
@@ -218,6 +275,9 @@ def get_new_row(row):
         write_unhandled_row(row)
         return None
     new_row.update(component_dict)
+    if 'Pos' in new_row:
+        # numeric PosStart, PosEnd and Offset, for position-window searches (PubtatorDB.search_window).
+        new_row.update(position_columns(new_row['Pos']))
     return new_row
 
 
@@ -277,6 +337,14 @@ def create_indices(db):
     db.execute("call create_index('m2p_general', 'SeqType')")
     db.execute("call create_index('m2p_general', 'EditType')")
 
+    # composite (Pos, Ref, Alt, PMID) index used by PubtatorDB searches (see PubtatorDB.add_indexes).
+    added = PubtatorDB().add_indexes()
+    print('@@@ Added %s index to: %s' % (PubtatorDB.M2P_INDEX[0], ', '.join(added)))
+
+    # (PosStart, PMID) index used by position-window searches (see PubtatorDB.add_position_columns).
+    added = PubtatorDB().add_position_indexes()
+    print('@@@ Added %s index to: %s' % (PubtatorDB.POSITION_INDEX[0], ', '.join(added)))
+
 def main_one_at_a_time():
     db = setup_db()
 
@@ -291,24 +359,28 @@ def main_one_at_a_time():
 
     broken = 0
     total = 0
-    for row in table:
-        new_row = get_new_row(row)
-        if new_row:
-            total += 1
-            if total % progress_tick == 0:
-                sys.stdout.write('.')
-                sys.stdout.flush()
+    with db.transaction(commit_every=COMMIT_EVERY):
+        for row in table:
+            new_row = get_new_row(row)
+            if new_row:
+                total += 1
+                if total % progress_tick == 0:
+                    sys.stdout.write('.')
+                    sys.stdout.flush()
 
-            db.insert('m2p_' + new_row['EditType'].upper(), new_row)
+                db.insert('m2p_' + new_row['EditType'].upper(), new_row)
 
-            # m2p_general
-            db.insert('m2p_general', new_row)
+                # m2p_general
+                db.insert('m2p_general', new_row)
 
-        else:
-            broken += 1
+            else:
+                broken += 1
 
     create_indices(db)
 
+    print('@@@ Setting up %s table (with indexes)...' % GENE_M2P_TABLENAME)
+    create_gene2m2p_table(db)
+
     print('')
     print('@@@ RESULTS:')
     print('Total rows processed from mutation2pubtator:', total + broken)
@@ -352,17 +424,19 @@ def main():
         tname = TABLENAME_TEMPLATE % edit_type
         print('\n@@@ Adding %i rows to %s table' % (len(rows), tname))
 
-        row_index = 0
-        while row_index < len(rows):
-            db.batch_insert(tname, rows[row_index:row_index + ROW_LIMIT])
+        added = db.batch_insert(tname, rows, dead_letter=M2P_REJECTED_ROWS)
 
-            # m2p_general
-            db.batch_insert('m2p_general', rows[row_index:row_index + ROW_LIMIT])
-            row_index = row_index + ROW_LIMIT
+        # m2p_general
+        db.batch_insert('m2p_general', rows, dead_letter=M2P_REJECTED_ROWS)
 
-        total_added += len(rows)
+        if added < len(rows):
+            print('@@@ %i rows rejected from %s (see %s)' % (len(rows) - added, tname, M2P_REJECTED_ROWS))
+        total_added += added
 
     create_indices(db)
+
+    print('@@@ Setting up %s table (with indexes)...' % GENE_M2P_TABLENAME)
+    create_gene2m2p_table(db)
     print('')
     print('@@@ RESULTS:')
     print('Total rows processed from mutation2pubtator:', total + broken)
@@ -0,0 +1,29 @@
+# Builds the memory-mapped PubTator mutation index (aminosearch.m2pindex) from the m2p_general and
+# gene2pubtator tables.  Run after 07_create_m2p_components_tables.py (and again whenever it is rerun).
+#
+# Usage: python sbin/08_build_m2p_index.py [path]    (default: data/m2p_index.npy)
+#
+# Point the web app at it with text2gene_M2P_INDEX=<path>; workers pick up a rebuilt index when restarted.
+
+import sys
+import time
+
+from aminosearch import PubtatorDB
+from aminosearch.m2pindex import build_m2p_index, meta_path
+
+M2P_INDEX_PATH = 'data/m2p_index.npy'
+
+path = sys.argv[1] if len(sys.argv) > 1 else M2P_INDEX_PATH
+
+
+def progress(count):
+    sys.stdout.write('\r    %i rows read' % count)
+    sys.stdout.flush()
+
+
+print('@@@ Exporting m2p_general (with GeneIDs) to %s...' % path)
+start = time.time()
+total = build_m2p_index(PubtatorDB(), path, progress=progress)
+print('')
+print('@@@ Wrote %i rows in %.0fs (metadata: %s)' % (total, time.time() - start, meta_path(path)))
+print('@@@ DONE')
@@ -0,0 +1,30 @@
+# Builds the granular match tables (lvg_mappings, clinvar_match, pubtator_match) in bulk from the
+# values already stored in the *_cache tables.  Nothing is recomputed, and re-running is harmless
+# (existing matches are upserted).
+#
+# google_match can't be backfilled this way: its cache keys are query strings, not hgvs_text.
+#
+# Usage: python sbin/backfill_granular_tables.py [reset]
+#
+# "reset" drops and recreates each granular table first.  Tables created before they had unique
+# keys must be upgraded first with sbin/migrate_cache_tables.py (or reset).
+
+import sys
+import time
+
+from text2gene.cached import ClinvarCachedQuery, PubtatorCachedQuery
+from text2gene.lvg_cached import VariantLVGCached
+
+
+def report(tablename, scanned, written):
+    print('[%s] <%i> %i cache rows scanned, %i entries written' % (tablename, time.time(), scanned, written))
+
+
+reset = sys.argv[1:] == ['reset']
+
+for cache in [VariantLVGCached(), ClinvarCachedQuery(), PubtatorCachedQuery()]:
+    print('@@@ %s --> %s' % (cache.tablename, cache.granular_table))
+    if reset:
+        cache.create_granular_table()
+    total = cache.backfill_granular(progress=report)
+    print('@@@ %s: done, %i entries written' % (cache.granular_table, total))
@@ -0,0 +1,125 @@
+# Times the PubTator (m2p_*) and ClinVar (t2g_hgvs_components) component searches for the variants in
+# the data/ sample sets, before and after adding the composite search indexes.
+#
+# Usage: python sbin/benchmark_search_indexes.py [--migrate] [--limit=<n>] [sample files...]
+#
+# Without --migrate, prints one set of timings (run it before and after sbin/migrate_search_indexes.py).
+# With --migrate, times the searches, adds the indexes (as migrate_search_indexes.py does), times them
+# again and prints both.  LVG lookups and a warm-up pass run first, so only the searches themselves are
+# timed, on a warm buffer pool.
+#
+# PubTator searches are timed on the m2p tables (as if there were no gene2m2p table), with and
+# without a Gene ID.
+
+import sys
+import time
+
+from medgen.api import GeneID
+
+from aminosearch import PubtatorDB, ClinVarAminoDB
+from aminosearch.instrument import LatencyHistogram
+from text2gene.api import LVG
+from text2gene.pmid_lookups import lex_components
+from text2gene.warmer import read_hgvs_file
+
+SAMPLE_FILES = ['data/clinvar_random_samples.txt', 'data/samples_BRCAx.tsv', 'data/colorgen_BRCA1_vus.tsv',
+                'data/colorgen_BRCA2_vus.tsv', 'data/colorgen_PTEN_vus.tsv', 'data/colorgen_SMAD3_vus.tsv']
+
+SEARCHES = ['pubtator (gene)', 'pubtator (no gene)', 'clinvar (gene)']
+
+migrate = '--migrate' in sys.argv
+limit = None
+paths = []
+for arg in sys.argv[1:]:
+    if arg.startswith('--limit='):
+        limit = int(arg.split('=', 1)[1])
+    elif not arg.startswith('--'):
+        paths.append(arg)
+
+pubtator_db = PubtatorDB()
+# benchmark the m2p tables themselves, not the gene2m2p fast path.
+pubtator_db.gene_table = None
+pubtator_db._gene_table_checked = True
+clinvar_db = ClinVarAminoDB()
+
+
+def load_components(paths):
+    """ Returns list of (gene_id, VariantComponents) for every usable variant in the sample files. """
+    hgvs_texts = []
+    for path in paths:
+        hgvs_texts.extend(read_hgvs_file(path))
+    if limit:
+        hgvs_texts = hgvs_texts[:limit]
+
+    print('@@@ Building LVGs for %i HGVS strings...' % len(hgvs_texts))
+    items = []
+    for hgvs_text in hgvs_texts:
+        try:
+            lex = LVG(hgvs_text)
+            gene_id = GeneID(lex.gene_name)
+        except Exception as error:
+            print('[%s] skipped: %r' % (hgvs_text, error))
+            continue
+        _, components_list = lex_components(lex)
+        items.extend((gene_id, comp) for comp in components_list)
+    return items
+
+
+def run_search(search, gene_id, comp):
+    if search == 'clinvar (gene)':
+        return clinvar_db.search(comp, gene_id, strict=True)
+    if search == 'pubtator (no gene)':
+        gene_id = None
+    if comp.seqtype == 'p':
+        return pubtator_db.search_proteins(comp, gene_id)
+    return pubtator_db.search_m2p(comp, gene_id)
+
+
+def run_all(items):
+    """ Runs every search for every item; returns dictionary of search -> LatencyHistogram. """
+    histograms = dict((search, LatencyHistogram()) for search in SEARCHES)
+    for gene_id, comp in items:
+        for search in SEARCHES:
+            start = time.time()
+            try:
+                run_search(search, gene_id, comp)
+            except Exception:
+                # (e.g. edit types without an m2p table)
+                continue
+            histograms[search].record((time.time() - start) * 1000)
+    return histograms
+
+
+def print_report(label, histograms):
+    print()
+    print('@@@ %s' % label)
+    print('%-20s %8s %10s %10s %10s %10s' % ('search', 'count', 'total ms', 'mean ms', 'p95 ms', 'max ms'))
+    for search in SEARCHES:
+        stats = histograms[search].to_dict()
+        print('%-20s %8i %10.0f %10s %10s %10s' % (search, stats['count'], histograms[search].total_ms,
+                                                    stats['mean_ms'], stats['p95_ms'], stats['max_ms']))
+
+
+items = load_components(paths or SAMPLE_FILES)
+print('@@@ %i searchable variant components' % len(items))
+
+print('@@@ Warm-up pass...')
+run_all(items)
+
+before = run_all(items)
+print_report('Current indexes', before)
+
+if migrate:
+    print()
+    print('@@@ Adding composite indexes...')
+    print('    m2p tables: %s' % (', '.join(pubtator_db.add_indexes()) or 'already present'))
+    print('    t2g_hgvs_components: %s' % (', '.join(clinvar_db.add_indexes()) or 'already present'))
+    run_all(items)
+    after = run_all(items)
+    print_report('With composite indexes', after)
+
+    print()
+    print('@@@ Speedup (total time before / after)')
+    for search in SEARCHES:
+        if after[search].total_ms:
+            print('%-20s %8.1fx' % (search, before[search].total_ms / after[search].total_ms))
@@ -0,0 +1,54 @@
+# Upgrades existing *_cache tables in place to the current SQLCache table layout.
+#
+#   * cache_value: JSON --> LONGBLOB (allows compressed values; old JSON rows still read)
+#   * cache_key: VARCHAR(255) utf8 --> BINARY(16) md5 digest (old key text kept in key_text)
+#   * (version, date_created) index for sbin/sweep_cache_versions.py
+#   * date_created index for sbin/purge_cache.py
+#   * unique key on the granular match tables (lvg_mappings, clinvar_match, pubtator_match,
+#     google_match), after deleting duplicate matches
+#
+# Safe to run more than once.
+#
+# A granular table with an older column layout (e.g. lvg_mappings with one hgvs_c/hgvs_g/... column
+# per seqtype instead of seqtype + alias) can't be upgraded in place; it is skipped, with the
+# command that rebuilds it from the cache table.
+
+from text2gene.cached import ClinvarCachedQuery, PubtatorCachedQuery
+from text2gene.lvg_cached import VariantLVGCached
+from text2gene.googlequery import GoogleCachedQuery
+
+# rebuilds each granular table (in the current layout) from the values in its cache table.
+REBUILD_COMMANDS = {'lvg_mappings': 'python sbin/regenerate_lvg_mappings.py reset',
+                    # google_match can't be backfilled; recreated empty, it refills as queries run.
+                    'google_match': 'GoogleCachedQuery().create_granular_table() after dropping google_match'}
+DEFAULT_REBUILD_COMMAND = 'python sbin/backfill_granular_tables.py reset'
+
+for cache in [VariantLVGCached(), ClinvarCachedQuery(), PubtatorCachedQuery(), GoogleCachedQuery()]:
+    print('@@@ %s' % cache.tablename)
+    if cache.upgrade_value_column():
+        print('    cache_value converted to LONGBLOB')
+    else:
+        print('    cache_value already LONGBLOB')
+
+    if cache.migrate_cache_keys():
+        print('    cache_key converted to BINARY(16)')
+    else:
+        print('    cache_key already BINARY(16)')
+
+    added = cache.add_indexes()
+    if added:
+        print('    added indexes: %s' % ', '.join(added))
+    else:
+        print('    indexes already present')
+
+    columns = cache.granular_columns()
+    missing = [column for column in cache.GRANULAR_FIELDS if column not in columns]
+    if not columns:
+        print('    %s: no table' % cache.granular_table)
+    elif missing:
+        print('    %s: SKIPPED: older layout (no %s column); rebuild it with: %s' % (
+              cache.granular_table, ', '.join(missing), REBUILD_COMMANDS.get(cache.granular_table, DEFAULT_REBUILD_COMMAND)))
+    elif cache.add_granular_unique_key():
+        print('    %s: duplicates removed, unique key added' % cache.granular_table)
+    else:
+        print('    %s: unique key already present' % cache.granular_table)
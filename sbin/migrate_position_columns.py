@@ -0,0 +1,33 @@
+# Adds the numeric position columns (PosStart, PosEnd, Offset) and their range indexes to existing
+# PubTator m2p_* tables (and gene2m2p), and the SeqType_Pos index to clinvar.t2g_hgvs_components,
+# for PubtatorDB.search_window and ClinVarAminoDB.search_window.
+#
+# Tables made by a current sbin/07_create_m2p_components_tables.py already have them.
+# Safe to run more than once.
+
+import sys
+
+from aminosearch import PubtatorDB, ClinVarAminoDB
+
+
+def progress(tablename, done, total):
+    if done % 1000 == 0 or done == total:
+        sys.stdout.write('\r    %s: %i / %i positions' % (tablename, done, total))
+        if done == total:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+
+
+print('@@@ PubTator m2p tables')
+added = PubtatorDB().add_position_columns(progress=progress)
+if added:
+    print('    added position columns to: %s' % ', '.join(added))
+else:
+    print('    position columns already present')
+
+print('@@@ clinvar.t2g_hgvs_components')
+added = ClinVarAminoDB().add_indexes()
+if added:
+    print('    added indexes: %s' % ', '.join(added))
+else:
+    print('    indexes already present')
@@ -0,0 +1,22 @@
+# Adds the composite search indexes to existing PubTator and ClinVar component tables:
+#
+#   * (Pos, Ref, Alt, PMID) on each m2p_* table (PubtatorDB.M2P_INDEX)
+#   * (GeneID, Pos, Ref, Alt) on clinvar.t2g_hgvs_components (ClinVarAminoDB.COMPONENTS_INDEX)
+#
+# Safe to run more than once.  See sbin/benchmark_search_indexes.py to measure the difference.
+
+from aminosearch import PubtatorDB, ClinVarAminoDB
+
+print('@@@ PubTator m2p tables')
+added = PubtatorDB().add_indexes()
+if added:
+    print('    added %s to: %s' % (PubtatorDB.M2P_INDEX[0], ', '.join(added)))
+else:
+    print('    indexes already present')
+
+print('@@@ clinvar.t2g_hgvs_components')
+added = ClinVarAminoDB().add_indexes()
+if added:
+    print('    added indexes: %s' % ', '.join(added))
+else:
+    print('    indexes already present')
@@ -1,8 +1,10 @@
 import time
 
 from medgen.api import ClinVarDB
-from text2gene import LVG
+from text2gene.api import LVGMany
 
+# number of variants looked up (and stored) per round trip to the cache.
+BATCH_SIZE = 500
 
 hgvs_examples = ClinVarDB().fetchall('select * from samples_vus')
 
@@ -13,13 +15,14 @@ print()
 def dmesg(hgvs_text, msg):
     print('[%s] <%i> %s' % (hgvs_text, time.time(), msg))
 
-for entry in hgvs_examples:
-    hgvs_text = entry['HGVS']
-    dmesg(hgvs_text, 'collecting')
-    try:
-        lex = LVG(hgvs_text)
-        dmesg(hgvs_text, '%r' % lex.variants)
-    except Exception as error:
-        dmesg(hgvs_text, '%r' % error)
-    dmesg(hgvs_text, 'done')
+hgvs_texts = [entry['HGVS'] for entry in hgvs_examples]
 
+for idx in range(0, len(hgvs_texts), BATCH_SIZE):
+    batch = hgvs_texts[idx:idx + BATCH_SIZE]
+    dmesg('%i-%i' % (idx, idx + len(batch)), 'collecting')
+    for hgvs_text, lex in zip(batch, LVGMany(batch)):
+        if lex is None:
+            dmesg(hgvs_text, 'could not create LVG')
+        else:
+            dmesg(hgvs_text, '%r' % lex.variants)
+    dmesg('%i-%i' % (idx, idx + len(batch)), 'done')
@@ -0,0 +1,32 @@
+# Enforces each cache's retention policy (SQLCache.RETENTION) in small chunks (safe to run on a live service).
+#
+# Usage: python sbin/purge_cache.py [days]
+#
+# Supplying days purges entries older than that many days from every cache, regardless of RETENTION.
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+from text2gene.cached import ClinvarCachedQuery, PubtatorCachedQuery
+from text2gene.lvg_cached import VariantLVGCached
+from text2gene.googlequery import GoogleCachedQuery
+
+try:
+    before = datetime.now() - timedelta(days=int(sys.argv[1]))
+except IndexError:
+    before = None
+
+
+def report(tablename, deleted):
+    print('[%s] <%i> %i expired entries deleted' % (tablename, time.time(), deleted))
+
+
+for cache in [VariantLVGCached(), ClinvarCachedQuery(), PubtatorCachedQuery(), GoogleCachedQuery()]:
+    if before is None and cache.RETENTION is None:
+        print('@@@ %s: no retention policy (kept until version change); skipping' % cache.tablename)
+        continue
+    cutoff = before or datetime.now() - timedelta(seconds=cache.RETENTION)
+    print('@@@ %s: purging entries created before %s' % (cache.tablename, cutoff))
+    total = cache.purge(cutoff, progress=report)
+    print('@@@ %s: done, %i expired entries deleted' % (cache.tablename, total))
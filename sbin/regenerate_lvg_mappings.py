@@ -1,12 +1,22 @@
+# Rebuilds lvg_mappings from the LVG objects already stored in hgvslvg_cache (nothing is recomputed).
+#
+# Usage: python sbin/regenerate_lvg_mappings.py [reset]
+#
+# "reset" drops and recreates lvg_mappings first (required if it predates the (hgvs_text, alias) unique key).
 
-from text2gene.lvg_cached import LVG, HgvsLVGCached
+import sys
+import time
 
-db = HgvsLVGCached()
-db.execute('delete from lvg_mappings where hgvs_text is not NULL')
-all_rows = db.fetchall('select * from hgvslvg_cache order by rand()')
+from text2gene.lvg_cached import VariantLVGCached
 
-for row in all_rows:
-    hgvs_text = row['cache_key'].strip()
-    lex = LVG(hgvs_text, force_granular=True)
-    print(lex)
 
+def report(tablename, scanned, written):
+    print('[%s] <%i> %i cache rows scanned, %i mappings written' % (tablename, time.time(), scanned, written))
+
+
+db = VariantLVGCached()
+if sys.argv[1:] == ['reset']:
+    db.create_granular_table()
+
+total = db.backfill_granular(progress=report)
+print('@@@ %s: done, %i mappings written' % (db.granular_table, total))
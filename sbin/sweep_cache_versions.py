@@ -0,0 +1,19 @@
+# Purges cache entries left behind by a VERSION bump, in small chunks (safe to run on a live service).
+#
+# Usage: python sbin/sweep_cache_versions.py
+
+import time
+
+from text2gene.cached import ClinvarCachedQuery, PubtatorCachedQuery
+from text2gene.lvg_cached import VariantLVGCached
+from text2gene.googlequery import GoogleCachedQuery
+
+
+def report(tablename, deleted):
+    print('[%s] <%i> %i stale entries deleted' % (tablename, time.time(), deleted))
+
+
+for cache in [VariantLVGCached(), ClinvarCachedQuery(), PubtatorCachedQuery(), GoogleCachedQuery()]:
+    print('@@@ %s (current version: %i)' % (cache.tablename, cache.VERSION))
+    total = cache.sweep_versions(progress=report)
+    print('@@@ %s: done, %i stale entries deleted' % (cache.tablename, total))
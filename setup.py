@@ -34,6 +34,7 @@ setup(
                             'hgvs2pmid = text2gene.__main__:hgvs2pmid_cli',
                             'hgvsfile2pmid = text2gene.__main__:cli_hgvsfile2pmid',
                             'googlequery = text2gene.__main__:googlequery_cli',
+                            'warm_cache = text2gene.warmer:main',
                             ] 
                    },
     cmdclass = {'build_ext': build_ext},
@@ -54,5 +55,10 @@ setup(
         'Flask-BasicAuth',
         'better-exceptions',
         ],
+    extras_require = {
+        'msgpack': ['msgpack'],  # compact LVG cache values (falls back to JSON without it)
+        'async': ['aiomysql'],  # aminosearch.asyncdb / text2gene.async_cached
+        'm2pindex': ['numpy'],  # aminosearch.m2pindex (memory-mapped PubTator mutation index)
+        },
     )
 
@@ -0,0 +1,28 @@
+import asyncio
+import unittest
+
+from aminosearch import PubtatorDB
+from aminosearch.asyncdb import AsyncPubtatorDB, aiomysql
+
+test_sql = 'select * from m2p_SUB where SeqType="c" limit 10'
+
+
+@unittest.skipIf(aiomysql is None, 'aiomysql not installed')
+class TestAsyncPubtatorDB(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_fetchall_matches_sync(self):
+        rows = self.run_async(AsyncPubtatorDB().fetchall(test_sql))
+        assert rows == list(PubtatorDB().fetchall(test_sql))
+
+    def test_concurrent_fetches(self):
+        db = AsyncPubtatorDB()
+
+        async def fetch_all():
+            return await asyncio.gather(*[db.fetchrow(test_sql) for _ in range(5)])
+
+        rows = self.run_async(fetch_all())
+        assert len(rows) == 5
+        assert all(row == rows[0] for row in rows)
@@ -0,0 +1,24 @@
+import unittest
+
+from text2gene.cache_stats import CacheStats, LatencyHistogram
+
+
+class TestCacheStats(unittest.TestCase):
+
+    def test_histogram(self):
+        hist = LatencyHistogram(buckets=[1, 10, 100])
+        for ms in [0.5, 5, 5, 50, 500]:
+            hist.record(ms)
+        assert hist.count == 5
+        assert hist.percentile(50) == 10
+        assert hist.percentile(100) == 500
+        assert hist.to_dict()['buckets'] == {'<=1': 1, '<=10': 2, '<=100': 1, '>100': 1}
+
+    def test_counters(self):
+        stats = CacheStats('test')
+        stats.incr('hits', 3)
+        stats.incr('misses')
+        outd = stats.to_dict()
+        assert outd['hits'] == 3
+        assert outd['hit_ratio'] == 0.75
+        assert outd['retrieve_latency']['count'] == 0
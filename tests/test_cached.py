@@ -25,3 +25,12 @@ class TestVariantLVGCached(unittest.TestCase):
         lex = LVG(test_hgvs_c)
         assert lex.hgvs_text == test_hgvs_c
 
+
+    def test_LVG_cache_value_roundtrip(self):
+        lex = LVG(test_hgvs_c)
+        stored = lvg_cache_db.encode_cache_value(lvg_cache_db.get_cache_value(lex))
+        loaded = lvg_cache_db.load_cache_value(lvg_cache_db.decode_cache_value(stored))
+        assert loaded.hgvs_text == lex.hgvs_text
+        assert sorted(loaded.hgvs_c) == sorted(lex.hgvs_c)
+        assert loaded.gene_name == lex.gene_name
+        assert sorted(loaded.variants['p'].keys()) == sorted(lex.variants['p'].keys())
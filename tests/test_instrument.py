@@ -0,0 +1,97 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from aminosearch.instrument import normalize_sql, QueryStats, SlowQueryLog, add_query_hook, remove_query_hook, fire_query_hooks
+
+
+def event(sql, ms, rows=1):
+    return {'sql': sql, 'args': (), 'statement': normalize_sql(sql), 'ms': ms, 'rows': rows,
+            'method': 'execute', 'db': 'pubtator'}
+
+
+class TestNormalizeSql(unittest.TestCase):
+
+    def test_literals_and_placeholders(self):
+        sql = 'select * from m2p_SUB where Pos=%s and Ref in ("A", "G")'
+        assert normalize_sql(sql) == 'select * from m2p_SUB where Pos=? and Ref in (?+)'
+        assert normalize_sql('select *   from m2p_SUB\n where Pos=151') == 'select * from m2p_SUB where Pos=?'
+
+    def test_multirow_values(self):
+        sql = 'insert into x (a,b) values (%s,%s), (%s,%s), (%s,%s)'
+        assert normalize_sql(sql) == 'insert into x (a,b) values (?+), ...'
+
+
+class TestQueryStats(unittest.TestCase):
+
+    def test_groups_by_statement(self):
+        stats = QueryStats()
+        stats(event('select * from m2p_SUB where Pos=1', 10, rows=3))
+        stats(event('select * from m2p_SUB where Pos=2', 30, rows=2))
+        stats(event('select * from m2p_DEL where Pos=2', 5))
+        report = stats.to_dict()
+        assert list(report.keys())[0] == 'select * from m2p_SUB where Pos=?'
+        assert report['select * from m2p_SUB where Pos=?']['count'] == 2
+        assert report['select * from m2p_SUB where Pos=?']['rows'] == 5
+        assert len(stats.to_dict(top=1)) == 1
+
+    def test_max_statements(self):
+        stats = QueryStats(max_statements=1)
+        stats(event('select * from a', 1))
+        stats(event('select * from b', 1))
+        stats(event('select * from c', 1))
+        assert stats.to_dict()['(other)']['count'] == 2
+
+
+class TestHooks(unittest.TestCase):
+
+    def test_failing_hook(self):
+        seen = []
+
+        def broken(event):
+            raise ValueError('broken hook')
+
+        add_query_hook(broken)
+        add_query_hook(seen.append)
+        try:
+            fire_query_hooks('select 1', (), 1.0, 1, 'execute', 'pubtator')
+        finally:
+            remove_query_hook(broken)
+            remove_query_hook(seen.append)
+        assert len(seen) == 1
+
+
+class TestSlowQueryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logger = logging.getLogger('pubtatordb-slowquery')
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+        shutil.rmtree(self.tmpdir)
+
+    def test_timestamped_lines(self):
+        filepath = os.path.join(self.tmpdir, 'slowquery.log')
+        slow_log = SlowQueryLog(threshold_ms=100, sample_rate=1, filepath=filepath)
+        slow_log(event('select * from m2p_SUB where Pos=1', 10))
+        slow_log(event('select * from m2p_SUB where Pos=1', 250))
+        with open(filepath) as fh:
+            lines = fh.read().splitlines()
+        assert len(lines) == 1
+        assert re.match(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+\t250\.0ms\tpubtator\t', lines[0])
+
+    def test_args_truncated(self):
+        filepath = os.path.join(self.tmpdir, 'slowquery.log')
+        slow_log = SlowQueryLog(threshold_ms=100, sample_rate=1, filepath=filepath, max_args_chars=50)
+        slow = event('insert into x (a,b) values (%s,%s), ...', 250)
+        slow['args'] = tuple(range(10000))
+        slow_log(slow)
+        with open(filepath) as fh:
+            line = fh.read().strip()
+        assert line.endswith('\t(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14,... (10000 args)')
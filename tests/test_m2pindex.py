@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+from aminosearch.m2pindex import np, build_m2p_index, meta_path, open_m2p_index, M2PIndex
+
+Comp = namedtuple('Comp', ['seqtype', 'edittype', 'ref', 'pos', 'alt'])
+
+M2P_ROWS = [
+    {'GeneID': 4087, 'PMID': 1, 'EditType': 'SUB', 'SeqType': 'c', 'Pos': '919', 'Ref': 'G', 'Alt': 'C'},
+    {'GeneID': 672, 'PMID': 1, 'EditType': 'SUB', 'SeqType': 'c', 'Pos': '919', 'Ref': 'G', 'Alt': 'C'},
+    {'GeneID': 4087, 'PMID': 2, 'EditType': 'SUB', 'SeqType': 'c', 'Pos': '919', 'Ref': 'G', 'Alt': 'T'},
+    {'GeneID': 4087, 'PMID': 3, 'EditType': 'SUB', 'SeqType': 'p', 'Pos': '307', 'Ref': 'Arg', 'Alt': 'Gly'},
+    {'GeneID': 0, 'PMID': 4, 'EditType': 'DEL', 'SeqType': 'c', 'Pos': '91', 'Ref': 'G', 'Alt': None},
+    {'GeneID': 4087, 'PMID': 5, 'EditType': 'INS', 'SeqType': 'c', 'Pos': '12_13', 'Ref': None, 'Alt': 'A' * 100},
+    {'GeneID': 4087, 'PMID': 6, 'EditType': 'DUP', 'SeqType': 'c', 'Pos': '50', 'Ref': None, 'Alt': 'T'},
+]
+
+
+class FakePubtatorDB(object):
+
+    def fetchrow(self, sql, *args):
+        return dict((field, max(len(row[field] or '') for row in M2P_ROWS))
+                    for field in ('EditType', 'SeqType', 'Pos', 'Ref', 'Alt'))
+
+    def iterate(self, sql, *args, **kwargs):
+        return iter(M2P_ROWS)
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestM2PIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'm2p_index.npy')
+        assert build_m2p_index(FakePubtatorDB(), path, chunk_size=2) == 6
+        self.index = M2PIndex(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_search_m2p(self):
+        rows = self.index.search_m2p(Comp('c', 'SUB', 'G', '919', 'C'), 4087)
+        assert [(row['PMID'], row['GeneID'], row['Alt']) for row in rows] == [(1, 4087, 'c')]
+        # without a gene, each mutation once.
+        assert [row['PMID'] for row in self.index.search_m2p(Comp('c', 'SUB', 'g', '919', 'c'), None)] == [1]
+        assert self.index.search_m2p(Comp('c', 'SUB', 'G', '9', 'C'), 4087) == []
+
+    def test_null_values(self):
+        # a NULL Alt (or Ref) is not the same as '', and (like in MySQL) never matches.
+        assert self.index.search_m2p(Comp('c', 'DEL', 'G', '91', ''), None) == []
+        assert self.index.search_m2p(Comp('c', 'DEL', 'G', '91', None), None) == []
+        assert [row['Alt'] for row in self.index.lookup('91', 'G')] == [None]
+        assert self.index.lookup('50', '') == []
+        assert self.index.lookup('50', None) == []
+
+    def test_search_proteins(self):
+        comp = Comp('p', '', 'Arg', '307', 'Ser')
+        assert [row['PMID'] for row in self.index.search_proteins(comp, 4087)] == [3]
+        assert self.index.search_proteins(comp, 4087, strict=True) == []
+
+    def test_overflow_left_to_mysql(self):
+        comps = [Comp('c', 'INS', '', '12_13', 'A' * 100), Comp('c', 'SUB', 'G', '919', 'T')]
+        results = self.index.search_many(comps, 4087)
+        assert results[0] is None
+        assert [row['PMID'] for row in results[1]] == [2]
+
+    def test_old_index_not_used(self):
+        path = os.path.join(self.tmpdir, 'old_index.npy')
+        np.save(path, np.zeros(1, dtype=[('key', 'S8'), ('GeneID', '<u4'), ('PMID', '<u4')]))
+        shutil.copy(meta_path(self.index.path), meta_path(path))
+        assert open_m2p_index(path) is None
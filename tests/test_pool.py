@@ -0,0 +1,89 @@
+import os
+import unittest
+
+from aminosearch import pool as pool_module
+from aminosearch.pool import ConnectionPool, get_pool
+from aminosearch.exceptions import PoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self):
+        self.pings += 1
+        if not self.alive:
+            raise Exception('MySQL server has gone away')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = ConnectionPool(FakeConnection, maxsize=2)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is conn
+        assert pool.stats()['connects'] == 1
+
+    def test_reconnect_on_failed_ping(self):
+        pool = ConnectionPool(FakeConnection, maxsize=2, ping_after=-1)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.alive = False
+        newconn = pool.checkout()
+        assert newconn is not conn
+        assert conn.closed
+        assert pool.stats()['reconnects'] == 1
+        assert pool.size == 1
+
+    def test_max_age(self):
+        pool = ConnectionPool(FakeConnection, maxsize=2, max_age=-1)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is not conn
+        assert pool.stats()['recycled'] == 1
+
+    def test_timeout(self):
+        pool = ConnectionPool(FakeConnection, maxsize=1, timeout=0.05)
+        pool.checkout()
+        self.assertRaises(PoolTimeout, pool.checkout)
+        assert pool.stats()['timeouts'] == 1
+
+    def test_ping_only_when_idle(self):
+        pool = ConnectionPool(FakeConnection, maxsize=2, ping_after=60)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is conn
+        assert conn.pings == 0
+        pool.checkin(conn)
+        pool._returned[id(conn)] -= 120
+        assert pool.checkout() is conn
+        assert conn.pings == 1
+
+    def test_rollback_only_when_dirty(self):
+        pool = ConnectionPool(FakeConnection, maxsize=2)
+        conn = pool.checkout()
+        pool.checkin(conn, dirty=False)
+        assert conn.rollbacks == 0
+        assert pool.checkout() is conn
+        pool.checkin(conn)
+        assert conn.rollbacks == 1
+
+    def test_pools_per_process(self):
+        pool = get_pool('pool-host', 'db', 'user', FakeConnection)
+        assert get_pool('pool-host', 'db', 'user', FakeConnection) is pool
+        # what a forked child sees: its parent's pools are dropped and new ones made.
+        key = (os.getpid(), 'pool-host', 'db', 'user')
+        pool_module._pools[(-1,) + key[1:]] = pool_module._pools.pop(key)
+        pool_module._reset_after_fork()
+        assert get_pool('pool-host', 'db', 'user', FakeConnection) is not pool
@@ -0,0 +1,61 @@
+import unittest
+from collections import namedtuple
+
+from aminosearch.positions import parse_position
+from aminosearch.pubtatordb import PubtatorQueries
+from aminosearch.clinvardb import ClinVarQueries
+from aminosearch.exceptions import PubtatorDBError, ClinVarDBError
+
+Comp = namedtuple('Comp', ['seqtype', 'edittype', 'ref', 'pos', 'alt'])
+
+
+class TestParsePosition(unittest.TestCase):
+
+    def test_positions(self):
+        assert parse_position('2153') == (2153, 2153, 0)
+        assert parse_position('2153_2155') == (2153, 2155, 0)
+        assert parse_position('4320+1') == (4320, 4320, 1)
+        assert parse_position('88-12') == (88, 88, -12)
+        assert parse_position('-1224') == (-1224, -1224, 0)
+        assert parse_position('1285+3_1301-2') == (1285, 1301, 3)
+        assert parse_position(415) == (415, 415, 0)
+
+    def test_unparseable(self):
+        assert parse_position('*45') == (None, None, None)
+        assert parse_position('') == (None, None, None)
+        assert parse_position(None) == (None, None, None)
+
+
+class TestSearchWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = PubtatorQueries()
+
+    def test_window_query(self):
+        sql, args = self.queries.search_window_query(Comp('c', 'SUB', 'G', '919+2', 'C'), 4087, window=5)
+        assert 'gene2pubtator' in sql and 'SeqType!="p"' in sql
+        assert args == (4087, 914, 924)
+
+        self.queries.gene_table = 'gene2m2p'
+        sql, args = self.queries.search_window_query(Comp('p', '', 'Arg', '307', 'Gly'), 4087, window=5)
+        assert sql.endswith('from gene2m2p where GeneID=%s and SeqType="p" and PosStart between %s and %s')
+        assert args == (4087, 302, 312)
+
+    def test_unparseable_position(self):
+        with self.assertRaises(PubtatorDBError):
+            self.queries.search_window_query(Comp('c', 'SUB', 'G', '*45', 'C'), None)
+
+
+class TestClinVarSearchWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = ClinVarQueries()
+
+    def test_window_query(self):
+        sql, args = self.queries.search_clinvar_window_query(Comp('c', 'SUB', 'G', '919', 'C'), 4087, window=5)
+        assert sql.endswith('where GeneID=%s and SeqType=%s and Pos between %s and %s')
+        assert args == (4087, 'c', 914, 924)
+
+    def test_unparseable_position(self):
+        with self.assertRaises(ClinVarDBError):
+            self.queries.search_clinvar_window_query(Comp('c', 'SUB', 'G', '*45', 'C'), None)
@@ -0,0 +1,108 @@
+import threading
+import unittest
+from collections import namedtuple
+
+from aminosearch.prefetch import PubtatorGenePrefetch, ClinVarGenePrefetch
+
+Comp = namedtuple('Comp', ['seqtype', 'edittype', 'ref', 'pos', 'alt'])
+
+GENE_ROWS = {
+    672: [{'PMID': 1, 'SeqType': 'c', 'EditType': 'SUB', 'Pos': '919', 'Ref': 'G', 'Alt': 'C'},
+          {'PMID': 2, 'SeqType': '', 'EditType': 'SUB', 'Pos': '919', 'Ref': 'G', 'Alt': 'T'},
+          {'PMID': 3, 'SeqType': 'p', 'EditType': 'SUB', 'Pos': '307', 'Ref': 'Arg', 'Alt': 'Gly'}],
+    675: [{'PMID': 4, 'SeqType': 'c', 'EditType': 'DEL', 'Pos': '12', 'Ref': 'T', 'Alt': ''}],
+    7157: [{'PMID': pmid, 'SeqType': 'p', 'EditType': 'SUB', 'Pos': '175', 'Ref': 'R', 'Alt': 'H'}
+           for pmid in range(10)],
+}
+
+
+class FakePubtatorDB(object):
+
+    GENE_TABLE_COLUMNS = 'PMID, Components, Mentions, SeqType, EditType, Ref, Pos, Alt'
+    gene_table = 'gene2m2p'
+
+    def __init__(self):
+        self.queries = []
+
+    def check_gene_table(self):
+        pass
+
+    def fetchall(self, sql, *args):
+        self.queries.append((sql, args))
+        return GENE_ROWS.get(args[0], [])[:args[-1]]
+
+    def search_many(self, components_list, gene_id, strict=False):
+        return [['db'] for _ in components_list]
+
+
+class TestGenePrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakePubtatorDB()
+        self.prefetch = PubtatorGenePrefetch(self.db, max_genes=2, max_rows=5)
+
+    def test_one_query_per_gene(self):
+        comps = [Comp('c', 'SUB', 'g', '919', 'c'), Comp('c', 'SUB', 'G', '919', 'A'), Comp('p', '', 'Arg', '307', 'Ser')]
+        results = self.prefetch.search_many(comps, 672)
+        assert [[row['PMID'] for row in rows] for rows in results] == [[1], [], [3]]
+        assert self.prefetch.search_m2p(Comp('c', 'SUB', 'G', '919', 'T'), 672)[0]['PMID'] == 2
+        assert len(self.db.queries) == 1
+        sql, args = self.db.queries[0]
+        assert sql == 'select distinct ' + self.db.GENE_TABLE_COLUMNS + ' from gene2m2p where GeneID=%s limit %s'
+        assert args == (672, 6)
+
+    def test_concurrent_loads(self):
+        loading = threading.Event()
+        release = threading.Event()
+        fetchall = self.db.fetchall
+
+        def slow_fetchall(sql, *args):
+            if args[0] == 672:
+                loading.set()
+                release.wait(5)
+            return fetchall(sql, *args)
+
+        self.db.fetchall = slow_fetchall
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.prefetch.gene_positions(672)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        assert loading.wait(5)
+        # while 672 loads, other genes can still be loaded and looked up.
+        other = threading.Thread(target=lambda: results.append(self.prefetch.lookup(675, '12', 'T')))
+        other.start()
+        other.join(2)
+        assert not other.is_alive()
+        assert results.pop()[0]['PMID'] == 4
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 3 and all(positions is results[0] for positions in results)
+        # one query for 672 (shared by the three threads), one for 675.
+        assert sorted(args[0] for sql, args in self.db.queries) == [672, 675]
+
+    def test_lru_over_genes(self):
+        self.prefetch.gene_positions(672)
+        self.prefetch.gene_positions(675)
+        self.prefetch.gene_positions(672)
+        # max_genes=2: adding a third gene drops the least recently used one (675).
+        self.prefetch.gene_positions(999)
+        assert list(self.prefetch._genes) == [672, 999]
+
+    def test_gene_too_big(self):
+        comps = [Comp('p', 'SUB', 'R', '175', 'H')]
+        assert self.prefetch.search_many(comps, 7157) == [['db']]
+        assert self.prefetch.search_many(comps, 7157) == [['db']]
+        assert len(self.db.queries) == 1
+        assert len(self.prefetch) == 0
+
+
+class TestClinVarGenePrefetch(unittest.TestCase):
+
+    def test_search(self):
+        db = FakePubtatorDB()
+        prefetch = ClinVarGenePrefetch(db)
+        assert [row['PMID'] for row in prefetch.search(Comp('c', 'SUB', 'G', '919', 'C'), 672)] == [1, 2]
+        assert [row['PMID'] for row in prefetch.search(Comp('c', 'SUB', 'G', '919', 'C'), 672, strict=True)] == [1]
+        assert db.queries == [('select * from clinvar.t2g_hgvs_components where GeneID=%s limit %s', (672, 500001))]
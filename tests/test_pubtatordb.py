@@ -0,0 +1,51 @@
+import unittest
+from collections import namedtuple
+
+from aminosearch.pubtatordb import PubtatorQueries
+
+Comp = namedtuple('Comp', ['seqtype', 'edittype', 'ref', 'pos', 'alt'])
+
+
+class TestSearchMany(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = PubtatorQueries()
+        # the same c. edit on two transcripts, a different c. edit, and a protein edit.
+        self.comps = [Comp('c', 'SUB', 'G', '919', 'C'),
+                      Comp('c', 'SUB', 'G', '919', 'C'),
+                      Comp('c', 'DEL', 'T', '12', ''),
+                      Comp('p', '', 'Arg', '307', 'Gly')]
+
+    def test_one_statement_per_table(self):
+        keys = [self.queries.search_key(comp, 4087) for comp in self.comps]
+        statements = list(self.queries.search_many_queries(keys, 4087))
+        assert sorted(tablename for tablename, _, _, _ in statements) == ['m2p_DEL', 'm2p_SUB', 'm2p_general']
+
+        for tablename, columns, sql, args in statements:
+            if tablename == 'm2p_SUB':
+                assert args == [4087, '919', 'g', 'c']
+                assert sql.endswith('(M.Pos,M.Ref,M.Alt) in ((%s,%s,%s))')
+            if tablename == 'm2p_general':
+                assert columns == ('SeqType', 'Pos', 'Ref')
+
+    def test_rows_mapped_to_components(self):
+        keys = [self.queries.search_key(comp, 4087) for comp in self.comps]
+        sub_rows = [{'PMID': 1, 'Pos': '919', 'Ref': 'G', 'Alt': 'C'}]
+        protein_rows = [{'PMID': 2, 'SeqType': 'p', 'Pos': '307', 'Ref': 'Arg', 'Alt': 'Gly'}]
+        results = self.queries.map_search_many(keys, [('m2p_SUB', ('Pos', 'Ref', 'Alt'), sub_rows),
+                                                      ('m2p_general', ('SeqType', 'Pos', 'Ref'), protein_rows)])
+        assert [[row['PMID'] for row in rows] for rows in results] == [[1], [1], [], [2]]
+
+    def test_gene_table(self):
+        self.queries.gene_table = 'gene2m2p'
+        keys = [self.queries.search_key(comp, 4087) for comp in self.comps[:3]]
+        statements = list(self.queries.search_many_queries(keys, 4087))
+        assert len(statements) == 1
+        tablename, columns, sql, args = statements[0]
+        assert 'gene2pubtator' not in sql
+        assert columns == ('EditType', 'Pos', 'Ref', 'Alt')
+        assert args == [4087, 'sub', '919', 'g', 'c', 'del', '12', 't', '']
+
+        sql, args = self.queries.search_m2p_query(self.comps[0], 4087)
+        assert sql.endswith('from gene2m2p where GeneID=%s and EditType=%s and Pos=%s and Ref=%s and Alt=%s')
+        assert args == (4087, 'SUB', '919', 'G', 'C')
@@ -0,0 +1,81 @@
+import unittest
+
+from aminosearch.sqldata import SQLData
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 1
+
+    def execute(self, sql, args=None):
+        self.conn.statements.append(sql)
+
+    def fetchall(self):
+        return [{'host': self.conn.host}]
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, host, alive=True):
+        self.host = host
+        self.alive = alive
+        self.statements = []
+
+    def ping(self):
+        pass
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSQLData(SQLData):
+    """ SQLData whose connections are FakeConnections; hosts listed in down refuse connections. """
+
+    def __init__(self, *args, **kwargs):
+        self.down = kwargs.pop('down', [])
+        super(FakeSQLData, self).__init__(*args, **kwargs)
+
+    def connect(self, host=None):
+        host = host or self._db_host
+        if host in self.down:
+            raise Exception('Can\'t connect to MySQL server on %s' % host)
+        return FakeConnection(host)
+
+
+class TestReadReplicas(unittest.TestCase):
+
+    def test_reads_go_to_replica(self):
+        db = FakeSQLData(host='primary-1', replicas=['replica-1'])
+        assert db.fetchrow('select 1')['host'] == 'replica-1'
+
+    def test_no_replicas(self):
+        db = FakeSQLData(host='primary-2', replicas=[])
+        assert db.fetchrow('select 1')['host'] == 'primary-2'
+
+    def test_read_your_writes(self):
+        db = FakeSQLData(host='primary-3', replicas=['replica-3'])
+        db.execute('insert into t values (1)')
+        assert db.fetchrow('select 1')['host'] == 'primary-3'
+
+    def test_connection_block_stays_on_primary(self):
+        db = FakeSQLData(host='primary-4', replicas=['replica-4'])
+        with db.connection():
+            assert db.fetchrow('select 1')['host'] == 'primary-4'
+
+    def test_replica_down(self):
+        db = FakeSQLData(host='primary-5', replicas=['replica-5'], down=['replica-5'])
+        assert db.fetchrow('select 1')['host'] == 'primary-5'
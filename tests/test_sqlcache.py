@@ -0,0 +1,454 @@
+import asyncio
+import hashlib
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from text2gene.async_cached import AsyncSQLCache
+from text2gene.sqlcache import LocalCache, SQLCache, ZLIB_MARKER, BINARY_PREFIX
+
+
+class FakeSQLCache(SQLCache):
+    """ SQLCache over a dictionary of rows instead of MySQL. """
+
+    LOCAL_CACHE_SIZE = 0
+
+    def __init__(self, servicename):
+        super(FakeSQLCache, self).__init__(servicename)
+        self.rows = {}
+        # (sql, args) of every statement run through fetchall / execute.
+        self.statements = []
+        # value "another worker" stores while this one waits in single_flight.
+        self.stored_while_waiting = None
+
+    def get_row(self, querydict):
+        return self.rows.get(self.get_key_digest(querydict))
+
+    def fetchall(self, sql, *args):
+        # get_rows: "where cache_key in (...)"; rows come back in no particular order.
+        self.statements.append((sql, args))
+        return [self.rows[key] for key in reversed(args) if key in self.rows]
+
+    def execute(self, sql, *args):
+        # store_many: multi-row "insert ... on duplicate key update" of (cache_key, key_text, cache_value, version).
+        self.statements.append((sql, args))
+        for idx in range(0, len(args), 4):
+            key, key_text, cache_value, version = args[idx:idx + 4]
+            self.rows[key] = {'cache_key': key, 'cache_value': cache_value, 'version': version, 'date_created': None}
+        return FakeCursor()
+
+    def store(self, querydict, value, **kwargs):
+        key = self.get_key_digest(querydict)
+        self.rows[key] = {'cache_key': key, 'cache_value': self.encode_cache_value(self.get_cache_value(value)),
+                          'version': self.VERSION, 'date_created': None}
+        return True
+
+    @contextmanager
+    def single_flight(self, querydict):
+        if self.stored_while_waiting is not None:
+            self.store(querydict, self.stored_while_waiting)
+        yield
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LocalCache(maxsize=10)
+        assert cache.get('key') is None
+        cache.put('key', [1, 2, 3])
+        assert cache.get('key') == [1, 2, 3]
+
+    def test_lru_eviction(self):
+        cache = LocalCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_expiry(self):
+        cache = LocalCache(maxsize=10, ttl=-1)
+        cache.put('key', 'value')
+        assert cache.get('key') is None
+
+    def test_version(self):
+        cache = LocalCache(maxsize=10)
+        cache.put('key', 'value', version=1)
+        assert cache.get('key', version=1) == 'value'
+        assert cache.get('key', version=2) is None
+
+    def test_admission(self):
+        cache = LocalCache(maxsize=10, admit_after=2)
+        cache.get('key')
+        assert not cache.put('key', 'value')
+        cache.get('key')
+        assert cache.put('key', 'value')
+        assert cache.get('key') == 'value'
+
+
+class TestRetrieve(unittest.TestCase):
+
+    def test_tiers_and_versions(self):
+        cache = FakeSQLCache('test_retrieve_tiers')
+        cache.local_cache = LocalCache(maxsize=10)
+        cache.store({'q': 1}, [1])
+        assert cache.retrieve({'q': 1}) == [1]
+        # filled the local tier on the MySQL hit.
+        cache.rows.clear()
+        assert cache.retrieve({'q': 1}) == [1]
+        cache.VERSION = 1
+        cache.store({'q': 2}, [2])
+        cache.rows[cache.get_key_digest({'q': 2})]['version'] = 0
+        cache.local_cache.clear()
+        assert cache.retrieve({'q': 2}, version=1) is None
+        stats = cache.stats.to_dict()
+        assert (stats['hits'], stats['local_hits'], stats['stale_rejects'], stats['misses']) == (2, 1, 1, 1)
+
+
+class TestRetrieveOrCompute(unittest.TestCase):
+
+    def test_computed(self):
+        cache = FakeSQLCache('test_computed')
+        assert cache.retrieve_or_compute({'q': 1}, lambda: [1]) == ([1], False)
+        assert cache.retrieve_or_compute({'q': 1}, lambda: [2]) == ([1], True)
+        stats = cache.stats.to_dict()
+        assert (stats['misses'], stats['hits'], stats['retrieve_latency']['count']) == (1, 1, 2)
+
+    def test_stored_while_waiting(self):
+        cache = FakeSQLCache('test_stored_while_waiting')
+        cache.stored_while_waiting = [3]
+        assert cache.retrieve_or_compute({'q': 1}, lambda: [4]) == ([3], True)
+        # one lookup: a single miss, timed once.
+        stats = cache.stats.to_dict()
+        assert (stats['misses'], stats['hits'], stats['retrieve_latency']['count']) == (1, 0, 1)
+        assert stats['compute_latency']['count'] == 0
+
+
+class TestNegativeCaching(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_negative_' + self._testMethodName)
+        self.cache.NEGATIVE_CACHE_TTL = 3600
+
+    def store_row(self, value, age):
+        key = self.cache.get_key_digest({'q': 1})
+        self.cache.rows[key] = {'cache_key': key, 'cache_value': self.cache.encode_cache_value(self.cache.get_cache_value(value)),
+                                'version': 0, 'date_created': datetime.now() - timedelta(seconds=age)}
+
+    def test_fresh_negative_is_hit(self):
+        self.store_row([], 60)
+        assert self.cache.retrieve({'q': 1}) == []
+        stats = self.cache.stats.to_dict()
+        assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 1, 0)
+
+    def test_expired_negative_is_miss(self):
+        self.store_row([], 7200)
+        assert self.cache.retrieve({'q': 1}) is None
+        # positive values don't expire.
+        self.store_row([123], 7200)
+        assert self.cache.retrieve({'q': 1}) == [123]
+        stats = self.cache.stats.to_dict()
+        assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 0, 1)
+
+    def test_local_ttl_capped(self):
+        self.cache.local_cache = LocalCache(maxsize=10, ttl=self.cache.LOCAL_CACHE_TTL)
+        self.cache.NEGATIVE_CACHE_TTL = 60
+        self.cache._local_put(b'negative', [], 0)
+        self.cache._local_put(b'positive', [1], 0)
+        expires = dict((key, entry[2] - time.time()) for key, entry in self.cache.local_cache._entries.items())
+        assert 50 < expires[b'negative'] <= 60
+        assert expires[b'positive'] > self.cache.LOCAL_CACHE_TTL - 10
+        # ...but never beyond LOCAL_CACHE_TTL.
+        self.cache.NEGATIVE_CACHE_TTL = self.cache.LOCAL_CACHE_TTL * 2
+        self.cache._local_put(b'negative', [], 0)
+        assert self.cache.local_cache._entries[b'negative'][2] - time.time() <= self.cache.LOCAL_CACHE_TTL
+
+
+class TestBulkLookups(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_bulk_' + self._testMethodName)
+        self.cache.BATCH_SIZE = 2
+
+    def test_retrieve_many(self):
+        for idx in range(5):
+            self.cache.store({'q': idx}, [idx])
+        values = self.cache.retrieve_many([{'q': 3}, {'q': 9}, {'q': 0}, {'q': 3}, {'q': 1}, {'q': 4}])
+        assert values == [[3], None, [0], [3], [1], [4]]
+        # 4 distinct keys present (and one missing), asked for BATCH_SIZE at a time.
+        assert [len(args) for sql, args in self.cache.statements] == [2, 2, 1]
+        stats = self.cache.stats.to_dict()
+        assert (stats['hits'], stats['misses']) == (5, 1)
+
+    def test_store_many(self):
+        assert self.cache.store_many([({'q': idx}, [idx]) for idx in range(5)]) == 5
+        assert [len(args) // 4 for sql, args in self.cache.statements] == [2, 2, 1]
+        assert self.cache.retrieve_many([{'q': idx} for idx in range(5)]) == [[idx] for idx in range(5)]
+        assert self.cache.stats.to_dict()['stores'] == 5
+
+    def test_retrieve_or_compute_many(self):
+        self.cache.store({'q': 1}, ['cached'])
+        results = self.cache.retrieve_or_compute_many([{'q': 0}, {'q': 1}, {'q': 2}], lambda querydict: [querydict['q']])
+        assert results == [([0], False), (['cached'], True), ([2], False)]
+        # both computed values written back with one store_many.
+        inserts = [args for sql, args in self.cache.statements if sql.startswith('insert')]
+        assert [len(args) // 4 for args in inserts] == [2]
+
+    def test_compute_error_keeps_computed(self):
+        def compute(querydict):
+            if querydict['q'] == 2:
+                raise ValueError('compute failed')
+            return [querydict['q']]
+
+        with self.assertRaises(ValueError):
+            self.cache.retrieve_or_compute_many([{'q': 0}, {'q': 1}, {'q': 2}, {'q': 3}], compute)
+        assert self.cache.retrieve_many([{'q': idx} for idx in range(4)]) == [[0], [1], None, None]
+
+
+class FakeAsyncDB(object):
+    """ AsyncSQLData running its statements through a FakeSQLCache. """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def fetchall(self, sql, *args):
+        return self.cache.fetchall(sql, *args)
+
+    async def fetchrow(self, sql, *args):
+        rows = self.cache.fetchall(sql, *args)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, *args):
+        return self.cache.execute(sql, *args)
+
+
+class TestAsyncSQLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_async_' + self._testMethodName)
+        self.cache.BATCH_SIZE = 2
+        # (AsyncSQLCache() would open an aiomysql-backed AsyncSQLData.)
+        self.async_cache = AsyncSQLCache.__new__(AsyncSQLCache)
+        self.async_cache.cache = self.cache
+        self.async_cache.db = FakeAsyncDB(self.cache)
+        self.async_cache._flights = {}
+
+    def test_same_statements_as_sync(self):
+        items = [({'q': idx}, [idx]) for idx in range(3)]
+        querydicts = [{'q': 2}, {'q': 9}, {'q': 0}]
+        SQLCache.store(self.cache, {'q': 5}, [5])
+        self.cache.store_many(items)
+        values = self.cache.retrieve_many(querydicts)
+        sync_statements = self.cache.statements
+
+        self.cache.rows, self.cache.statements = {}, []
+        asyncio.run(self.async_cache.store({'q': 5}, [5]))
+        asyncio.run(self.async_cache.store_many(items))
+        assert asyncio.run(self.async_cache.retrieve_many(querydicts)) == values == [[2], None, [0]]
+        assert self.cache.statements == sync_statements
+
+    def test_retrieve(self):
+        asyncio.run(self.async_cache.store({'q': 1}, []))
+        assert asyncio.run(self.async_cache.retrieve({'q': 1})) == []
+        assert asyncio.run(self.async_cache.retrieve({'q': 1}, version=self.cache.VERSION + 1)) is None
+        stats = self.cache.stats.to_dict()
+        assert (stats['hits'], stats['negative_hits'], stats['misses'], stats['stale_rejects']) == (1, 1, 1, 1)
+
+
+class TestCacheValueEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_encoding')
+
+    def test_small_json_stored_plain(self):
+        json_text = self.cache.get_cache_value([1, 2, 3])
+        encoded = self.cache.encode_cache_value(json_text)
+        assert encoded == json_text.encode('utf-8')
+        assert self.cache.decode_cache_value(encoded) == json_text
+
+    def test_large_json_compressed(self):
+        json_text = self.cache.get_cache_value(list(range(1000)))
+        assert len(json_text) >= self.cache.COMPRESS_MIN_SIZE
+        encoded = self.cache.encode_cache_value(json_text)
+        assert encoded.startswith(ZLIB_MARKER)
+        assert len(encoded) < len(json_text)
+        assert self.cache.decode_cache_value(encoded) == json_text
+
+    def test_binary_values(self):
+        for data in [BINARY_PREFIX + b'm' + b'\x01\x02', BINARY_PREFIX + b'm' + b'\xff' * 5000]:
+            encoded = self.cache.encode_cache_value(data)
+            assert encoded.startswith(ZLIB_MARKER) == (len(data) >= self.cache.COMPRESS_MIN_SIZE)
+            assert self.cache.decode_cache_value(encoded) == data
+
+    def test_text_column(self):
+        # rows from a table still using a JSON column come back as text.
+        assert self.cache.decode_cache_value('[1, 2]') == '[1, 2]'
+
+    def test_value_roundtrip(self):
+        for value in [[], {'a': 'b'}, ['x' * 2000]]:
+            encoded = self.cache.encode_cache_value(self.cache.get_cache_value(value))
+            assert self.cache.load_cache_value(self.cache.decode_cache_value(encoded)) == value
+
+
+class FakeCursor(object):
+    rowcount = 0
+
+
+class TestCacheKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_keys')
+
+    def test_canonical_key_text(self):
+        assert self.cache.get_cache_key({'b': 1, 'a': [1, 2]}) == '{"a":[1,2],"b":1}'
+        assert self.cache.get_cache_key({'a': [1, 2], 'b': 1}) == self.cache.get_cache_key({'b': 1, 'a': [1, 2]})
+        # values that aren't JSON types are keyed by their str().
+        assert self.cache.get_cache_key({'a': FakeCursor}) == '{"a":"%s"}' % FakeCursor
+
+    def test_key_digest(self):
+        digest = self.cache.get_key_digest({'b': 1, 'a': 2})
+        assert len(digest) == 16
+        assert digest == hashlib.md5(b'{"a":2,"b":1}').digest()
+        assert digest != self.cache.get_key_digest({'b': 1, 'a': 3})
+
+    def test_migrate_cache_keys_resumes(self):
+        executed = []
+        self.cache.execute = lambda sql, *args: executed.append(sql) or FakeCursor()
+        # a migration interrupted after adding new_key (but not key_text).
+        self.cache.fetchall = lambda sql, *args: [{'COLUMN_NAME': 'cache_key', 'DATA_TYPE': 'varchar'},
+                                                  {'COLUMN_NAME': 'new_key', 'DATA_TYPE': 'binary'}]
+        self.cache.connection = contextmanager(lambda: iter([None]))
+        assert self.cache.migrate_cache_keys()
+        assert executed[0] == 'alter table test_keys_cache add column key_text TEXT default NULL'
+        assert not any('add column new_key' in sql for sql in executed)
+
+    def test_migrate_cache_keys_done(self):
+        executed = []
+        self.cache.execute = lambda sql, *args: executed.append(sql) or FakeCursor()
+        triggers = [{'TRIGGER_NAME': 'test_keys_cache_new_entry_date'}, {'TRIGGER_NAME': 'test_keys_cache_update'}]
+        self.cache.fetchall = lambda sql, *args: triggers if 'TRIGGERS' in sql else \
+            [{'COLUMN_NAME': 'cache_key', 'DATA_TYPE': 'binary'}]
+        self.cache.connection = contextmanager(lambda: iter([None]))
+        assert not self.cache.migrate_cache_keys()
+        assert not executed
+
+    def test_migrate_cache_keys_restores_triggers(self):
+        # a migration that died after its last ALTER, before re-creating the triggers.
+        executed = []
+        self.cache.execute = lambda sql, *args: executed.append(sql) or FakeCursor()
+        self.cache.fetchall = lambda sql, *args: [] if 'TRIGGERS' in sql else \
+            [{'COLUMN_NAME': 'cache_key', 'DATA_TYPE': 'binary'}, {'COLUMN_NAME': 'key_text', 'DATA_TYPE': 'text'}]
+        self.cache.connection = contextmanager(lambda: iter([None]))
+        assert not self.cache.migrate_cache_keys()
+        created = [sql.split()[2] for sql in executed if sql.startswith('create trigger')]
+        assert created == ['`test_keys_cache_new_entry_date`', '`test_keys_cache_update`']
+
+
+class TestGranularUniqueKey(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeSQLCache('test_granular')
+        self.cache.granular_table = 'test_match'
+        self.cache.GRANULAR_FIELDS = ('hgvs_text', 'PMID', 'version')
+        self.cache.GRANULAR_UNIQUE_KEY = ('hgvs_text_PMID', 'hgvs_text, PMID')
+        self.columns = ['hgvs_text', 'PMID', 'version']
+        self.duplicates = []
+        self.executed = []
+        self.cache.execute = lambda sql, *args: self.executed.append((sql, args)) or FakeCursor()
+        self.cache.fetchall = lambda sql, *args: [{'COLUMN_NAME': column} for column in self.columns] \
+            if 'information_schema.COLUMNS' in sql else self.duplicates
+        self.cache.fetchrow = lambda sql, *args: None
+        self.cache.connection = contextmanager(lambda: iter([None]))
+
+    def test_duplicates_removed(self):
+        self.duplicates = [{'hgvs_text': 'NM_000059.3:c.35G>A', 'PMID': 123, 'copies': 3}]
+        assert self.cache.add_granular_unique_key()
+        # keeps one of the three copies (the highest version).
+        assert self.executed[0] == ('delete from test_match where hgvs_text=%s and PMID=%s order by version limit %s',
+                                    ('NM_000059.3:c.35G>A', 123, 2))
+        assert self.executed[-1][0] == 'alter table test_match add unique key hgvs_text_PMID (hgvs_text, PMID)'
+
+    def test_already_present(self):
+        self.cache.fetchrow = lambda sql, *args: {'INDEX_NAME': 'hgvs_text_PMID'}
+        assert not self.cache.add_granular_unique_key()
+        assert not self.executed
+
+    def test_no_table(self):
+        self.columns = []
+        assert not self.cache.add_granular_unique_key()
+        assert not self.executed
+
+    def test_old_layout_skipped(self):
+        # lvg_mappings as created before seqtype + alias (one column per seqtype).
+        self.cache.granular_table = 'lvg_mappings'
+        self.cache.GRANULAR_FIELDS = ('hgvs_text', 'seqtype', 'alias', 'version')
+        self.cache.GRANULAR_UNIQUE_KEY = ('hgvs_text_alias', 'hgvs_text, alias')
+        self.columns = ['hgvs_text', 'hgvs_g', 'hgvs_c', 'hgvs_n', 'hgvs_p', 'version']
+        self.cache.fetchrow = lambda sql, *args: self.fail('should not look for the index')
+        assert not self.cache.add_granular_unique_key()
+        assert not self.executed
+
+
+class TestSweepVersions(unittest.TestCase):
+
+    def test_chunks(self):
+        cache = FakeSQLCache('test_sweep')
+        cache.VERSION = 3
+        cache.SWEEP_CHUNK_SIZE = 2
+        cache.SWEEP_PAUSE = 0
+        stale = [2, 2, 1]
+        executed = []
+
+        def execute(sql, *args):
+            executed.append((sql, args))
+            cursor = FakeCursor()
+            cursor.rowcount = stale.pop(0) if stale else 0
+            return cursor
+
+        progress = []
+        cache.execute = execute
+        assert cache.sweep_versions(progress=lambda tablename, deleted: progress.append((tablename, deleted))) == 5
+        # stopped after the short (third) chunk, without another statement.
+        assert [args for sql, args in executed] == [(3, 2)] * 3
+        assert executed[0][0] == 'delete from test_sweep_cache where version < %s order by version, date_created limit %s'
+        assert progress == [('test_sweep_cache', 2), ('test_sweep_cache', 4), ('test_sweep_cache', 5)]
+        # an explicit version.
+        executed[:] = []
+        assert cache.sweep_versions(version=1) == 0
+        assert [args for sql, args in executed] == [(1, 2)]
+
+
+class TestPurge(unittest.TestCase):
+
+    def test_candidates_read_on_primary(self):
+        cache = FakeSQLCache('test_purge')
+        cache.SWEEP_CHUNK_SIZE = 2
+        cache.SWEEP_PAUSE = 0
+        candidates = [[{'cache_key': b'b'}, {'cache_key': b'a'}], [{'cache_key': b'c'}]]
+        calls = []
+
+        @contextmanager
+        def connection():
+            calls.append('connect')
+            yield
+            calls.append('release')
+
+        def fetchall(sql, *args):
+            calls.append('select')
+            return candidates.pop(0)
+
+        def execute(sql, *args):
+            calls.append(('delete',) + args[1:])
+            cursor = FakeCursor()
+            cursor.rowcount = len(args) - 1
+            return cursor
+
+        cache.connection = connection
+        cache.fetchall = fetchall
+        cache.execute = execute
+        assert cache.purge(before=datetime(2020, 1, 1)) == 3
+        assert calls == ['connect', 'select', ('delete', b'a', b'b'), 'release',
+                         'connect', 'select', ('delete', b'c'), 'release']
@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import MySQLdb
+
+from aminosearch import sqldata
+from aminosearch.sqldata import SQLData
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 1
+        self.rows = []
+
+    def execute(self, sql, args=None):
+        if args is not None and tuple(args) in self.conn.bad_rows:
+            raise MySQLdb.IntegrityError(1062, 'Duplicate entry')
+        self.conn.statements.append(sql)
+        self.rows = list(self.conn.result)
+
+    def executemany(self, sql, rows):
+        self.conn.batches.append(len(rows))
+        if any(tuple(row) in self.conn.bad_rows for row in rows):
+            raise MySQLdb.IntegrityError(1062, 'Duplicate entry')
+
+    def fetchall(self):
+        return [{'host': self.conn.host}]
+
+    def fetchmany(self, size):
+        self.conn.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, host):
+        self.host = host
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        # rows returned by a streaming (SSDictCursor) query, and number of fetchmany() round trips.
+        self.result = []
+        self.fetches = 0
+        # rows that fail to insert, and sizes of the executemany() chunks sent.
+        self.bad_rows = set()
+        self.batches = []
+
+    def ping(self):
+        pass
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSQLData(SQLData):
+    """ SQLData whose connections are FakeConnections. """
+
+    def connect(self, host=None):
+        return FakeConnection(host or self._db_host)
+
+
+class TestConnections(unittest.TestCase):
+
+    def test_cursor_needs_connection_block(self):
+        db = FakeSQLData(host='sqldata-1', replicas=[])
+        self.assertRaises(RuntimeError, db.cursor, 'select 1')
+        with db.connection():
+            assert db.cursor('select 1').fetchall()
+
+    def test_rollback_only_when_dirty(self):
+        db = FakeSQLData(host='sqldata-2', replicas=[])
+        with db.connection() as conn:
+            pass
+        assert conn.rollbacks == 0
+        # execute() commits, so there's nothing to roll back.
+        db.execute('insert into t values (1)')
+        assert (conn.commits, conn.rollbacks) == (1, 0)
+        # a read leaves its snapshot open.
+        db.fetchall('select 1')
+        assert conn.rollbacks == 1
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeSQLData(host='transaction-' + self._testMethodName, replicas=[])
+
+    def test_commit_at_end(self):
+        with self.db.transaction():
+            self.db.execute('insert into t values (1)')
+            self.db.execute('insert into t values (2)')
+            conn = self.db.conn
+            assert conn.commits == 0
+        assert conn.commits == 1
+        assert conn.rollbacks == 0
+
+    def test_commit_every(self):
+        with self.db.transaction(commit_every=2):
+            for idx in range(5):
+                self.db.execute('insert into t values (%s)', idx)
+            conn = self.db.conn
+            assert conn.commits == 2
+        assert conn.commits == 3
+
+    def test_rollback_on_error(self):
+        try:
+            with self.db.transaction():
+                self.db.execute('insert into t values (1)')
+                conn = self.db.conn
+                raise ValueError('oops')
+        except ValueError:
+            pass
+        assert (conn.commits, conn.rollbacks) == (0, 1)
+        assert self.db.conn is None
+
+    def test_nested(self):
+        with self.db.transaction():
+            conn = self.db.conn
+            with self.db.transaction(commit_every=1):
+                self.db.execute('insert into t values (1)')
+                assert self.db.conn is conn
+            # the inner block joined the outer one (and its commit_every was ignored).
+            assert conn.commits == 0
+        assert conn.commits == 1
+
+    def test_batch_insert(self):
+        self.db._max_allowed_packet = 1000
+        with self.db.transaction():
+            conn = self.db.conn
+            conn.bad_rows = set([(3,)])
+            assert self.db.batch_insert('t', [{'ID': idx} for idx in range(5)]) == 4
+            # the failed chunk went back to its savepoint; nothing was committed.
+            assert conn.statements[:2] == ['savepoint batch_chunk', 'rollback to savepoint batch_chunk']
+            assert (conn.commits, conn.rollbacks) == (0, 0)
+        assert conn.commits == 1
+
+
+class TestIterate(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeSQLData(host='iterate-' + self._testMethodName, replicas=[])
+        self.conn = self.db.pool.checkout()
+        self.conn.result = [{'ID': idx} for idx in range(5)]
+        self.db.pool.checkin(self.conn, dirty=False)
+
+    def test_batches(self):
+        rows = list(self.db.iterate('select ID from t', batch_size=2))
+        assert [row['ID'] for row in rows] == list(range(5))
+        # 2 + 2 + 1 rows, then an empty batch.
+        assert self.conn.fetches == 4
+
+    def test_connection_returned(self):
+        list(self.db.iterate('select ID from t'))
+        assert self.db.pool.stats()['in_use'] == 0
+        assert self.db.pool.checkout() is self.conn
+
+    def test_abandoned_connection_discarded(self):
+        rows = self.db.iterate('select ID from t', batch_size=2)
+        next(rows)
+        rows.close()
+        assert self.conn.closed
+        assert self.db.pool.stats()['discarded'] == 1
+        assert self.db.pool.stats()['in_use'] == 0
+
+    def test_net_write_timeout(self):
+        rows = list(self.db.iterate('select ID from t', net_write_timeout=3600))
+        assert len(rows) == 5
+        assert self.conn.statements == ['set session net_write_timeout=%s', 'select ID from t']
+        # not handed back to the pool with the raised timeout.
+        assert self.conn.closed
+        assert self.db.pool.stats()['in_use'] == 0
+
+    def test_statements_while_iterating(self):
+        # the query has its own connection, so other statements can run between rows.
+        for row in self.db.iterate('select ID from t', batch_size=2):
+            with self.db.connection() as conn:
+                assert conn is not self.conn
+
+
+class TestBatchInsert(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeSQLData(host='batch-' + self._testMethodName, replicas=[])
+        self.db._max_allowed_packet = 1000
+        self.conn = self.db.pool.checkout()
+        self.db.pool.checkin(self.conn, dirty=False)
+        self.tmpdir = tempfile.mkdtemp()
+        self.max_rows = sqldata.BATCH_MAX_ROWS
+
+    def tearDown(self):
+        sqldata.BATCH_MAX_ROWS = self.max_rows
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks_within_budget(self):
+        rows = [['x' * 10, 'y' * 10] for _ in range(10)]
+        # each row counts as 20 bytes of values + 4 bytes per field.
+        chunks = list(self.db._batch_chunks(rows, ['a', 'b'], 100))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+        # a row bigger than the budget still goes out (alone).
+        assert [len(chunk) for chunk in self.db._batch_chunks([['x' * 200], ['y']], ['a'], 100)] == [1, 1]
+
+    def test_chunks_max_rows(self):
+        sqldata.BATCH_MAX_ROWS = 4
+        chunks = list(self.db._batch_chunks([[1]] * 10, ['a'], 10 ** 6))
+        assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+
+    def test_insert(self):
+        new_data = [{'ID': idx, 'name': 'row %i' % idx} for idx in range(50)]
+        assert self.db.batch_insert('t', new_data) == 50
+        # budget is half of max_allowed_packet.
+        assert len(self.conn.batches) > 1 and sum(self.conn.batches) == 50
+        assert self.conn.commits == len(self.conn.batches)
+
+    def test_retry_and_dead_letter(self):
+        dead_letter = os.path.join(self.tmpdir, 'rejected.jsonl')
+        new_data = [{'ID': idx} for idx in range(5)]
+        self.conn.bad_rows = set([(3,)])
+        assert self.db.batch_insert('t', new_data, dead_letter=dead_letter) == 4
+        # the failed chunk was rolled back, then retried one row at a time.
+        assert self.conn.rollbacks == 1
+        assert len(self.conn.statements) == 4
+        with open(dead_letter) as fh:
+            rejected = [json.loads(line) for line in fh]
+        assert len(rejected) == 1
+        assert rejected[0]['table'] == 't'
+        assert rejected[0]['row'] == {'ID': 3}
+        assert 'Duplicate entry' in rejected[0]['error']
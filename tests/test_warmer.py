@@ -0,0 +1,52 @@
+import os
+import time
+import unittest
+
+from text2gene.warmer import CacheWarmer, RateLimiter, read_hgvs_file
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data')
+
+
+class FakeCache(object):
+
+    granular = True
+
+    def __init__(self):
+        self.values = {}
+        self.lookups = 0
+        self.granular_stored = []
+
+    def retrieve_or_compute(self, querydict, compute, skip_cache=False):
+        self.lookups += 1
+        if querydict in self.values:
+            return self.values[querydict], True
+        self.values[querydict] = compute()
+        return self.values[querydict], False
+
+
+class TestWarmer(unittest.TestCase):
+
+    def test_read_plain_file(self):
+        hgvs_texts = read_hgvs_file(os.path.join(DATA_DIR, 'colorgen_BRCA1_vus.tsv'))
+        assert hgvs_texts[0] == 'NM_007294.3:c.1033G>T'
+
+    def test_read_tsv_file(self):
+        hgvs_texts = read_hgvs_file(os.path.join(DATA_DIR, 'clinvar_HHT_72.tsv'))
+        assert hgvs_texts[0] == 'NM_000020.2(ACVRL1):c.696_698delCTC'
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(20)
+        start = time.time()
+        for _ in range(5):
+            limiter.wait()
+        assert time.time() - start >= 0.15
+
+    def test_warm_one_lookup_per_variant(self):
+        warmer = CacheWarmer(workers=1)
+        cache = FakeCache()
+        for _ in range(2):
+            assert warmer._warm('clinvar', cache, 'NM_000020.2:c.1A>G', lambda: [1], cache.granular_stored.append) == [1]
+        assert cache.lookups == 2
+        assert cache.granular_stored == [[1]]
+        counts = warmer.counts['clinvar']
+        assert (counts['computed'], counts['cached'], counts['errors']) == (1, 1, 0)
@@ -10,12 +10,16 @@ from hgvs.exceptions import HGVSParseError
 
 from aminosearch import PubtatorDB
 
-from .cached import PubtatorHgvs2Pmid, ClinvarHgvs2Pmid
-from .api import LVG, GoogleQuery
+from .cached import PubtatorHgvs2Pmid, ClinvarHgvs2Pmid, PubtatorHgvs2PmidMany, ClinvarHgvs2PmidMany
+from .api import LVG, LVGMany, GoogleQuery
+from .pmid_lookups import enable_gene_prefetch
 
 
 pubtator_db = PubtatorDB()
 
+# number of hgvs strings looked up together by batch (file-based) commands.
+BATCH_SIZE = 500
+
 SQLDEBUG = True
 
 __author__ = 'Naomi Most <naomi@text2gene.com>'
@@ -196,6 +200,36 @@ def hgvs2pmid(hgvs_text):
         print('[%s] Cannot parse as HGVS; skipping' % hgvs_text)
 
 
+def hgvs_list_to_pmid_results(hgvs_texts):
+    """ Batched version of hgvs_to_pmid_results_dict: uses one bulk cache lookup per
+    service for the whole list.
+
+    :param hgvs_texts: list of hgvs strings
+    :return: list of (hgvs_text, pmid_results) tuples for each usable hgvs_text
+    """
+    lexes = []
+    for hgvs_text, lex in zip(hgvs_texts, LVGMany(hgvs_texts)):
+        if lex is None:
+            print('[%s] Cannot process as HGVS; skipping' % hgvs_text)
+            continue
+        try:
+            edittype = VariantComponents(lex.seqvar).edittype
+        except RejectedSeqVar:
+            edittype = None
+        if edittype not in ['SUB', 'DEL', 'INS', 'FS', 'INDEL']:
+            print('[%s] Cannot process edit type %s; skipping' % (hgvs_text, edittype))
+            continue
+        lexes.append(lex)
+
+    pubtator_results = PubtatorHgvs2PmidMany(lexes)
+    clinvar_results = ClinvarHgvs2PmidMany(lexes)
+
+    out = []
+    for lex, pubtator_pmids, clinvar_pmids in zip(lexes, pubtator_results, clinvar_results):
+        out.append((lex.hgvs_text, {'PubTator': pubtator_pmids, 'ClinVar': clinvar_pmids}))
+    return out
+
+
 #TODO: convert to docopt
 def cli_hgvsfile2pmid():
     import sys
@@ -206,16 +240,14 @@ def cli_hgvsfile2pmid():
         sys.exit()
 
     with open(textfile, 'r') as fh:
-        for hgvs_text in fh.read().split('\n'):
-            if not hgvs_text.strip():
-                continue
-            try:
-                results = hgvs_to_pmid_results_dict(hgvs_text)
-                for key, pmids in results.items():
-                    print('[%s] %i PMIDs Found in %s: %r' % (hgvs_text, len(pmids), key, pmids))
-
-            except HGVSParseError:
-                print('[%s] Cannot parse as HGVS; skipping' % hgvs_text)
+        hgvs_texts = [line.strip() for line in fh.read().split('\n') if line.strip()]
+
+    # batch files are usually a few genes' variants: search each gene's PubTator rows in memory.
+    enable_gene_prefetch()
+    for idx in range(0, len(hgvs_texts), BATCH_SIZE):
+        for hgvs_text, results in hgvs_list_to_pmid_results(hgvs_texts[idx:idx + BATCH_SIZE]):
+            for key, pmids in results.items():
+                print('[%s] %i PMIDs Found in %s: %r' % (hgvs_text, len(pmids), key, pmids))
 
 
 def hgvs2pmid_cli():
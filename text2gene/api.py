@@ -2,8 +2,8 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 from metavariant import VariantLVG
 
-from .lvg_cached import LVG
-from .cached import ClinvarHgvs2Pmid, PubtatorHgvs2Pmid
-from .googlequery import GoogleQuery
+from .lvg_cached import LVG, LVGMany
+from .cached import ClinvarHgvs2Pmid, PubtatorHgvs2Pmid, ClinvarHgvs2PmidMany, PubtatorHgvs2PmidMany
+from .googlequery import GoogleQuery, GoogleQueryMany
 from .report_utils import CitationTable, ClinVarInfo, GeneInfo
 
@@ -0,0 +1,190 @@
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import logging
+import time
+
+from aminosearch.asyncdb import AsyncSQLData
+
+from .cached import clinvar_cached_query, pubtator_cached_query
+from .pmid_lookups import clinvar_lex_to_pmid, pubtator_lex_to_pmid_async
+
+log = logging.getLogger('text2gene.async_cached')
+
+
+class AsyncSQLCache(object):
+    """ asyncio front end for a SQLCache object (e.g. pubtator_cached_query): retrieve, retrieve_many,
+    store, store_many, delete and retrieve_or_compute as coroutines over AsyncSQLData (aiomysql).
+
+    Keys, values, versions, negative-entry expiry, the in-process tier (cache.local_cache) and
+    stats are all the wrapped cache's own, so sync and async callers share one cache.
+
+    Request coalescing in retrieve_or_compute is in-process only: concurrent coroutines computing the
+    same key await one computation, but there is no MySQL advisory lock across workers (GET_LOCK
+    would tie up a pooled connection for the whole computation).
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.db = AsyncSQLData(host=cache._db_host, user=cache._db_user, name=cache._db_name,
+                               **{'pass': cache._db_pass})
+        self._flights = {}    # cache_key -> future for the value being computed
+
+    async def get_rows(self, keys):
+        """ Coroutine version of SQLCache.get_rows. """
+        rows = []
+        for sql, args in self.cache._get_rows_queries(keys):
+            rows.extend(await self.db.fetchall(sql, *args))
+        return rows
+
+    async def get_row(self, querydict):
+        """ Coroutine version of SQLCache.get_row. """
+        sql, args = self.cache._get_row_query(querydict)
+        return await self.db.fetchrow(sql, *args)
+
+    async def retrieve(self, querydict, version=0):
+        """ Coroutine version of SQLCache.retrieve. """
+        cache = self.cache
+        start = time.time()
+        key = cache.get_key_digest(querydict)
+        value = cache._local_get(key, version, record_stats=True)
+        if value is None:
+            value = cache._accept_row(key, await self.get_row(querydict), version, record_stats=True)
+        cache._record_lookup(value)
+        cache.stats.record_retrieve((time.time() - start) * 1000)
+        return value
+
+    async def retrieve_many(self, querydicts, version=0):
+        """ Coroutine version of SQLCache.retrieve_many. """
+        cache = self.cache
+        start = time.time()
+        keys = [cache.get_key_digest(querydict) for querydict in querydicts]
+        found, missing = cache._local_get_many(keys, version)
+        return cache._accept_rows(keys, found, await self.get_rows(missing), version, start)
+
+    async def store(self, querydict, value, **kwargs):
+        """ Coroutine version of SQLCache.store.
+
+        :return: True if stored (False if the entry existed and update_if_duplicate was False)
+        """
+        cache = self.cache
+        update_if_duplicate = kwargs.get('update_if_duplicate', True)
+        sql, args = cache._store_query(querydict, value, update_if_duplicate)
+        try:
+            cursor = await self.db.execute(sql, *args)
+        except Exception:
+            cache.stats.incr('store_failures')
+            raise
+        return cache._stored(args[0], value, cursor.rowcount, update_if_duplicate)
+
+    async def store_many(self, items):
+        """ Coroutine version of SQLCache.store_many. """
+        cache = self.cache
+        rows = cache._store_many_rows(items)
+        for sql, args, count in cache._store_many_queries(rows):
+            try:
+                await self.db.execute(sql, *args)
+            except Exception:
+                cache.stats.incr('store_failures', count)
+                raise
+            cache.stats.incr('stores', count)
+
+        for key, _, _, version, value in rows:
+            cache._local_put(key, value, version)
+        return len(rows)
+
+    async def delete(self, querydict):
+        cache = self.cache
+        key = cache.get_key_digest(querydict)
+        if cache.local_cache is not None:
+            cache.local_cache.pop(key)
+        await self.db.execute('delete from {db.tablename} where cache_key=%s'.format(db=cache), key)
+
+    async def retrieve_or_compute(self, querydict, compute, skip_cache=False):
+        """ Coroutine version of SQLCache.retrieve_or_compute.  compute may be a coroutine function
+        or a plain function (which is run in the event loop's default executor); either takes no arguments.
+
+        :return: (value, from_cache) tuple
+        """
+        cache = self.cache
+        if not skip_cache:
+            value = await self.retrieve(querydict, version=cache.VERSION)
+            if value is not None:
+                return value, True
+
+        key = cache.get_key_digest(querydict)
+        if key in self._flights:
+            return await asyncio.shield(self._flights[key]), False
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            start = time.time()
+            if asyncio.iscoroutinefunction(compute):
+                value = await compute()
+            else:
+                value = await asyncio.get_running_loop().run_in_executor(None, compute)
+            cache.stats.record_compute((time.time() - start) * 1000)
+            if value is not None:
+                await self.store(querydict, value)
+            flight.set_result(value)
+        except Exception as error:
+            flight.set_exception(error)
+            # mark the exception retrieved, in case nobody else was waiting on this flight.
+            flight.exception()
+            raise
+        except BaseException:
+            flight.cancel()
+            raise
+        finally:
+            del self._flights[key]
+        return value, False
+
+
+_async_caches = {}
+
+
+def get_async_cache(cache):
+    """ Returns the AsyncSQLCache for the given SQLCache object, creating it on first use. """
+    if id(cache) not in _async_caches:
+        _async_caches[id(cache)] = AsyncSQLCache(cache)
+    return _async_caches[id(cache)]
+
+
+async def pubtator_query_async(lex, skip_cache=False, **kwargs):
+    """ Coroutine version of PubtatorHgvs2Pmid (granular results are stored in the default executor). """
+    query = pubtator_cached_query
+
+    async def compute():
+        return await pubtator_lex_to_pmid_async(lex, kwargs.get('gene_name', None))
+
+    result, from_cache = await get_async_cache(query).retrieve_or_compute(lex, compute, skip_cache=skip_cache)
+    if result and query.granular and not from_cache:
+        await asyncio.get_running_loop().run_in_executor(None, query.store_granular, lex, result)
+    return result
+
+
+async def clinvar_query_async(lex, skip_cache=False):
+    """ Coroutine version of ClinvarHgvs2Pmid.  The ClinVar lookups themselves go through medgen
+    (blocking), so a miss is computed in the default executor.
+    """
+    query = clinvar_cached_query
+    result, from_cache = await get_async_cache(query).retrieve_or_compute(lex, lambda: clinvar_lex_to_pmid(lex),
+                                                                          skip_cache=skip_cache)
+    if result and query.granular and not from_cache:
+        await asyncio.get_running_loop().run_in_executor(None, query.store_granular, lex, result)
+    return result
+
+
+async def hgvs2pmid_async(lex, skip_cache=False):
+    """ Looks lex up in PubTator and ClinVar (cache first, then the source databases) concurrently.
+
+    Example:
+        results = asyncio.run(hgvs2pmid_async(LVG('NM_001232.3:c.919G>C')))
+
+    :param lex: any lexical variant object (VariantLVG, NCBIEnrichedLVG, NCBIHgvsLVG)
+    :param skip_cache: whether to force reloading the data by skipping the cache
+    :return: dictionary {'pubtator': [pmids], 'clinvar': [pmids]}
+    """
+    pubtator, clinvar = await asyncio.gather(pubtator_query_async(lex, skip_cache=skip_cache),
+                                             clinvar_query_async(lex, skip_cache=skip_cache))
+    return {'pubtator': pubtator, 'clinvar': clinvar}
@@ -0,0 +1,70 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from aminosearch.instrument import LatencyHistogram, LATENCY_BUCKETS_MS
+
+COUNTERS = ['hits', 'local_hits', 'misses', 'negative_hits', 'stale_rejects', 'stores', 'store_failures']
+
+
+class CacheStats(object):
+    """ Hit/miss counters and retrieve/compute latency histograms for one cache service.
+
+    Counters:
+        hits: lookups answered from cache (either tier); includes negative_hits
+        local_hits: hits answered by the in-process tier
+        misses: lookups not answered from cache
+        negative_hits: hits on a cached "nothing found" result
+        stale_rejects: rows found but ignored because their version is too old
+        stores: values written to the cache
+        store_failures: writes to the cache that raised an error
+
+    Stats are kept per process (i.e. per gunicorn worker).
+    """
+
+    def __init__(self, servicename):
+        self.servicename = servicename
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.retrieve_latency = LatencyHistogram()
+        self.compute_latency = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_retrieve(self, ms):
+        with self._lock:
+            self.retrieve_latency.record(ms)
+
+    def record_compute(self, ms):
+        with self._lock:
+            self.compute_latency.record(ms)
+
+    def to_dict(self):
+        with self._lock:
+            outd = dict(self.counters)
+            lookups = outd['hits'] + outd['misses']
+            outd['hit_ratio'] = round(outd['hits'] / float(lookups), 4) if lookups else None
+            outd['retrieve_latency'] = self.retrieve_latency.to_dict()
+            outd['compute_latency'] = self.compute_latency.to_dict()
+            return outd
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_cache_stats(servicename):
+    """ Returns the (process-wide) CacheStats object for servicename, creating it if needed. """
+    with _registry_lock:
+        if servicename not in _registry:
+            _registry[servicename] = CacheStats(servicename)
+        return _registry[servicename]
+
+
+def all_cache_stats():
+    """ Returns dictionary of servicename -> stats dictionary for every service seen in this process. """
+    with _registry_lock:
+        services = list(_registry.values())
+    return dict((stats.servicename, stats.to_dict()) for stats in services)
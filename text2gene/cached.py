@@ -16,6 +16,12 @@ class ClinvarCachedQuery(SQLCache):
 
     VERSION = 0
 
+    # "no PMIDs found" is cached, but rechecked after 3 days.
+    NEGATIVE_CACHE_TTL = 3 * 24 * 3600
+
+    GRANULAR_FIELDS = ('hgvs_text', 'PMID', 'version')
+    GRANULAR_UNIQUE_KEY = ('hgvs_text_PMID', 'hgvs_text, PMID')
+
     def __init__(self, granular=False, granular_table='clinvar_match'):
         self.granular = granular
         self.granular_table = granular_table
@@ -32,9 +38,11 @@ class ClinvarCachedQuery(SQLCache):
         tmpl = '{hgvs_text}@{lvg_mode}'
         return tmpl.format(hgvs_text=lex.hgvs_text, lvg_mode=lex.LVG_MODE)
 
+    def granular_entries(self, hgvs_text, value, version):
+        return [(hgvs_text, pmid, version) for pmid in value]
+
     def store_granular(self, lex, result):
-        entry_pairs = [{'hgvs_text': lex.hgvs_text, 'PMID': pmid, 'version': self.VERSION} for pmid in result]
-        self.batch_insert(self.granular_table, entry_pairs)
+        self.store_granular_rows(self.granular_entries(lex.hgvs_text, result, self.VERSION))
 
     def query(self, lex, skip_cache=False, force_granular=False):
         """
@@ -42,19 +50,28 @@ class ClinvarCachedQuery(SQLCache):
         :param skip_cache: whether to force reloading the data by skipping the cache
         :return: list of PMIDs if found (result of Clinvar query)
         """
-        if not skip_cache:
-            result = self.retrieve(lex, version=self.VERSION)
-            if result:
-                if force_granular:
-                    self.store_granular(lex, result)
-                return result
-
-        result = clinvar_lex_to_pmid(lex)
-        self.store(lex, result)
-        if (force_granular or self.granular) and result:
+        result, from_cache = self.retrieve_or_compute(lex, lambda: clinvar_lex_to_pmid(lex), skip_cache=skip_cache)
+        if result and (force_granular or (self.granular and not from_cache)):
             self.store_granular(lex, result)
         return result
 
+    def query_many(self, lexes, skip_cache=False, force_granular=False):
+        """ Batched version of query(), using one multi-key cache lookup and one bulk store
+        for the whole list.
+
+        :param lexes: list of lexical variant objects (VariantLVG, NCBIEnrichedLVG, NCBIHgvsLVG)
+        :param skip_cache: whether to force reloading the data by skipping the cache
+        :return: list of PMID lists (one per lex, in the same order)
+        """
+        results = self.retrieve_or_compute_many(lexes, clinvar_lex_to_pmid, skip_cache=skip_cache)
+
+        out = []
+        for lex, (result, from_cache) in zip(lexes, results):
+            if result and (force_granular or (self.granular and not from_cache)):
+                self.store_granular(lex, result)
+            out.append(result)
+        return out
+
     def create_granular_table(self):
         tname = self.granular_table
         log.info('creating table {} for ClinvarCachedQuery'.format(tname))
@@ -63,18 +80,23 @@ class ClinvarCachedQuery(SQLCache):
 
         sql = """create table {} (
                   hgvs_text varchar(255) not null,
-                  PMID varchar(25) default NULL,
-                  version int(11) default 0)
+                  PMID varchar(25) not null,
+                  version int(11) default 0,
+                  UNIQUE KEY hgvs_text_PMID (hgvs_text, PMID))
                   ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci""".format(tname)
         self.execute(sql)
-        sql = 'call create_index("{}", "hgvs_text,PMID")'.format(tname)
-        self.execute(sql)
 
 
 class PubtatorCachedQuery(SQLCache):
 
     VERSION = 0
 
+    # "no PMIDs found" is cached, but rechecked after 3 days.
+    NEGATIVE_CACHE_TTL = 3 * 24 * 3600
+
+    GRANULAR_FIELDS = ('hgvs_text', 'PMID', 'version')
+    GRANULAR_UNIQUE_KEY = ('hgvs_text_PMID', 'hgvs_text, PMID')
+
     def __init__(self, granular=False, granular_table='pubtator_match'):
         self.granular = granular
         self.granular_table = granular_table
@@ -91,9 +113,11 @@ class PubtatorCachedQuery(SQLCache):
         tmpl = '{hgvs_text}@{lvg_mode}'
         return tmpl.format(hgvs_text=lex.hgvs_text, lvg_mode=lex.LVG_MODE)
 
+    def granular_entries(self, hgvs_text, value, version):
+        return [(hgvs_text, pmid, version) for pmid in value]
+
     def store_granular(self, lex, result):
-        entry_pairs = [{'hgvs_text': lex.hgvs_text, 'PMID': pmid, 'version': self.VERSION} for pmid in result]
-        self.batch_insert(self.granular_table, entry_pairs)
+        self.store_granular_rows(self.granular_entries(lex.hgvs_text, result, self.VERSION))
 
     def query(self, lex, skip_cache=False, force_granular=False, **kwargs):
         """
@@ -109,19 +133,29 @@ class PubtatorCachedQuery(SQLCache):
         :param skip_cache: whether to force reloading the data by skipping the cache
         :return: list of PMIDs if found (result of Clinvar query)
         """
-        if not skip_cache:
-            result = self.retrieve(lex, version=self.VERSION)
-            if result:
-                if force_granular:
-                    self.store_granular(lex, result)
-                return result
-
-        result = pubtator_lex_to_pmid(lex, kwargs.get('gene_name', None))
-        self.store(lex, result)
-        if (force_granular or self.granular) and result:
+        result, from_cache = self.retrieve_or_compute(lex, lambda: pubtator_lex_to_pmid(lex, kwargs.get('gene_name', None)),
+                                                      skip_cache=skip_cache)
+        if result and (force_granular or (self.granular and not from_cache)):
             self.store_granular(lex, result)
         return result
 
+    def query_many(self, lexes, skip_cache=False, force_granular=False):
+        """ Batched version of query(), using one multi-key cache lookup and one bulk store
+        for the whole list.
+
+        :param lexes: list of lexical variant objects (VariantLVG, NCBIEnrichedLVG, NCBIHgvsLVG)
+        :param skip_cache: whether to force reloading the data by skipping the cache
+        :return: list of PMID lists (one per lex, in the same order)
+        """
+        results = self.retrieve_or_compute_many(lexes, pubtator_lex_to_pmid, skip_cache=skip_cache)
+
+        out = []
+        for lex, (result, from_cache) in zip(lexes, results):
+            if result and (force_granular or (self.granular and not from_cache)):
+                self.store_granular(lex, result)
+            out.append(result)
+        return out
+
     def create_granular_table(self):
         tname = self.granular_table
         log.info('creating table {} for PubtatorCachedQuery'.format(tname))
@@ -131,15 +165,19 @@ class PubtatorCachedQuery(SQLCache):
 
         sql = """create table {} (
                   hgvs_text varchar(255) not null,
-                  PMID int(11) default NULL,
-                  version int(11) default NULL)
+                  PMID int(11) not null,
+                  version int(11) default NULL,
+                  UNIQUE KEY hgvs_text_PMID (hgvs_text, PMID))
                   ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci""".format(tname)
         self.execute(sql)
-        sql = 'call create_index("{}", "hgvs_text,PMID")'.format(tname)
-        self.execute(sql)
 
 
 ### API Definitions
 
-ClinvarHgvs2Pmid = ClinvarCachedQuery(granular=GRANULAR_CACHE).query
-PubtatorHgvs2Pmid = PubtatorCachedQuery(granular=GRANULAR_CACHE).query
+clinvar_cached_query = ClinvarCachedQuery(granular=GRANULAR_CACHE)
+pubtator_cached_query = PubtatorCachedQuery(granular=GRANULAR_CACHE)
+
+ClinvarHgvs2Pmid = clinvar_cached_query.query
+ClinvarHgvs2PmidMany = clinvar_cached_query.query_many
+PubtatorHgvs2Pmid = pubtator_cached_query.query
+PubtatorHgvs2PmidMany = pubtator_cached_query.query_many
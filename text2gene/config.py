@@ -13,6 +13,15 @@ ENV = os.getenv('%s_ENV' % PKGNAME, 'dev')
 
 SEQVAR_MAX_LEN = 100
 
+# max number of entries held in each cached-query object's in-process cache tier (0 disables it).
+LOCAL_CACHE_SIZE = int(os.getenv('%s_LOCAL_CACHE_SIZE' % PKGNAME, 5000))
+
+# comma-separated hosts of read replicas of the text2gene (cache) database; cache lookups are read from them.
+DB_REPLICAS = [host.strip() for host in os.getenv('%s_DB_REPLICAS' % PKGNAME, '').split(',') if host.strip()]
+
+# path of the memory-mapped PubTator mutation index (sbin/08_build_m2p_index.py) used by PubTator searches, if any.
+M2P_INDEX = os.getenv('%s_M2P_INDEX' % PKGNAME, '')
+
 ####
 import logging
 log = logging.getLogger(PKGNAME)
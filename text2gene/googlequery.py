@@ -4,7 +4,6 @@ import re
 import os
 import logging
 import urllib
-import hashlib
 
 import requests
 
@@ -434,36 +433,55 @@ class GoogleCachedQuery(SQLCache):
     """
     VERSION = 0
 
+    LOCAL_CACHE_TTL = 24 * 3600
+
+    # results are re-fetched from Google after 90 days (see sbin/purge_cache.py).
+    RETENTION = 90 * 24 * 3600
+
+    GRANULAR_FIELDS = ('hgvs_text', 'PMID', 'version')
+    GRANULAR_UNIQUE_KEY = ('hgvs_text_PMID', 'hgvs_text, PMID')
+
     def __init__(self, granular=False, granular_table='google_match'):
         self.granular = granular
         self.granular_table = granular_table
         super(self.__class__, self).__init__('google_query')
 
-    def _truncate_result(self, result):
-        """ Removes unnecessary bulk from Google CSE result list. """
-        out = []
-        for item in result:
-            if type(item) == dict:
-                if item.get('pagemap', None):
-                    for key in ('person', 'article', 'cse_thumbnail'):
-                        if item['pagemap'].get(key, None):
-                            item['pagemap'].pop(key)
-        out.append(item)
-        return out
+    # old VARCHAR keys were already the md5 hex digest of the query string.
+    LEGACY_KEY_SQL = 'UNHEX(cache_key)'
+    LEGACY_KEY_TEXT_SQL = 'NULL'
 
     def get_cache_key(self, qstring):
         """ Returns a cache_key for the supplied Google query string.
 
         :param qstring: (str) Google query string
-        :return: md5 hash of query string
+        :return: query string (stored as its md5 digest)
         """
-        return hashlib.md5(qstring.encode('utf-8')).hexdigest()
+        return qstring
+
+    def hgvs_text_for_key_text(self, key_text):
+        # keys are Google query strings, which can't be turned back into an hgvs_text
+        # (and resolving PMIDs from cached results may hit the network), so no backfill.
+        return None
+
+    def granular_entries(self, hgvs_text, value, version):
+        return [(hgvs_text, pmid, version) for pmid in googlecse2pmid(parse_cse_items(value))]
 
     def store_granular(self, hgvs_text, cse_results):
         pmids = googlecse2pmid(cse_results)
         if pmids:
-            entry_pairs = [{'hgvs_text': hgvs_text, 'PMID': pmid, 'version': self.VERSION} for pmid in pmids]
-            self.batch_insert(self.granular_table, entry_pairs)
+            self.store_granular_rows([(hgvs_text, pmid, self.VERSION) for pmid in pmids])
+
+    def build_qstring(self, lex, seqtypes=None, term_limit=31, use_gene_synonyms=True, gcse=None):
+        """ Returns the Google query string (i.e. the cache key) that query() would use for these arguments.
+
+        :param lex: any lexical variant object (VariantLVG, NCBIEnrichedLVG, NCBIHgvsLVG)
+        :return: (str) Google query string
+        """
+        if seqtypes is None:
+            seqtypes = ALL_SEQTYPES
+        if gcse is None:
+            gcse = GoogleCSEngine(lex)
+        return gcse.build_query(seqtypes, term_limit=term_limit, use_gene_synonyms=use_gene_synonyms)
 
     def query(self, lex, seqtypes=None, term_limit=31, use_gene_synonyms=True, skip_cache=False, force_granular=False):
         """ Supply a "lex" object to run a GoogleQuery and return all parseable results as GoogleCSEResult
@@ -480,11 +498,8 @@ class GoogleCachedQuery(SQLCache):
         :param skip_cache: whether to force reloading the data by skipping the cache
         :return: list of GoogleCSEresult objects or empty list if no results
         """
-        if seqtypes is None:
-            seqtypes = ALL_SEQTYPES
-
         gcse = GoogleCSEngine(lex)
-        qstring = gcse.build_query(seqtypes, term_limit=term_limit, use_gene_synonyms=use_gene_synonyms)
+        qstring = self.build_qstring(lex, seqtypes, term_limit, use_gene_synonyms, gcse=gcse)
 
         # This looks like a lot of extra steps (get the results, parse the results, convert the results
         # into PMIDs)... but there's an advantage. By storing the JSON response instead of the GoogleCSEResult
@@ -494,31 +509,50 @@ class GoogleCachedQuery(SQLCache):
         # In other words, we can reuse our cached API results for each query while leaving ourselves open to the
         # possibility of taking advantage of improved interpretation over time.
 
-        if not skip_cache:
-            result = self.retrieve(qstring, version=self.VERSION)
-            if result is not None:
-                log.debug('GoogleQuery: loaded results from cache for qstring %s' % qstring)
-                cse_results = parse_cse_items(result)
-                if force_granular:
-                    self.store_granular(lex.hgvs_text, cse_results)
-                return cse_results
-
-        log.debug('GoogleQuery: Hitting Google API with qstring %s' % qstring)
-        result = gcse.send_query(qstring)
-
-        # if result is too long to be stored, doctor it up (remove unnecessary parts):
-        if len('%r' % result) > 64000:
-            result = self._truncate_result(result)
+        def send_query():
+            log.debug('GoogleQuery: Hitting Google API with qstring %s' % qstring)
+            return gcse.send_query(qstring)
 
-        self.store(qstring, result)
+        result, from_cache = self.retrieve_or_compute(qstring, send_query, skip_cache=skip_cache)
+        if from_cache:
+            log.debug('GoogleQuery: loaded results from cache for qstring %s' % qstring)
 
         cse_results = parse_cse_items(result)
 
-        if (force_granular or self.granular) and result:
+        if force_granular or (self.granular and not from_cache and result):
             self.store_granular(lex.hgvs_text, cse_results)
 
         return cse_results
 
+    def query_many(self, lexes, seqtypes=None, term_limit=31, use_gene_synonyms=True, skip_cache=False, force_granular=False):
+        """ Batched version of query(), using one multi-key cache lookup and one bulk store
+        for the whole list.  Keyword arguments apply to every lex.
+
+        :param lexes: list of lexical variant objects (VariantLVG, NCBIEnrichedLVG, NCBIHgvsLVG)
+        :return: list of lists of GoogleCSEResult objects (one per lex, in the same order)
+        """
+        engines = {}
+        qstrings = []
+        for lex in lexes:
+            gcse = GoogleCSEngine(lex)
+            qstring = self.build_qstring(lex, seqtypes, term_limit, use_gene_synonyms, gcse=gcse)
+            engines[qstring] = gcse
+            qstrings.append(qstring)
+
+        def send_query(qstring):
+            log.debug('GoogleQuery: Hitting Google API with qstring %s' % qstring)
+            return engines[qstring].send_query(qstring)
+
+        results = self.retrieve_or_compute_many(qstrings, send_query, skip_cache=skip_cache)
+
+        out = []
+        for lex, (result, from_cache) in zip(lexes, results):
+            cse_results = parse_cse_items(result)
+            if result and (force_granular or (self.granular and not from_cache)):
+                self.store_granular(lex.hgvs_text, cse_results)
+            out.append(cse_results)
+        return out
+
     def create_granular_table(self):
         tname = self.granular_table
         log.info('creating table {} for GoogleCachedQuery'.format(tname))
@@ -527,12 +561,14 @@ class GoogleCachedQuery(SQLCache):
 
         sql = """create table {} (
                   hgvs_text varchar(255) not null,
-                  PMID int(11) default NULL,
-                  version int(11) default NULL)
+                  PMID int(11) not null,
+                  version int(11) default NULL,
+                  UNIQUE KEY hgvs_text_PMID (hgvs_text, PMID))
                   ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci""".format(tname)
         self.execute(sql)
-        sql = 'call create_index("{}", "hgvs_text,PMID")'.format(tname)
-        self.execute(sql)
 
 
-GoogleQuery = GoogleCachedQuery(granular=GRANULAR_CACHE).query
+google_cached_query = GoogleCachedQuery(granular=GRANULAR_CACHE)
+
+GoogleQuery = google_cached_query.query
+GoogleQueryMany = google_cached_query.query_many
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from metavariant import VariantLVG, Variant
+
+log = logging.getLogger('text2gene.lvg')
+
+SEQTYPES = ['g', 'c', 'n', 'p']
+
+
+class LazyVariants(Mapping):
+    """ Read-only stand-in for VariantLVG.variants ({seqtype: {hgvs_string: SequenceVariant}}) built
+    from lists of hgvs strings.  Each seqtype's strings are parsed into SequenceVariant objects the
+    first time that seqtype is accessed.
+    """
+
+    def __init__(self, hgvs_by_seqtype):
+        self._hgvs = hgvs_by_seqtype
+        self._parsed = {}
+
+    def __getitem__(self, seqtype):
+        if seqtype not in self._parsed:
+            if seqtype not in self._hgvs:
+                raise KeyError(seqtype)
+            seqvars = {}
+            for hgvs_text in self._hgvs[seqtype]:
+                seqvar = Variant(hgvs_text)
+                if seqvar is None:
+                    log.debug('Dropping unparseable cached %s variant %s', seqtype, hgvs_text)
+                    continue
+                seqvars[hgvs_text] = seqvar
+            self._parsed[seqtype] = seqvars
+        return self._parsed[seqtype]
+
+    def __iter__(self):
+        return iter(SEQTYPES)
+
+    def __len__(self):
+        return len(SEQTYPES)
+
+    def hgvs_strings(self, seqtype):
+        """ Returns list of hgvs strings for seqtype without parsing them. """
+        if seqtype in self._parsed:
+            return list(self._parsed[seqtype].keys())
+        return list(self._hgvs.get(seqtype, []))
+
+
+class LazyVariantLVG(VariantLVG):
+    """ VariantLVG rebuilt from cached values without redoing any lexical variant generation.
+
+    VariantLVG.from_json runs the full constructor (parsing and re-mapping every variant through UTA).
+    LazyVariantLVG instead keeps the cached hgvs strings, and only parses them into SequenceVariant
+    objects when seqvar or variants[seqtype] is actually used.  hgvs_c/g/n/p, gene_name, transcripts
+    and to_json() never parse anything.
+    """
+
+    def __init__(self, hgvs_text, gene_name=None, transcripts=None, hgvs_c=None, hgvs_g=None,
+                 hgvs_n=None, hgvs_p=None, **kwargs):
+        self.hgvs_text = hgvs_text
+        self._gene_name = gene_name
+        self._seqvar = None
+        self.transcripts = set(transcripts or [])
+        self.variants = LazyVariants({'g': hgvs_g or [], 'c': hgvs_c or [], 'n': hgvs_n or [], 'p': hgvs_p or []})
+
+    @property
+    def seqvar(self):
+        if self._seqvar is None:
+            self._seqvar = self.parse(self.hgvs_text)
+        return self._seqvar
+
+    @property
+    def hgvs_c(self):
+        return self.variants.hgvs_strings('c')
+
+    @property
+    def hgvs_g(self):
+        return self.variants.hgvs_strings('g')
+
+    @property
+    def hgvs_n(self):
+        return self.variants.hgvs_strings('n')
+
+    @property
+    def hgvs_p(self):
+        return self.variants.hgvs_strings('p')
+
+    @classmethod
+    def from_dict(cls, inpd):
+        """ Instantiates from a dictionary shaped like the output of VariantLVG._simple_dict()
+        (i.e. the parsed JSON stored by VariantLVG.to_json).
+        """
+        inpd = dict(inpd)
+        return cls(inpd.pop('hgvs_text'), **inpd)
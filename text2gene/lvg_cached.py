@@ -2,19 +2,39 @@ from __future__ import absolute_import, unicode_literals
 
 import logging
 
+import simplejson as json
 from metavariant import VariantLVG 
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from .exceptions import Text2GeneError
 from .sqlcache import SQLCache
+from .lazy_lvg import LazyVariantLVG
 from .config import GRANULAR_CACHE, SEQVAR_MAX_LEN
 
 log = logging.getLogger('text2gene.lvg')
 
+# cache_values starting with this marker are msgpack-encoded LVG_PACK_FIELDS lists (see SQLCache.BINARY_PREFIX).
+LVG_PACK_MARKER = b'\x00m'
+
+# bump LVG_PACK_SCHEMA whenever LVG_PACK_FIELDS changes; packed values with another schema are treated as misses.
+LVG_PACK_SCHEMA = 1
+LVG_PACK_FIELDS = ['hgvs_text', 'gene_name', 'transcripts', 'hgvs_c', 'hgvs_g', 'hgvs_n', 'hgvs_p']
+
 
 class VariantLVGCached(SQLCache):
 
     VERSION = 1
 
+    # LVG output only changes with VERSION, so hot variants can stay in-process for a long time.
+    LOCAL_CACHE_TTL = 24 * 3600
+
+    GRANULAR_FIELDS = ('hgvs_text', 'seqtype', 'alias', 'version')
+    GRANULAR_UNIQUE_KEY = ('hgvs_text_alias', 'hgvs_text, alias')
+
     def __init__(self, granular=False, granular_table='lvg_mappings'):
         self.granular = granular
         self.granular_table = granular_table
@@ -24,85 +44,106 @@ class VariantLVGCached(SQLCache):
         return str(hgvs_text)
 
     def get_cache_value(self, obj):
-        """ Returns json object representation of supplied object. """
-        return obj.to_json()
-
-    def retrieve(self, hgvs_text, version=0):
-        """ If cache contains a value for hgvs_text, retrieve it. Otherwise, return None.
-
-        (Overrides default retrieve)
+        """ Returns msgpack representation of supplied object (or its json representation,
+        if msgpack is not installed).
+        """
+        if msgpack is None:
+            return obj.to_json()
+        simple = obj._simple_dict()
+        packed = [LVG_PACK_SCHEMA] + [simple[field] for field in LVG_PACK_FIELDS]
+        return LVG_PACK_MARKER + msgpack.packb(packed, use_bin_type=True)
+
+    def load_cache_value(self, cache_value):
+        """ Returns LazyVariantLVG object reconstructed from stored msgpack or json, or None
+        if the stored value cannot be read here (treated as a cache miss).
+        """
+        if isinstance(cache_value, bytes):
+            if not cache_value.startswith(LVG_PACK_MARKER) or msgpack is None:
+                log.info('Cannot read binary LVG cache value %r; ignoring', cache_value[:2])
+                return None
+            packed = msgpack.unpackb(cache_value[len(LVG_PACK_MARKER):], raw=False)
+            if packed[0] != LVG_PACK_SCHEMA:
+                log.debug('Ignoring LVG cache value with pack schema %r', packed[0])
+                return None
+            return LazyVariantLVG.from_dict(dict(zip(LVG_PACK_FIELDS, packed[1:])))
+        return LazyVariantLVG.from_dict(json.loads(cache_value))
+
+    def hgvs_text_for_key_text(self, key_text):
+        return key_text
+
+    def granular_entries(self, hgvs_text, lex, version):
+        entries = []
+        for seqtype in ['c', 'g', 'n', 'p']:
+            for alias in getattr(lex, 'hgvs_' + seqtype):
+                entries.append((hgvs_text, seqtype, alias, version))
+        return entries
 
-        If requested version number is GREATER THAN OR EQUAL TO version number of existing data, older version will be
-        destroyed so that newer version can be created in its place.
+    def store_granular(self, lex):
+        self.store_granular_rows(self.granular_entries(lex.hgvs_text, lex, self.VERSION))
 
-        Thus, supplying version=0 allows returns from cache from *any* version of data that has ever been stored.
+    def create_lvg(self, hgvs_text):
+        """ Returns a new VariantLVG object for hgvs_text (uncached).
 
-        :param hgvs_text: (str)
-        :param version: (int) only return results from cache with greater than or equal version number [default: 0]
-        :return: LVG object or None
+        :raises: Text2GeneError if one can't be made
         """
-        row = self.get_row(hgvs_text)
-        if row:
-            if row['version'] >= version:
-                return VariantLVG.from_json(row['cache_value'])     #.decode('string_escape'))
-            else:
-                log.debug('Expiring obsolete entry at cache_key location %s.', self.get_cache_key(hgvs_text))
-                self.delete(hgvs_text)
-        return None
-
-    def _store_granular_hgvs_type(self, lex, hgvs_seqtype_name):
-        hgvs_vars = getattr(lex, hgvs_seqtype_name)
-        if hgvs_vars:
-            entry_pairs = [{'hgvs_text': lex.hgvs_text,
-                            hgvs_seqtype_name: item,
-                            'version': self.VERSION} for item in hgvs_vars]
-
-            self.batch_insert(self.granular_table, entry_pairs)
-
-    def store_granular(self, lex):
-        for hgvs_type in ['c', 'g', 'n', 'p']:
-            self._store_granular_hgvs_type(lex, 'hgvs_'+hgvs_type)
+        lexobj = VariantLVG(hgvs_text, seqvar_max_len=SEQVAR_MAX_LEN)
+        if not lexobj:
+            raise Text2GeneError('VariantLVG object could not be created from input hgvs_text %s' % hgvs_text)
+        return lexobj
 
     def query(self, hgvs_text, skip_cache=False, force_granular=False):
-        if not skip_cache:
-            result = self.retrieve(hgvs_text, version=self.VERSION)
-            if result:
-                if force_granular:
-                    self.store_granular(result)
-                return result
+        lexobj, from_cache = self.retrieve_or_compute(hgvs_text, lambda: self.create_lvg(hgvs_text), skip_cache=skip_cache)
+        if force_granular or (self.granular and not from_cache):
+            self.store_granular(lexobj)
+        return lexobj
+
+    def _lvg_or_None(self, hgvs_text):
+        try:
+            return self.create_lvg(hgvs_text)
+        except Exception as error:
+            log.info('[%s] VariantLVG object could not be created: %r', hgvs_text, error)
+            return None
+
+    def query_many(self, hgvs_texts, skip_cache=False, force_granular=False):
+        """ Batched version of query(), using one multi-key cache lookup and one bulk store
+        for the whole list.
+
+        Unlike query(), an hgvs_text that cannot be made into a VariantLVG object does not raise;
+        its entry in the returned list is None instead.
+
+        :param hgvs_texts: list of hgvs strings
+        :param skip_cache: whether to force reloading the data by skipping the cache
+        :return: list of VariantLVG objects (or None) in the same order as hgvs_texts
+        """
+        results = self.retrieve_or_compute_many(hgvs_texts, self._lvg_or_None, skip_cache=skip_cache)
 
-        lexobj = VariantLVG(hgvs_text, seqvar_max_len=SEQVAR_MAX_LEN)
-        if lexobj:
-            self.store(hgvs_text, lexobj)
-            if force_granular or self.granular:
+        out = []
+        for lexobj, from_cache in results:
+            if lexobj is not None and (force_granular or (self.granular and not from_cache)):
                 self.store_granular(lexobj)
-
-            return lexobj
-        else:
-            raise Text2GeneError('VariantLVG object could not be created from input hgvs_text %s' % hgvs_text)
+            out.append(lexobj)
+        return out
 
     def create_granular_table(self):
         tname = self.granular_table
-        log.info('creating table {} for NCBIVariantReportCachedQuery'.format(tname))
+        log.info('creating table {} for VariantLVGCached'.format(tname))
 
         self.execute("drop table if exists {};".format(tname))
 
         sql = """create table {} (
               hgvs_text varchar(255) not null,
-              hgvs_g varchar(255) default NULL,
-              hgvs_c varchar(255) default NULL,
-              hgvs_n varchar(255) default NULL,
-              hgvs_p varchar(255) default NULL,
-              version int(11) default NULL
+              seqtype char(1) not null,
+              alias varchar(255) not null,
+              version int(11) default NULL,
+              UNIQUE KEY hgvs_text_alias (hgvs_text, alias),
+              KEY alias (alias)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci""".format(tname)
         self.execute(sql)
 
-        self.execute('call create_index("{}", "hgvs_text,hgvs_g")'.format(tname))
-        self.execute('call create_index("{}", "hgvs_text,hgvs_c")'.format(tname))
-        self.execute('call create_index("{}", "hgvs_text,hgvs_n")'.format(tname))
-        self.execute('call create_index("{}", "hgvs_text,hgvs_p")'.format(tname))
-
 
 # API Definitions
 
-LVG = VariantLVGCached(GRANULAR_CACHE).query
+lvg_cached_query = VariantLVGCached(GRANULAR_CACHE)
+
+LVG = lvg_cached_query.query
+LVGMany = lvg_cached_query.query_many
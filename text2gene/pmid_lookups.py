@@ -1,16 +1,42 @@
 from __future__ import absolute_import, unicode_literals
 
+import asyncio
+
 from medgen.api import GeneID, ClinvarPubmeds
 from metavariant import VariantComponents, Variant
 from metavariant.exceptions import RejectedSeqVar
 
 from aminosearch import PubtatorDB
+from aminosearch.asyncdb import AsyncPubtatorDB
 from aminosearch.exceptions import PubtatorDBError
+from aminosearch.m2pindex import open_m2p_index
+from aminosearch.prefetch import PubtatorGenePrefetch
 
-from .config import log
+from .config import log, M2P_INDEX
 
 pubtator_db = PubtatorDB()
 
+# memory-mapped PubTator mutation index (see aminosearch.m2pindex), if M2P_INDEX is configured.
+m2p_index = open_m2p_index(M2P_INDEX)
+
+# gene-scoped prefetch of PubTator rows (see enable_gene_prefetch), for batch runs.
+pubtator_prefetch = None
+
+# created on first use by pubtator_lex_to_pmid_async (needs aiomysql).
+async_pubtator_db = None
+
+
+def enable_gene_prefetch(**kwargs):
+    """ Makes pubtator_lex_to_pmid load each gene's PubTator rows with one query and answer that
+    gene's variants from memory (see aminosearch.prefetch.PubtatorGenePrefetch; keyword arguments
+    are passed to it).  Meant for batch runs over variant lists dominated by a few genes.
+
+    :return: the PubtatorGenePrefetch object
+    """
+    global pubtator_prefetch
+    pubtator_prefetch = PubtatorGenePrefetch(pubtator_db, **kwargs)
+    return pubtator_prefetch
+
 
 def clinvar_lex_to_pmid(lex):
     """ Takes a "lex" object (metavariant.VariantLVG) and uses each variant found in
@@ -35,6 +61,51 @@ def clinvar_lex_to_pmid(lex):
     return list(pmids)
     
 
+def lex_components(lex):
+    """ Returns (seqvars, components_list) for the variants in lex.variants that have enough
+    information to search on (VariantComponents doesn't raise RejectedSeqVar).
+
+    :param lex: lexical variant object (metavariant.VariantLVG)
+    :return: (list of SequenceVariant objects, list of VariantComponents objects)
+    """
+    seqvars = []
+    components_list = []
+    for seqtype in lex.variants:
+        for seqvar in lex.variants[seqtype].values():
+            try:
+                components = VariantComponents(seqvar)
+            except RejectedSeqVar:
+                log.debug('[%s] Rejected sequence variant: %r' % (lex.seqvar, seqvar))
+                continue
+
+            log.info('[%s] [[%s]] %s', lex.seqvar, seqvar, components)
+            seqvars.append(seqvar)
+            components_list.append(components)
+    return seqvars, components_list
+
+
+def pubtator_search_many(components_list, gene_id):
+    """ pubtator_db.search_many, answered from m2p_index where possible (when M2P_INDEX is set):
+    only the components the index can't answer are searched in MySQL.
+
+    (Index rows have no Components or Mentions; use pubtator_db directly when those are needed.)
+
+    With enable_gene_prefetch(), searches with a gene_id are answered from the gene's prefetched rows first.
+    """
+    if gene_id and pubtator_prefetch is not None:
+        return pubtator_prefetch.search_many(components_list, gene_id)
+
+    if m2p_index is None:
+        return pubtator_db.search_many(components_list, gene_id)
+
+    results = m2p_index.search_many(components_list, gene_id)
+    missing = [idx for idx, rows in enumerate(results) if rows is None]
+    if missing:
+        for idx, rows in zip(missing, pubtator_db.search_many([components_list[idx] for idx in missing], gene_id)):
+            results[idx] = rows
+    return results
+
+
 def pubtator_lex_to_pmid(lex, gene_name=None):
     """ Takes an LVG object ("lex") (metavariant.VariantLVG) and uses each
     variant found in lex.variants to do a search in PubTator for associated PMIDs.
@@ -61,25 +132,45 @@ def pubtator_lex_to_pmid(lex, gene_name=None):
 
     log.info('[%s] %s (Gene ID: %s)', lex.seqvar, gene_name, gene_id)
 
+    _, components_list = lex_components(lex)
     pmids = set()
-    for seqtype in lex.variants:
-        for seqvar in lex.variants[seqtype].values():
-            try:
-                components = VariantComponents(seqvar)
-            except RejectedSeqVar:
-                log.debug('[%s] Rejected sequence variant: %r' % (lex.seqvar, seqvar))
-                continue
+    for results in pubtator_search_many(components_list, gene_id):
+        for res in results:
+            pmids.add(res['PMID'])
 
-            log.info('[%s] [[%s]] %s', lex.seqvar, seqvar, components)
-            try:
-                if seqtype == 'p':
-                    results = pubtator_db.search_proteins(components, gene_id)
-                else:
-                    results = pubtator_db.search_m2p(components, gene_id)
-                for res in results:
-                    pmids.add(res['PMID'])
-            except PubtatorDBError as error:
-                log.info('[%s] (%s) %r', lex.seqvar, seqvar, error)
+    return list(pmids)
+
+
+async def pubtator_lex_to_pmid_async(lex, gene_name=None):
+    """ Coroutine version of pubtator_lex_to_pmid, over AsyncPubtatorDB (requires aiomysql).
+
+    :param lex: lexical variant object (metavariant.VariantLVG)
+    :return: list of pmids found in PubTator
+    """
+    global async_pubtator_db
+    if async_pubtator_db is None:
+        async_pubtator_db = AsyncPubtatorDB()
+
+    # GeneID is a (blocking) medgen lookup.
+    loop = asyncio.get_running_loop()
+    gene_id = None
+    if gene_name:
+        gene_id = await loop.run_in_executor(None, GeneID, gene_name)
+    else:
+        try:
+            gene_name = lex.gene_name
+            gene_id = await loop.run_in_executor(None, GeneID, lex.gene_name)
+        except TypeError:
+            # no gene_name? it happens -- but our results will be basically bunk without it.
+            return []
+
+    log.info('[%s] %s (Gene ID: %s)', lex.seqvar, gene_name, gene_id)
+
+    _, components_list = lex_components(lex)
+    pmids = set()
+    for results in await async_pubtator_db.search_many(components_list, gene_id):
+        for res in results:
+            pmids.add(res['PMID'])
 
     return list(pmids)
 
@@ -137,25 +228,12 @@ def pubtator_results_for_lex(lex, gene_name=None):
 
     log.info('[%s] %s (Gene ID: %s)', lex.seqvar, gene_name, gene_id)
 
+    seqvars, components_list = lex_components(lex)
     results = {}
-    for seqtype in lex.variants:
-        for seqvar in lex.variants[seqtype].values():
-
-            try:
-                result = pubtator_results_for_seqvar(seqvar, gene_id)
-                results.update(result)
-                try:
-                    for row in results['%s' % seqvar]:
-                        log.info('[%s] [[%s]] Mentions: %s  PMID: %s  Components: %s', lex.seqvar, seqvar,
-                                  row['Mentions'], row['PMID'], row['Components'])
-                except Exception as error:
-                    print(error)
-                    #from IPython import embed; embed()
-
-            except RejectedSeqVar:
-                log.debug('[%s] [[%s]] VariantComponents raised RejectedSeqVar', lex.seqvar, seqvar)
-
-            except PubtatorDBError as error:
-                log.info('[%s] [[%s]] %r', lex.seqvar, seqvar, error)
+    for seqvar, rows in zip(seqvars, pubtator_db.search_many(components_list, gene_id)):
+        results['%s' % seqvar] = rows
+        for row in rows:
+            log.info('[%s] [[%s]] Mentions: %s  PMID: %s  Components: %s', lex.seqvar, seqvar,
+                      row['Mentions'], row['PMID'], row['Components'])
 
     return results
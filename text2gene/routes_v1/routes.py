@@ -3,18 +3,22 @@ from __future__ import absolute_import, unicode_literals
 API_INDICATOR = 'v1'
 
 import logging
+import os
 
 from flask import Blueprint, request, redirect
 
 from metavariant.exceptions import CriticalHgvsError
 from metavariant.utils import strip_gene_name_from_hgvs_text
 from metavariant.lovd import LOVDVariantsForGene
+from aminosearch.pool import all_pool_stats
+from aminosearch.instrument import query_stats
 
 from ..googlequery import GoogleCSEngine, googlecse2pmid, ALL_SEQTYPES, get_posedits_for_seqvar
 from ..report_utils import CitationTable
 from ..api import LVG, GoogleQuery
 from ..sqlcache import SQLCache
-from ..cached import PubtatorHgvs2Pmid, ClinvarHgvs2Pmid
+from ..cache_stats import all_cache_stats
+from ..cached import PubtatorHgvs2Pmid, ClinvarHgvs2Pmid, clinvar_cached_query
 from ..config import PKGNAME
 from ..utils import HTTP200, HTTP400, restrict_by_ip
 
@@ -153,17 +157,33 @@ def citation_table(hgvs_text):
 
 @routes_v1.route('/v1/cache_stats', methods=['GET'])
 def cache_stats():
-    """ Returns JSON containing statistics for the latest cache contents in MySQL. """
-    db = SQLCache('clinvar')
+    """ Returns JSON containing statistics for the cache tables in MySQL (approximate row counts
+    from table statistics) and hit/miss/latency metrics for each cached service, as seen by the
+    worker process answering this request.
+    """
+    db = clinvar_cached_query
     cache_report = {
                     'hgvslvg_cache': None,
                     'google_query_cache': None,
                     'pubtator_hgvs2pmid_cache': None,
                     'clinvar_hgvs2pmid_cache': None,
                     }
-    for tablename in list(cache_report.keys()):
-        result = db.fetchrow('select count(cache_key) as cnt from %s' % tablename)
-        cache_report[tablename] = result['cnt']
+    tablenames = list(cache_report.keys())
+    sql = 'select TABLE_NAME, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH from information_schema.TABLES ' \
+          'where TABLE_SCHEMA=%s and TABLE_NAME in (' + ','.join(['%s' for _ in tablenames]) + ')'
+    tables = {}
+    for row in db.fetchall(sql, db.DBNAME, *tablenames):
+        cache_report[row['TABLE_NAME']] = row['TABLE_ROWS']
+        tables[row['TABLE_NAME']] = {'approx_rows': row['TABLE_ROWS'],
+                                     'data_bytes': row['DATA_LENGTH'],
+                                     'index_bytes': row['INDEX_LENGTH'],
+                                     }
+
+    cache_report['tables'] = tables
+    cache_report['services'] = all_cache_stats()
+    cache_report['pools'] = all_pool_stats()
+    cache_report['queries'] = query_stats.to_dict(top=20)
+    cache_report['pid'] = os.getpid()
 
     return HTTP200(cache_report)
 
@@ -1,11 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
 import hashlib
-import pickle
 #import json
 import simplejson as json
 import logging
-from datetime import datetime
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 import MySQLdb as mdb
 
@@ -14,8 +18,118 @@ from medgen.config import config as medgen_config
 
 from aminosearch.sqldata import SQLData, SQLdatetime
 
+from .cache_stats import get_cache_stats
+from .config import LOCAL_CACHE_SIZE, DB_REPLICAS
+
 log = logging.getLogger('text2gene.sqlcache')
 
+# Stored cache_values beginning with this marker are zlib-compressed; anything else is plain JSON
+# (which can never start with a NUL byte), so rows written before compression was added still read.
+ZLIB_MARKER = b'\x00z'
+
+# Subclasses may store a binary serialization instead of JSON by returning bytes from get_cache_value;
+# those bytes must start with a NUL byte followed by a marker character of their own (not "z").
+BINARY_PREFIX = b'\x00'
+
+# in-process single-flight registry: flight_id -> [lock, number of callers holding or waiting on lock]
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _join_flight(flight_id):
+    with _flights_lock:
+        flight = _flights.setdefault(flight_id, [threading.Lock(), 0])
+        flight[1] += 1
+    flight[0].acquire()
+    return flight
+
+
+def _leave_flight(flight_id, flight):
+    flight[0].release()
+    with _flights_lock:
+        flight[1] -= 1
+        if flight[1] == 0:
+            del _flights[flight_id]
+
+
+class LocalCache(object):
+    """ Bounded in-process LRU cache with per-entry expiry, used by SQLCache as a first tier
+    in front of MySQL so that hot keys never leave the worker.
+
+    Each entry remembers the cache VERSION it was produced under; a lookup requesting a
+    higher version treats the entry as absent.
+
+    Admission: a key is only admitted once it has been looked up at least `admit_after` times
+    (tracked in a bounded "doorkeeper" table), which keeps one-off lookups from flushing out
+    popular entries.  The default (0) admits everything.
+
+    Eviction: least-recently-used entry first, whenever the cache grows past `maxsize`.
+
+    Note that values are returned as-is (not copied), so callers must not mutate them.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, admit_after=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.admit_after = admit_after
+
+        self._entries = OrderedDict()     # cache_key -> (value, version, expires)
+        self._seen = OrderedDict()        # cache_key -> number of lookups (doorkeeper)
+        self._lock = threading.RLock()
+
+    def _note_lookup(self, cache_key):
+        if not self.admit_after:
+            return
+        self._seen[cache_key] = self._seen.pop(cache_key, 0) + 1
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+    def get(self, cache_key, version=0):
+        """ Return value stored at cache_key, or None if absent, expired, or older than version. """
+        with self._lock:
+            self._note_lookup(cache_key)
+            entry = self._entries.get(cache_key, None)
+            if entry is None:
+                return None
+
+            value, entry_version, expires = entry
+            if expires < time.time() or entry_version < version:
+                del self._entries[cache_key]
+                return None
+
+            self._entries.move_to_end(cache_key)
+            return value
+
+    def put(self, cache_key, value, version=0, ttl=None):
+        """ Store value at cache_key if the admission policy allows it.
+
+        :return: True if value was admitted to the cache
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            if self.admit_after and self._seen.get(cache_key, 0) < self.admit_after:
+                return False
+
+            self._entries.pop(cache_key, None)
+            self._entries[cache_key] = (value, version, time.time() + ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def pop(self, cache_key):
+        with self._lock:
+            self._entries.pop(cache_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class SQLCache(SQLData):
     """ Subclass of SQLData that stores simple key-value pairs on a unique-key-indexed
@@ -29,32 +143,244 @@ class SQLCache(SQLData):
     DBHOST = medgen_config.get('medgen', 'db_host')
     DBPORT = medgen_config.get('medgen', 'db_port')
 
+    # read replicas for lookups (see SQLData.read_connection).  Stores stay on the primary, and the storing
+    # thread reads from the primary for a few seconds afterwards; the local tier covers other threads.
+    DBREPLICAS = DB_REPLICAS
+
     TABLENAME_FORMAT = '{}_cache'
 
     VERSION = 0
 
+    # In-process cache tier (see LocalCache). Set LOCAL_CACHE_SIZE to 0 to disable.
+    LOCAL_CACHE_SIZE = LOCAL_CACHE_SIZE
+    LOCAL_CACHE_TTL = 3600             # seconds
+    LOCAL_CACHE_ADMIT_AFTER = 0
+
+    # max number of keys per statement in retrieve_many / store_many.
+    BATCH_SIZE = 500
+
+    # Negative entries (empty results, see is_negative) are treated as misses once they are older
+    # than NEGATIVE_CACHE_TTL seconds, so they get recomputed sooner than positive results.
+    # None means negative entries live as long as positive ones.
+    NEGATIVE_CACHE_TTL = None
+
+    # JSON values at least this many bytes long are stored zlib-compressed.
+    COMPRESS_MIN_SIZE = 1024
+
+    # seconds to wait for another worker computing the same key (MySQL GET_LOCK) before computing anyway.
+    SINGLE_FLIGHT_TIMEOUT = 60
+
+    # SQL expressions mapping a row from the old VARCHAR cache_key layout onto its BINARY(16) digest
+    # and key text (see migrate_cache_keys).  Old keys were the get_cache_key() text itself.
+    LEGACY_KEY_SQL = 'UNHEX(MD5(cache_key))'
+    LEGACY_KEY_TEXT_SQL = 'cache_key'
+
+    # rows rewritten per statement by migrate_cache_keys.
+    MIGRATE_CHUNK_SIZE = 10000
+
+    # Columns of the subclass's granular table (hgvs_text, match column(s), version), in the order
+    # returned by granular_entries().
+    GRANULAR_FIELDS = None
+
+    # (name, columns) of the granular table's unique key (on the match, i.e. not version), which
+    # store_granular_rows upserts on; see add_granular_unique_key for tables created without it.
+    GRANULAR_UNIQUE_KEY = None
+
+    # cache rows read per statement by backfill_granular.
+    BACKFILL_CHUNK_SIZE = 5000
+
+    # Retention policy enforced by purge(): entries older than RETENTION seconds (by date_created) are
+    # deleted.  None keeps entries until a VERSION bump makes them stale.
+    RETENTION = None
+
+    # rows deleted per statement by sweep_versions and purge, and seconds to pause between statements.
+    SWEEP_CHUNK_SIZE = 1000
+    SWEEP_PAUSE = 0.1
+
     def __init__(self, servicename, *args, **kwargs):
         self._db_host = self.DBHOST
         self._db_user = self.DBUSER
         self._db_pass = self.DBPASS
         self._db_name = self.DBNAME
+        self._db_replicas = self.DBREPLICAS
         self.commitOnEnd = True
 
         self.servicename = servicename
         self.tablename = kwargs.get('tablename', self.TABLENAME_FORMAT.format(self.servicename))
 
         self.conn = None
+        self.stats = get_cache_stats(self.servicename)
+
+        if self.LOCAL_CACHE_SIZE:
+            self.local_cache = LocalCache(maxsize=self.LOCAL_CACHE_SIZE,
+                                          ttl=self.LOCAL_CACHE_TTL,
+                                          admit_after=self.LOCAL_CACHE_ADMIT_AFTER)
+        else:
+            self.local_cache = None
 
     def get_cache_key(self, querydict):
-        """ Default method to make a unique cache key from an input dictionary.
+        """ Default method to make a unique cache key from an input dictionary: a canonical
+        JSON encoding (sorted keys, no whitespace), which is stable across Python versions.
+
+        Override in subclasses to build the key text another way; the stored key is always
+        the md5 digest of this text (see get_key_digest).
+        """
+        return json.dumps(querydict, sort_keys=True, separators=(',', ':'), default=str)
+
+    def get_key_digest(self, querydict):
+        """ Returns the 16-byte md5 digest of get_cache_key(querydict), used as the BINARY(16)
+        primary key of the cache table.
         """
-        return hashlib.md5(pickle.dumps(sorted(querydict.items()))).hexdigest()
+        return hashlib.md5(self.get_cache_key(querydict).encode('utf-8')).digest()
 
     def get_cache_value(self, value):
-        """ Default method to turn a serializable data structure into a storable and
-        reconstructable mysql blob value.  (Uses json.dumps and strips out literal "\'")
+        """ Default method to turn a serializable data structure into a reconstructable
+        JSON string.  (Uses json.dumps)
+        """
+        return json.dumps(value)
+
+    def load_cache_value(self, cache_value):
+        """ Default method to reconstruct a data structure from a stored cache_value.
+        (Inverse of get_cache_value; uses json.loads)
         """
-        return json.dumps(value).replace("\'", '')        # get rid of literal "\'" which mysql will choke on.
+        return json.loads(cache_value)
+
+    def encode_cache_value(self, json_text):
+        """ Turns JSON text (or marked binary data, see BINARY_PREFIX) from get_cache_value into the
+        bytes stored in the cache_value column, compressing it if it is at least COMPRESS_MIN_SIZE bytes long.
+        """
+        data = json_text if isinstance(json_text, bytes) else json_text.encode('utf-8')
+        if len(data) >= self.COMPRESS_MIN_SIZE:
+            return ZLIB_MARKER + zlib.compress(data)
+        return data
+
+    def decode_cache_value(self, cache_value):
+        """ Inverse of encode_cache_value: returns JSON text (or marked binary data) for a stored
+        cache_value, which may be compressed bytes, plain bytes, or text (from a table still using
+        a JSON column).
+        """
+        if isinstance(cache_value, str):
+            return cache_value
+        if cache_value.startswith(ZLIB_MARKER):
+            cache_value = zlib.decompress(cache_value[len(ZLIB_MARKER):])
+        if cache_value.startswith(BINARY_PREFIX):
+            return cache_value
+        return cache_value.decode('utf-8')
+
+    def is_negative(self, value):
+        """ Default method to decide whether a value is a "negative" result (i.e. nothing found),
+        subject to NEGATIVE_CACHE_TTL.  Empty lists and dictionaries are negative.
+        """
+        return value == [] or value == {}
+
+    def _value_from_row(self, row):
+        """ Returns value stored in row, or None if it is a negative entry older than NEGATIVE_CACHE_TTL. """
+        value = self.load_cache_value(self.decode_cache_value(row['cache_value']))
+        if self.NEGATIVE_CACHE_TTL is not None and row['date_created'] is not None and self.is_negative(value):
+            if row['date_created'] < datetime.now() - timedelta(seconds=self.NEGATIVE_CACHE_TTL):
+                log.debug('Ignoring expired negative entry at cache_key location %r.', row['cache_key'])
+                return None
+        return value
+
+    def _local_put(self, key, value, version):
+        if self.local_cache is None:
+            return
+        if self.NEGATIVE_CACHE_TTL is not None and self.is_negative(value):
+            self.local_cache.put(key, value, version, ttl=min(self.LOCAL_CACHE_TTL, self.NEGATIVE_CACHE_TTL))
+        else:
+            self.local_cache.put(key, value, version)
+
+    # Statement builders and row handling shared by the methods below and their coroutine versions in
+    # AsyncSQLCache (see async_cached.py), which differ only in how the statements are run.
+
+    def _local_get(self, key, version, record_stats=False):
+        if self.local_cache is None:
+            return None
+        value = self.local_cache.get(key, version)
+        if value is not None and record_stats:
+            self.stats.incr('local_hits')
+        return value
+
+    def _accept_row(self, key, row, version, record_stats=False):
+        """ Returns the value in a fetched row (filling the in-process tier), or None if there is no row,
+        or it is older than version, or it is an expired negative entry. """
+        if row and row['version'] >= version:
+            value = self._value_from_row(row)
+            if value is not None:
+                self._local_put(key, value, row['version'])
+            return value
+        if row and record_stats:
+            self.stats.incr('stale_rejects')
+        return None
+
+    def _local_get_many(self, keys, version):
+        """ :return: ({cache_key: value} found in the in-process tier, [distinct cache_keys left to fetch]) """
+        found = {}
+        for key in keys:
+            value = self._local_get(key, version, record_stats=True)
+            if value is not None:
+                found[key] = value
+        return found, list(OrderedDict.fromkeys(key for key in keys if key not in found))
+
+    def _accept_rows(self, keys, found, rows, version, start):
+        """ Completes a retrieve_many: adds the values in fetched rows to found, records the stats,
+        and returns the values in keys order. """
+        for row in rows:
+            value = self._accept_row(row['cache_key'], row, version, record_stats=True)
+            if value is not None:
+                found[row['cache_key']] = value
+        values = [found.get(key, None) for key in keys]
+        for value in values:
+            self._record_lookup(value)
+        self.stats.record_retrieve((time.time() - start) * 1000)
+        return values
+
+    def _get_row_query(self, querydict):
+        sql = 'SELECT * from ' + self.tablename + ' where cache_key = %s limit 1'
+        return sql, (self.get_key_digest(querydict),)
+
+    def _get_rows_queries(self, keys):
+        """ Yields (sql, args) selecting the rows for keys, BATCH_SIZE keys per statement. """
+        for idx in range(0, len(keys), self.BATCH_SIZE):
+            chunk = keys[idx:idx + self.BATCH_SIZE]
+            sql = 'SELECT * from ' + self.tablename + ' where cache_key in (%s)' % ','.join(['%s' for _ in chunk])
+            yield sql, tuple(chunk)
+
+    def _store_query(self, querydict, value, update_if_duplicate=True):
+        args = (self.get_key_digest(querydict), self.get_cache_key(querydict),
+                self.encode_cache_value(self.get_cache_value(value)), self.VERSION)
+        if update_if_duplicate:
+            sql = 'insert into {db.tablename} (cache_key, key_text, cache_value, version) values (%s, %s, %s, %s)' \
+                  ' on duplicate key update cache_value=values(cache_value), version=values(version)'
+        else:
+            sql = 'insert ignore into {db.tablename} (cache_key, key_text, cache_value, version) values (%s, %s, %s, %s)'
+        return sql.format(db=self), args
+
+    def _stored(self, key, value, rowcount, update_if_duplicate=True):
+        """ Records a store() statement's outcome.  :return: False if an existing entry was left alone """
+        if not rowcount and not update_if_duplicate:
+            return False
+        self.stats.incr('stores')
+        self._local_put(key, value, self.VERSION)
+        return True
+
+    def _store_many_rows(self, items):
+        """ :return: list of (cache_key, key_text, cache_value, version, value) for (querydict, value) items """
+        return [(self.get_key_digest(querydict), self.get_cache_key(querydict),
+                 self.encode_cache_value(self.get_cache_value(value)), self.VERSION, value)
+                for querydict, value in items]
+
+    def _store_many_queries(self, rows):
+        """ Yields (sql, args, number of rows) upserting rows (see _store_many_rows), BATCH_SIZE per statement. """
+        for idx in range(0, len(rows), self.BATCH_SIZE):
+            chunk = rows[idx:idx + self.BATCH_SIZE]
+            sql = 'insert into {db.tablename} (cache_key, key_text, cache_value, version) values '.format(db=self)
+            sql += ','.join(['(%s,%s,%s,%s)' for _ in chunk])
+            sql += ' on duplicate key update cache_value=values(cache_value), version=values(version)'
+            args = []
+            for key, key_text, cache_value, version, _ in chunk:
+                args.extend([key, key_text, cache_value, version])
+            yield sql, args, len(chunk)
 
     def update(self, fv_dict):
         """
@@ -62,8 +388,8 @@ class SQLCache(SQLData):
         :return: True if successful
         :raises: MySQLdb exceptions
         """
-        sql = 'update {db.tablename} set cache_value=%s where cache_key=%s'.format(db=self)
-        self.execute(sql, fv_dict['cache_value'], fv_dict['cache_key'])
+        sql = 'update {db.tablename} set cache_value=%s, version=%s where cache_key=%s'.format(db=self)
+        self.execute(sql, fv_dict['cache_value'], fv_dict['version'], fv_dict['cache_key'])
         return True
 
     def store(self, querydict, value, **kwargs):
@@ -73,62 +399,231 @@ class SQLCache(SQLData):
         The value MUST be serializable to JSON.  
 
         json.dumps(value) will be tried by default; override the get_cache_value() method 
-        in your subclass to construct JSON another way if needed.
+        in your subclass to construct JSON another way if needed.  Large values are stored
+        compressed (see encode_cache_value).
 
-        If an entry with previously stored querydict exists, entry will be updated with date_created 
-        set to datetime.now().  This behavior can be changed to ignoring the update by setting 
+        If an entry with previously stored querydict exists, entry will be updated (in the same
+        "INSERT ... ON DUPLICATE KEY UPDATE" statement) with date_created set to now() by the update
+        trigger.  This behavior can be changed to ignoring the update ("INSERT IGNORE") by setting
         update_if_duplicate to False (default: True).
 
         Override self.get_cache_key to implement a different approach to turning `querydict` arg into 
-        hashable key.
+        key text (which is hashed into the stored BINARY(16) cache_key).
 
         Keywords:
            update_if_duplicate: (bool) see note above.
 
         :param querydict: serializable
         :param value: JSON-serializable value
-        :return: True if successful
+        :return: True if successful (False if the entry existed and update_if_duplicate was False)
         :raises: MySQLdb exceptions and json serialization errors
         """
-        fv_dict = {'cache_key': self.get_cache_key(querydict), 
-                   'cache_value': self.get_cache_value(value),
-                   'version': self.VERSION,
-                  }
+        update_if_duplicate = kwargs.get('update_if_duplicate', True)
+        sql, args = self._store_query(querydict, value, update_if_duplicate)
         try:
-            self.insert(self.tablename, fv_dict)
-        except mdb.IntegrityError:
-            if kwargs.get('update_if_duplicate', True):
-                # update entry with current time
-                return self.update(fv_dict)
-            else:
-                return False
+            cursor = self.execute(sql, *args)
+        except Exception:
+            self.stats.incr('store_failures')
+            raise
+        return self._stored(args[0], value, cursor.rowcount, update_if_duplicate)
 
-        return True
+    def store_many(self, items):
+        """ Bulk version of store(): takes an iterable of (querydict, value) pairs and writes them
+        using multi-row "INSERT ... ON DUPLICATE KEY UPDATE" statements of up to BATCH_SIZE rows each.
+
+        Existing entries are always updated (and date_created reset by the update trigger).
+
+        :param items: iterable of (querydict, value) pairs
+        :return: number of entries stored
+        :raises: MySQLdb exceptions and json serialization errors
+        """
+        rows = self._store_many_rows(items)
+        for sql, args, count in self._store_many_queries(rows):
+            try:
+                self.execute(sql, *args)
+            except Exception:
+                self.stats.incr('store_failures', count)
+                raise
+            self.stats.incr('stores', count)
+
+        for key, _, _, version, value in rows:
+            self._local_put(key, value, version)
+        return len(rows)
 
     def delete(self, querydict):
-        sql = 'delete from {db.tablename} where cache_key="%s"'.format(db=self)
-        self.execute(sql % self.get_cache_key(querydict))
+        key = self.get_key_digest(querydict)
+        if self.local_cache is not None:
+            self.local_cache.pop(key)
+        sql = 'delete from {db.tablename} where cache_key=%s'.format(db=self)
+        self.execute(sql, key)
 
     def retrieve(self, querydict, version=0):
         """ If cache contains a value for this querydict, return it. Otherwise, return None.
 
-        If requested version number is GREATER THAN OR EQUAL TO version number of existing data, older 
-        version will be destroyed so that newer version can be created in its place.
+        Entries with a version number LOWER than the requested version are ignored (treated as a miss);
+        they get overwritten when the value is stored again, and purged in bulk by sweep_versions().
 
         Thus, supplying version=0 allows returns from cache from *any* version of data that has ever been stored.
 
+        A cached negative result (e.g. an empty list) is returned as such, distinct from a miss (None),
+        until it is older than NEGATIVE_CACHE_TTL.
+
+        The in-process tier (self.local_cache) is consulted first, and filled from MySQL on a hit.
+
         :param querydict:
         :param version: (int) only return results from cache with greater than or equal version number [default: 0]
         :return: value at this cache location, or None
         """
-        row = self.get_row(querydict)
-        if row:
-            if row['version'] >= version:
-                return json.loads(row['cache_value'])            #.decode('string_escape'))
-            else:
-                log.debug('Expiring obsolete entry at cache_key location %s.', self.get_cache_key(querydict))
-                self.delete(querydict)
-        return None
+        start = time.time()
+        value = self._lookup(querydict, version, record_stats=True)
+        self._record_lookup(value)
+        self.stats.record_retrieve((time.time() - start) * 1000)
+        return value
+
+    def _lookup(self, querydict, version=0, record_stats=False):
+        """ Returns the value for querydict from the in-process tier or MySQL (filling the in-process
+        tier on a MySQL hit), or None.  The hit / miss counts are left to the caller (see retrieve).
+
+        :param record_stats: whether to count local_hits and stale_rejects [default: False]
+        """
+        key = self.get_key_digest(querydict)
+        value = self._local_get(key, version, record_stats)
+        if value is None:
+            value = self._accept_row(key, self.get_row(querydict), version, record_stats)
+        return value
+
+    def _record_lookup(self, value):
+        if value is None:
+            self.stats.incr('misses')
+        else:
+            self.stats.incr('hits')
+            if self.is_negative(value):
+                self.stats.incr('negative_hits')
+
+    def retrieve_many(self, querydicts, version=0):
+        """ Bulk version of retrieve(): looks up all querydicts at once, using the in-process tier
+        first and then "WHERE cache_key IN (...)" selects of up to BATCH_SIZE keys each.
+
+        :param querydicts: iterable of querydicts
+        :param version: (int) only return results from cache with greater than or equal version number [default: 0]
+        :return: list of values (or None for each miss) in the same order as querydicts
+        """
+        start = time.time()
+        keys = [self.get_key_digest(querydict) for querydict in querydicts]
+        found, missing = self._local_get_many(keys, version)
+        return self._accept_rows(keys, found, self.get_rows(missing), version, start)
+
+    @contextmanager
+    def single_flight(self, querydict):
+        """ Context manager that lets only one caller at a time through for this querydict's cache_key:
+        in-process callers wait on a local lock, other workers wait on a MySQL advisory lock (GET_LOCK).
+
+        If the advisory lock cannot be obtained within SINGLE_FLIGHT_TIMEOUT seconds (or MySQL errors out),
+        the block runs anyway rather than failing the request.
+        """
+        key = self.get_cache_key(querydict)
+        flight_id = '%s:%s' % (self.tablename, self.get_key_digest(querydict).hex())
+        # MySQL lock names are limited to 64 characters.
+        lock_name = 't2g_' + hashlib.md5(flight_id.encode('utf-8')).hexdigest()
+
+        flight = _join_flight(flight_id)
+        try:
+            # advisory locks belong to a MySQL session, so hold one connection from GET_LOCK to RELEASE_LOCK.
+            with self.connection():
+                locked = False
+                try:
+                    row = self.fetchrow('SELECT GET_LOCK(%s, %s) as locked', lock_name, self.SINGLE_FLIGHT_TIMEOUT)
+                    locked = bool(row and row['locked'])
+                    if not locked:
+                        log.info('Timed out waiting for lock on cache_key %s; computing anyway.', key)
+                except mdb.Error as error:
+                    log.info('Could not obtain lock on cache_key %s: %r', key, error)
+
+                try:
+                    yield
+                finally:
+                    if locked:
+                        self.fetchrow('SELECT RELEASE_LOCK(%s) as released', lock_name)
+        finally:
+            _leave_flight(flight_id, flight)
+
+    def retrieve_or_compute(self, querydict, compute, skip_cache=False):
+        """ Cache-aside lookup with request coalescing.  On a miss, compute() is called inside
+        single_flight(), after checking the cache once more in case a concurrent caller just stored
+        the value; the result is stored unless it is None.
+
+        :param querydict:
+        :param compute: function taking no arguments and returning the value for querydict
+        :param skip_cache: whether to force recomputing the value
+        :return: (value, from_cache) tuple
+        """
+        if not skip_cache:
+            value = self.retrieve(querydict, version=self.VERSION)
+            if value is not None:
+                return value, True
+
+        with self.single_flight(querydict):
+            if not skip_cache:
+                # (the miss above was already counted, so this lookup records no stats.)
+                value = self._lookup(querydict, version=self.VERSION)
+                if value is not None:
+                    return value, True
+
+            start = time.time()
+            value = compute()
+            self.stats.record_compute((time.time() - start) * 1000)
+            if value is not None:
+                self.store(querydict, value)
+
+        return value, False
+
+    def retrieve_or_compute_many(self, querydicts, compute, skip_cache=False):
+        """ Batched cache-aside lookup.  Cached values for all querydicts are fetched with retrieve_many(),
+        compute(querydict) is called for each miss, and all newly computed values are written back with
+        a single store_many().  Computed values of None are returned but not stored.
+
+        :param querydicts: iterable of querydicts
+        :param compute: function taking one querydict and returning its value
+        :param skip_cache: whether to force recomputing every value
+        :return: list of (value, from_cache) tuples in the same order as querydicts
+        """
+        querydicts = list(querydicts)
+        if skip_cache:
+            values = [None] * len(querydicts)
+        else:
+            values = self.retrieve_many(querydicts, version=self.VERSION)
+
+        results = []
+        computed = []
+        try:
+            for querydict, value in zip(querydicts, values):
+                if value is not None:
+                    results.append((value, True))
+                    continue
+
+                start = time.time()
+                value = compute(querydict)
+                self.stats.record_compute((time.time() - start) * 1000)
+                if value is not None:
+                    computed.append((querydict, value))
+                results.append((value, False))
+        finally:
+            # keep whatever was computed, even if a later compute() raised.
+            if computed:
+                self.store_many(computed)
+
+        return results
+
+    def get_rows(self, keys):
+        """ Return all rows (as dicts) stored at the given cache_keys, in no particular order.
+
+        :param keys: list of cache_keys (already passed through get_key_digest)
+        :return: list of dictionaries representing rows found
+        """
+        rows = []
+        for sql, args in self._get_rows_queries(keys):
+            rows.extend(self.fetchall(sql, *args))
+        return rows
 
     def get_row(self, querydict):
         """ If cache contains a value for this querydict, return entire row (as dict). Otherwise, return None.
@@ -136,9 +631,128 @@ class SQLCache(SQLData):
         :param querydict:
         :return: dictionary representing entire row for this query dictionary
         """
-        key = self.get_cache_key(querydict)
-        sql = 'SELECT * from ' + self.tablename + ' where cache_key = %s limit 1'
-        return self.fetchrow(sql, key)
+        sql, args = self._get_row_query(querydict)
+        return self.fetchrow(sql, *args)
+
+    def granular_entries(self, hgvs_text, value, version):
+        """ Subclasses with a granular table return the rows (tuples in GRANULAR_FIELDS order) that
+        represent this cached value for hgvs_text.
+        """
+        raise NotImplementedError
+
+    def hgvs_text_for_key_text(self, key_text):
+        """ Returns the hgvs_text a stored key_text was made from, or None if it cannot be recovered
+        (in which case backfill_granular skips the row).  Default: keys shaped "<hgvs_text>@<lvg_mode>".
+        """
+        return key_text.split('@')[0] if key_text else None
+
+    def store_granular_rows(self, entries):
+        """ Upserts entries (tuples in GRANULAR_FIELDS order) into the granular table using multi-row
+        "INSERT ... ON DUPLICATE KEY UPDATE" statements of up to BATCH_SIZE rows each, in one transaction.
+        Storing the same match twice just refreshes its version.
+
+        :param entries: list of tuples
+        :return: number of entries written
+        """
+        fields = self.GRANULAR_FIELDS
+        placeholder = '(%s)' % ','.join(['%s'] * len(fields))
+        with self.transaction():
+            for idx in range(0, len(entries), self.BATCH_SIZE):
+                chunk = entries[idx:idx + self.BATCH_SIZE]
+                sql = 'insert into {table} ({fields}) values {values} on duplicate key update version=values(version)'.format(
+                            table=self.granular_table, fields=','.join(fields), values=','.join([placeholder] * len(chunk)))
+                args = []
+                for entry in chunk:
+                    args.extend(entry)
+                self.execute(sql, *args)
+        return len(entries)
+
+    def granular_columns(self):
+        """ Returns list of the granular table's column names (empty if the table doesn't exist).
+        Read on the primary, which a replica's schema may lag behind.
+        """
+        with self.connection():
+            rows = self.fetchall('select COLUMN_NAME from information_schema.COLUMNS where TABLE_SCHEMA=%s '
+                                 'and TABLE_NAME=%s', self._db_name, self.granular_table)
+        return [row['COLUMN_NAME'] for row in rows]
+
+    def add_granular_unique_key(self):
+        """ Adds GRANULAR_UNIQUE_KEY to a granular table created before it was part of
+        create_granular_table.  Duplicate matches are deleted first, keeping the row with the highest
+        version of each.  Safe to run more than once.
+
+        Tables with an older layout, lacking some of GRANULAR_FIELDS, are left alone (they have to be
+        rebuilt; see sbin/migrate_cache_tables.py).
+
+        :return: True if the key was added, False if the table already has it, doesn't exist, or has an older layout
+        """
+        name, columns = self.GRANULAR_UNIQUE_KEY
+        key_columns = [column.strip() for column in columns.split(',')]
+        existing = self.granular_columns()
+        if not existing:
+            return False
+        missing = [column for column in self.GRANULAR_FIELDS if column not in existing]
+        if missing:
+            log.warning('%s has an older layout (no %s column); not adding unique key %s', self.granular_table,
+                        ', '.join(missing), name)
+            return False
+
+        with self.connection():
+            index = self.fetchrow('select INDEX_NAME from information_schema.STATISTICS where TABLE_SCHEMA=%s '
+                                  'and TABLE_NAME=%s and INDEX_NAME=%s limit 1', self._db_name, self.granular_table, name)
+            if index:
+                return False
+            duplicates = self.fetchall('select {columns}, count(*) as copies from {table} group by {columns} '
+                                       'having copies > 1'.format(columns=columns, table=self.granular_table))
+
+        log.info('%s: deleting duplicates of %i matches before adding unique key %s', self.granular_table,
+                 len(duplicates), name)
+        sql = 'delete from {table} where {where} order by version limit %s'.format(
+                    table=self.granular_table, where=' and '.join('%s=%%s' % column for column in key_columns))
+        for row in duplicates:
+            self.execute(sql, *([row[column] for column in key_columns] + [row['copies'] - 1]))
+
+        self.execute('alter table {} add unique key {} ({})'.format(self.granular_table, name, columns))
+        return True
+
+    def backfill_granular(self, progress=None):
+        """ Fills the granular table from values already in the cache table, without recomputing
+        anything.  Walks the cache table in primary key order, BACKFILL_CHUNK_SIZE rows at a time.
+        Rows whose hgvs_text cannot be recovered from key_text, and negative results, are skipped.
+
+        :param progress: optional function called as progress(granular_table, rows_scanned, entries_written)
+        :return: (int) number of granular entries written
+        """
+        sql = 'select cache_key, key_text, cache_value, version, date_created from {db.tablename} ' \
+              'where cache_key > %s order by cache_key limit %s'.format(db=self)
+        last_key = b''
+        scanned = 0
+        written = 0
+        while True:
+            rows = self.fetchall(sql, last_key, self.BACKFILL_CHUNK_SIZE)
+            if not rows:
+                break
+            entries = []
+            for row in rows:
+                hgvs_text = self.hgvs_text_for_key_text(row['key_text'])
+                if not hgvs_text:
+                    continue
+                try:
+                    value = self._value_from_row(row)
+                except Exception as error:
+                    log.info('%s: cannot load value for %s: %r', self.tablename, row['key_text'], error)
+                    continue
+                if value:
+                    entries.extend(self.granular_entries(hgvs_text, value, row['version']))
+            written += self.store_granular_rows(entries)
+            scanned += len(rows)
+            last_key = rows[-1]['cache_key']
+            log.info('%s: backfilled %i entries from %i rows', self.granular_table, written, scanned)
+            if progress:
+                progress(self.granular_table, scanned, written)
+            if len(rows) < self.BACKFILL_CHUNK_SIZE:
+                break
+        return written
 
     def _create_triggers(self):
         sql = """create trigger `{db.tablename}_new_entry_date` before INSERT on `{db.tablename}`
@@ -149,15 +763,39 @@ class SQLCache(SQLData):
                 for each row set new.date_created = now()""".format(db=self)
         self.execute(sql)
 
+    def _drop_triggers(self):
+        self.execute('drop trigger if exists `{db.tablename}_new_entry_date`'.format(db=self))
+        self.execute('drop trigger if exists `{db.tablename}_update`'.format(db=self))
+
+    def _ensure_triggers(self):
+        """ Re-creates the date_created triggers if either is missing (e.g. after a migrate_cache_keys
+        run that died between its last ALTER and re-creating them).
+
+        :return: True if the triggers were re-created
+        """
+        with self.connection():
+            rows = self.fetchall('select TRIGGER_NAME from information_schema.TRIGGERS where TRIGGER_SCHEMA=%s '
+                                 'and EVENT_OBJECT_TABLE=%s', self._db_name, self.tablename)
+        names = set(row['TRIGGER_NAME'] for row in rows)
+        if set(['%s_new_entry_date' % self.tablename, '%s_update' % self.tablename]) <= names:
+            return False
+        log.info('Re-creating date_created triggers on %s', self.tablename)
+        self._drop_triggers()
+        self._create_triggers()
+        return True
+
     def create_table(self, reset=False):
         if reset:
             self.execute("DROP TABLE IF EXISTS {}".format(self.tablename))
 
         sql = """CREATE TABLE {} (
-                cache_key VARCHAR(255) primary key not null,
-                cache_value JSON default NULL,
+                cache_key BINARY(16) primary key not null,
+                key_text TEXT default NULL,
+                cache_value LONGBLOB default NULL,
                 date_created DATETIME default NULL,
-                version int(11) default 0
+                version int(11) default 0,
+                KEY version_date (version, date_created),
+                KEY date_created (date_created)
               ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci""".format(self.tablename)
 
         try:
@@ -174,20 +812,142 @@ class SQLCache(SQLData):
     def drop_table(self):
         super(SQLCache, self).drop_table(self.tablename)
 
-    def reset(self, before=None):
-        # UNTESTED!
-        # TODO: test:
+    def upgrade_value_column(self):
+        """ Converts cache_value in a table created with a JSON column to LONGBLOB, so it can hold
+        compressed values.  Existing JSON rows are kept as plain (uncompressed) values.
+        """
+        row = self.fetchrow('select DATA_TYPE from information_schema.COLUMNS where TABLE_SCHEMA=%s '
+                            'and TABLE_NAME=%s and COLUMN_NAME="cache_value"', self._db_name, self.tablename)
+        if row and row['DATA_TYPE'].lower() != 'longblob':
+            log.info('Converting %s.cache_value from %s to LONGBLOB', self.tablename, row['DATA_TYPE'])
+            self.execute('alter table {db.tablename} modify cache_value LONGBLOB default NULL'.format(db=self))
+            return True
+        return False
 
-        sql = "DELETE FROM {db.tablename} where date_created < ".format(db=self)
+    def add_indexes(self):
+        """ Adds the (version, date_created) index used by sweep_versions and the date_created index
+        used by purge to a table created before they were part of create_table.
 
-        if before:
-            before = SQLdatetime(before)
-        else:
-            before = SQLdatetime(datetime.now())
+        :return: list of names of the indexes that were added
+        """
+        indexes = [('version_date', 'version, date_created'), ('date_created', 'date_created')]
+        return [name for name, columns in indexes if self.add_index(self.tablename, name, columns)]
 
-        sql += '"%s"' % before
+    def sweep_versions(self, version=None, progress=None):
+        """ Deletes entries whose version is lower than `version` (default: this class's VERSION),
+        SWEEP_CHUNK_SIZE rows per statement with a SWEEP_PAUSE between statements, so the sweep can
+        run alongside live traffic.  Uses the (version, date_created) index; oldest entries go first.
 
-        self.execute(sql)
+        :param version: (int) purge entries with a version lower than this [default: self.VERSION]
+        :param progress: optional function called as progress(tablename, deleted_so_far) after each chunk
+        :return: (int) total number of rows deleted
+        """
+        if version is None:
+            version = self.VERSION
+
+        sql = 'delete from {db.tablename} where version < %s order by version, date_created limit %s'.format(db=self)
+        deleted = 0
+        while True:
+            cursor = self.execute(sql, version, self.SWEEP_CHUNK_SIZE)
+            if cursor.rowcount < 1:
+                break
+            deleted += cursor.rowcount
+            log.info('%s: swept %i entries older than version %i', self.tablename, deleted, version)
+            if progress:
+                progress(self.tablename, deleted)
+            if cursor.rowcount < self.SWEEP_CHUNK_SIZE:
+                break
+            time.sleep(self.SWEEP_PAUSE)
+
+        return deleted
+
+    def migrate_cache_keys(self):
+        """ Rewrites a table created with the old VARCHAR(255) cache_key primary key in place, so that
+        cache_key becomes the BINARY(16) digest used by get_key_digest and the old key text is kept
+        in key_text.  Old keys are mapped with the LEGACY_KEY_SQL and LEGACY_KEY_TEXT_SQL expressions,
+        MIGRATE_CHUNK_SIZE rows at a time.  date_created is preserved.
+
+        An interrupted migration picks up where it left off when run again (re-creating the
+        date_created triggers if it died after the last ALTER).
+
+        :return: True if the table was migrated, False if it already uses binary keys
+        """
+        # (read on the primary, which a replica's schema may lag behind.)
+        with self.connection():
+            rows = self.fetchall('select COLUMN_NAME, DATA_TYPE from information_schema.COLUMNS where TABLE_SCHEMA=%s '
+                                 'and TABLE_NAME=%s', self._db_name, self.tablename)
+        columns = dict((row['COLUMN_NAME'], row['DATA_TYPE'].lower()) for row in rows)
+        if columns.get('cache_key', 'binary') == 'binary':
+            if columns:
+                self._ensure_triggers()
+            return False
+
+        log.info('Migrating %s to BINARY(16) cache keys', self.tablename)
+        add_columns = [column_sql for name, column_sql in [('new_key', 'add column new_key BINARY(16) default NULL'),
+                                                           ('key_text', 'add column key_text TEXT default NULL')]
+                       if name not in columns]
+        if add_columns:
+            self.execute('alter table {db.tablename} '.format(db=self) + ', '.join(add_columns))
+
+        # the update trigger would otherwise stamp every migrated row with now().
+        self._drop_triggers()
+
+        sql = 'update {db.tablename} set new_key={db.LEGACY_KEY_SQL}, key_text={db.LEGACY_KEY_TEXT_SQL} ' \
+              'where new_key is NULL limit %s'.format(db=self)
+        migrated = 0
+        while True:
+            cursor = self.execute(sql, self.MIGRATE_CHUNK_SIZE)
+            if cursor.rowcount < 1:
+                break
+            migrated += cursor.rowcount
+            log.info('%s: %i rows migrated', self.tablename, migrated)
+
+        self.execute('alter table {db.tablename} drop primary key, drop column cache_key, '
+                     'change new_key cache_key BINARY(16) not null first, add primary key (cache_key)'.format(db=self))
+        self._create_triggers()
+        return True
+
+    def purge(self, before=None, progress=None):
+        """ Deletes entries created before `before` (default: RETENTION seconds ago), SWEEP_CHUNK_SIZE
+        rows per statement with a SWEEP_PAUSE between statements, so the purge can run alongside live
+        traffic.  Each chunk is picked off the date_created index and deleted by primary key, in key order.
+
+        If neither `before` nor RETENTION is set, nothing is deleted (see sweep_versions for stale versions).
+
+        :param before: (datetime) purge entries created before this time [default: now - RETENTION]
+        :param progress: optional function called as progress(tablename, deleted_so_far) after each chunk
+        :return: (int) total number of rows deleted
+        """
+        if before is None:
+            if self.RETENTION is None:
+                return 0
+            before = datetime.now() - timedelta(seconds=self.RETENTION)
+        before = SQLdatetime(before)
+
+        select_sql = 'select cache_key from {db.tablename} where date_created < %s ' \
+                     'order by date_created limit %s'.format(db=self)
+        deleted = 0
+        while True:
+            # (candidates are read on the primary, which a replica may lag behind.)
+            with self.connection():
+                keys = sorted(row['cache_key'] for row in self.fetchall(select_sql, before, self.SWEEP_CHUNK_SIZE))
+                if not keys:
+                    break
+                sql = 'delete from {db.tablename} where date_created < %s and cache_key in ({keys})'.format(
+                            db=self, keys=', '.join(['%s'] * len(keys)))
+                cursor = self.execute(sql, before, *keys)
+            deleted += cursor.rowcount
+            if self.local_cache is not None:
+                for key in keys:
+                    self.local_cache.pop(key)
+            log.info('%s: purged %i entries created before %s', self.tablename, deleted, before)
+            if progress:
+                progress(self.tablename, deleted)
+            if len(keys) < self.SWEEP_CHUNK_SIZE:
+                break
+            time.sleep(self.SWEEP_PAUSE)
+
+        return deleted
 
     def size(self):
         """ Counts number of rows currently in table.
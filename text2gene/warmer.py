@@ -0,0 +1,294 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import csv
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docopt import docopt
+
+from .lvg_cached import VariantLVGCached
+from .cached import ClinvarCachedQuery, PubtatorCachedQuery
+from .config import GRANULAR_CACHE
+from .pmid_lookups import clinvar_lex_to_pmid, pubtator_lex_to_pmid, enable_gene_prefetch
+
+log = logging.getLogger('text2gene.warmer')
+
+# columns that hold an HGVS string in the data/*.tsv sample files (first one present wins).
+HGVS_COLUMNS = ['HGVS', 'hgvs_text', 'Name', 'subject_label']
+
+SERVICES = ['lvg', 'clinvar', 'pubtator', 'google']
+
+
+__doc__ = """warm_cache
+
+Fill the LVG, ClinVar, PubTator and (optionally) Google caches for a list of HGVS strings.
+Entries already cached are skipped; only cache misses count against the rate limits.
+
+Usage:
+    warm_cache [options] <source>...
+    warm_cache [options] --sql=<query>
+    warm_cache --help
+
+Sources can be text files (one HGVS string per line) or tab-separated files with a header
+row containing one of the columns: HGVS, hgvs_text, Name, subject_label.
+
+--sql runs the query against the ClinVar database, e.g. "select HGVS from samples_vus".
+
+Options:
+    -h, --help              Show this screen.
+    -w, --workers=<n>       Number of worker threads [default: 4]
+    --google                Also warm the Google query cache.
+    --lvg-rate=<n>          Max LVG computations per second; 0 is unlimited [default: 0]
+    --clinvar-rate=<n>      Max ClinVar lookups per second; 0 is unlimited [default: 0]
+    --pubtator-rate=<n>     Max PubTator lookups per second; 0 is unlimited [default: 0]
+    --google-rate=<n>       Max Google queries per second; 0 is unlimited [default: 1]
+    --column=<name>         Column holding HGVS strings (tsv files and --sql).
+    --limit=<n>             Only warm the first n HGVS strings.
+    --prefetch              Load each gene's PubTator rows once and search them in memory
+                            (for lists of variants in a few genes).
+"""
+
+
+class RateLimiter(object):
+    """ Token bucket shared by all worker threads: allows `rate` calls per second on average,
+    with bursts of up to `burst` calls.  A rate of 0 (or None) disables limiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate or 0)
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def _clean_hgvs(text):
+    # ClinVar names look like "NM_000020.2(ACVRL1):c.696_698delCTC (p.Ser233del)"
+    return text.strip().split(' ')[0]
+
+
+def read_hgvs_file(path, column=None):
+    """ Returns list of hgvs strings found in path, which can be a plain list (one per line)
+    or a tab-separated file with a header row.
+
+    :param path: path to sample file
+    :param column: name of the column holding hgvs strings [default: first of HGVS_COLUMNS present]
+    :return: list of hgvs strings
+    """
+    with open(path, 'r') as fh:
+        lines = [line for line in fh.read().split('\n') if line.strip()]
+
+    if not lines or '\t' not in lines[0]:
+        return [_clean_hgvs(line) for line in lines]
+
+    reader = csv.DictReader(lines, delimiter='\t')
+    if column is None:
+        column = next((name for name in HGVS_COLUMNS if name in reader.fieldnames), None)
+    if column is None:
+        raise ValueError('%s: no HGVS column found in header (looked for %s)' % (path, ', '.join(HGVS_COLUMNS)))
+    return [_clean_hgvs(row[column]) for row in reader if row.get(column)]
+
+
+def read_hgvs_sql(sql, column=None):
+    """ Returns list of hgvs strings selected by sql from the ClinVar database.
+
+    :param sql: select statement
+    :param column: name of the column holding hgvs strings [default: HGVS, or the only column]
+    :return: list of hgvs strings
+    """
+    from medgen.api import ClinVarDB
+    rows = ClinVarDB().fetchall(sql)
+    hgvs_texts = []
+    for row in rows:
+        if column is None:
+            column = 'HGVS' if 'HGVS' in row or len(row) > 1 else list(row.keys())[0]
+        if row[column]:
+            hgvs_texts.append(_clean_hgvs(row[column]))
+    return hgvs_texts
+
+
+def _dedupe(items):
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+class CacheWarmer(object):
+    """ Fills the LVG, ClinVar, PubTator and (optionally) Google caches for a list of hgvs strings
+    using a pool of worker threads.
+
+    Each worker thread gets its own cached-query objects (and therefore its own MySQL connection).
+    Lookups already in cache are counted as "cached" and do not consume rate-limit tokens; each
+    miss waits on its service's RateLimiter before hitting the upstream.
+    """
+
+    def __init__(self, workers=4, google=False, rates=None):
+        self.workers = workers
+        self.services = [svc for svc in SERVICES if google or svc != 'google']
+        rates = rates or {}
+        self.limiters = dict((svc, RateLimiter(rates.get(svc))) for svc in self.services)
+        self.counts = dict((svc, {'cached': 0, 'computed': 0, 'errors': 0, 'seconds': 0.0}) for svc in self.services)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _queries(self):
+        if not hasattr(self._local, 'queries'):
+            queries = {'lvg': VariantLVGCached(GRANULAR_CACHE),
+                       'clinvar': ClinvarCachedQuery(granular=GRANULAR_CACHE),
+                       'pubtator': PubtatorCachedQuery(granular=GRANULAR_CACHE),
+                       }
+            if 'google' in self.services:
+                from .googlequery import GoogleCachedQuery
+                queries['google'] = GoogleCachedQuery(granular=GRANULAR_CACHE)
+            self._local.queries = queries
+        return self._local.queries
+
+    def _count(self, svc, outcome, seconds):
+        with self._lock:
+            self.counts[svc][outcome] += 1
+            self.counts[svc]['seconds'] += seconds
+
+    def _warm(self, svc, cache, querydict, compute, store_granular=None):
+        """ Looks querydict up in cache and, on a miss, computes and stores it (one cache lookup either
+        way, via retrieve_or_compute).  Only misses wait on the service's RateLimiter.
+
+        :param compute: function taking no arguments that computes the value (uncached)
+        :param store_granular: optional function called with a newly computed value when the cache is granular
+        :return: the value, or None if it could not be looked up or computed
+        """
+        limiter = self.limiters[svc]
+
+        def limited_compute():
+            limiter.wait()
+            return compute()
+
+        start = time.time()
+        try:
+            value, from_cache = cache.retrieve_or_compute(querydict, limited_compute)
+            if value and not from_cache and store_granular and cache.granular:
+                store_granular(value)
+        except Exception as error:
+            log.info('[%s] %s: %r', querydict, svc, error)
+            self._count(svc, 'errors', time.time() - start)
+            return None
+        self._count(svc, 'cached' if from_cache else 'computed', time.time() - start)
+        return value
+
+    def warm_one(self, hgvs_text):
+        """ Warms every service's cache for hgvs_text; errors are counted, not raised.
+
+        :param hgvs_text: hgvs string
+        :return: (bool) whether an LVG object could be made for hgvs_text
+        """
+        queries = self._queries()
+        lvg = queries['lvg']
+        lex = self._warm('lvg', lvg, hgvs_text, lambda: lvg.create_lvg(hgvs_text), lvg.store_granular)
+        if lex is None:
+            return False
+
+        for svc, lex_to_pmid in [('clinvar', clinvar_lex_to_pmid), ('pubtator', pubtator_lex_to_pmid)]:
+            cache = queries[svc]
+            self._warm(svc, cache, lex, lambda: lex_to_pmid(lex), lambda result: cache.store_granular(lex, result))
+
+        if 'google' in queries:
+            from .googlequery import GoogleCSEngine, parse_cse_items
+            google = queries['google']
+            try:
+                gcse = GoogleCSEngine(lex)
+                qstring = google.build_qstring(lex, gcse=gcse)
+            except Exception as error:
+                log.info('[%s] google: %r', hgvs_text, error)
+                self._count('google', 'errors', 0)
+            else:
+                self._warm('google', google, qstring, lambda: gcse.send_query(qstring),
+                           lambda result: google.store_granular(lex.hgvs_text, parse_cse_items(result)))
+        return True
+
+    def run(self, hgvs_texts, progress_every=100):
+        """ Warms caches for all hgvs_texts and returns a throughput report.
+
+        :param hgvs_texts: list of hgvs strings (duplicates are skipped)
+        :param progress_every: log progress every n variants (0 to disable)
+        :return: report dictionary (see report())
+        """
+        hgvs_texts = _dedupe(hgvs_texts)
+        start = time.time()
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(self.warm_one, hgvs_texts):
+                done += 1
+                if progress_every and done % progress_every == 0:
+                    log.info('warmed %i/%i variants (%.1f/s)', done, len(hgvs_texts), done / (time.time() - start))
+        return self.report(len(hgvs_texts), time.time() - start)
+
+    def report(self, total, elapsed):
+        outd = {'variants': total,
+                'elapsed_seconds': round(elapsed, 2),
+                'variants_per_second': round(total / elapsed, 2) if elapsed else None,
+                'services': {},
+                }
+        for svc in self.services:
+            counts = self.counts[svc]
+            lookups = counts['cached'] + counts['computed'] + counts['errors']
+            outd['services'][svc] = {'cached': counts['cached'],
+                                     'computed': counts['computed'],
+                                     'errors': counts['errors'],
+                                     'computed_per_second': round(counts['computed'] / elapsed, 2) if elapsed else None,
+                                     'mean_ms': round(counts['seconds'] * 1000 / lookups, 1) if lookups else None,
+                                     }
+        return outd
+
+
+def print_report(report):
+    print()
+    print('@@@ Warmed %i variants in %.1fs (%s variants/s)' % (report['variants'], report['elapsed_seconds'],
+                                                             report['variants_per_second']))
+    print('%-10s %8s %8s %8s %12s %10s' % ('service', 'cached', 'computed', 'errors', 'computed/s', 'mean ms'))
+    for svc in SERVICES:
+        if svc not in report['services']:
+            continue
+        row = report['services'][svc]
+        print('%-10s %8i %8i %8i %12s %10s' % (svc, row['cached'], row['computed'], row['errors'],
+                                              row['computed_per_second'], row['mean_ms']))
+
+
+def main():
+    args = docopt(__doc__)
+
+    if args['--sql']:
+        hgvs_texts = read_hgvs_sql(args['--sql'], column=args['--column'])
+    else:
+        hgvs_texts = []
+        for path in args['<source>']:
+            hgvs_texts.extend(read_hgvs_file(path, column=args['--column']))
+
+    if args['--limit']:
+        hgvs_texts = hgvs_texts[:int(args['--limit'])]
+
+    if args['--prefetch']:
+        enable_gene_prefetch()
+
+    rates = dict((svc, float(args['--%s-rate' % svc])) for svc in SERVICES)
+    warmer = CacheWarmer(workers=int(args['--workers']), google=args['--google'], rates=rates)
+
+    print('@@@ Warming caches for %i HGVS strings with %i workers' % (len(hgvs_texts), warmer.workers))
+    print_report(warmer.run(hgvs_texts))
+
+
+if __name__ == '__main__':
+    main()